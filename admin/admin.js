@@ -87,13 +87,14 @@
     });
   }
 
-  // Utility to fetch data with the auth token
-  async function fetchAuth(path) {
+  // Utility to fetch with the auth token; returns the raw response
+  async function authFetch(path, extraHeaders = {}) {
     const url = API_BASE + path;
     const res = await fetch(url, {
       headers: { 
         'Authorization': 'Bearer ' + token,
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        ...extraHeaders
       }
     });
     
@@ -106,98 +107,58 @@
       throw new Error('Authentication failed');
     }
     
-    if (!res.ok) {
+    if (!res.ok && res.status !== 304) {
       const errorText = await res.text();
       throw new Error(`HTTP ${res.status}: ${errorText}`);
     }
     
+    return res;
+  }
+
+  // Utility to fetch data with the auth token
+  async function fetchAuth(path) {
+    const res = await authFetch(path);
     return res.json();
   }
 
-  async function loadData() {
+  // The dashboard shows counts plus the newest rows of each table from /admin/summary.
+  // Polls send the last ETag back, so an unchanged summary is a bodyless 304.
+  const SUMMARY_LIMIT = 25;
+  let summaryEtag = null;
+  let summaryData = null;
+
+  async function fetchSummary() {
+    const headers = summaryEtag ? { 'If-None-Match': summaryEtag } : {};
+    const res = await authFetch('/admin/summary?limit=' + SUMMARY_LIMIT, headers);
+    if (res.status === 304) return null;
+    summaryEtag = res.headers.get('ETag');
+    return res.json();
+  }
+
+  async function loadData(quiet = false) {
     try {
-      container.innerHTML = `
-        <div style="text-align: center; padding: 40px; color: var(--muted);">
-          <div style="font-size: 18px; margin-bottom: 10px;">Loading admin data...</div>
-          <div style="font-size: 14px;">Please wait while we fetch all records</div>
-        </div>
-      `;
+      if (!quiet) {
+        container.innerHTML = `
+          <div style="text-align: center; padding: 40px; color: var(--muted);">
+            <div style="font-size: 18px; margin-bottom: 10px;">Loading admin data...</div>
+            <div style="font-size: 14px;">Please wait while we fetch the latest records</div>
+          </div>
+        `;
+      }
       
-      // Fetch all admin data with error handling for each endpoint
-      const [
-        users, 
-        meals, 
-        items, 
-        transactions, 
-        messages, 
-        comments, 
-        mealprices, 
-        usageAdjustments,
-        activities
-      ] = await Promise.all([
-        fetchAuth('/admin/users').catch(e => { 
-          console.error('Users error:', e); 
-          showNotification('Failed to load users data', 'error');
-          return []; 
-        }),
-        fetchAuth('/admin/offers/meals').catch(e => { 
-          console.error('Meals error:', e); 
-          showNotification('Failed to load meal offers', 'error');
-          return []; 
-        }),
-        fetchAuth('/admin/offers/items').catch(e => { 
-          console.error('Items error:', e); 
-          showNotification('Failed to load item offers', 'error');
-          return []; 
-        }),
-        fetchAuth('/admin/transactions').catch(e => { 
-          console.error('Transactions error:', e); 
-          showNotification('Failed to load transactions', 'error');
-          return []; 
-        }),
-        fetchAuth('/admin/messages').catch(e => { 
-          console.error('Messages error:', e); 
-          showNotification('Failed to load messages', 'error');
-          return []; 
-        }),
-        fetchAuth('/admin/comments').catch(e => { 
-          console.error('Comments error:', e); 
-          showNotification('Failed to load comments', 'error');
-          return []; 
-        }),
-        fetchAuth('/admin/mealprices').catch(e => { 
-          console.error('Meal prices error:', e); 
-          showNotification('Failed to load meal prices', 'error');
-          return []; 
-        }),
-        fetchAuth('/admin/usage-adjustments').catch(e => { 
-          console.error('Usage adjustments error:', e); 
-          showNotification('Failed to load usage adjustments', 'error');
-          return []; 
-        }),
-        fetchAuth('/admin/activities').catch(e => { 
-          console.error('Activities error:', e); 
-          showNotification('Failed to load activities', 'error');
-          return []; 
-        })
-      ]);
-
-      renderTables({ 
-        users, 
-        meals, 
-        items, 
-        transactions, 
-        messages, 
-        comments, 
-        mealprices, 
-        usageAdjustments,
-        activities 
-      });
+      const data = await fetchSummary();
+      if (!data && quiet) return; // nothing changed since the last poll
+      if (data) summaryData = data;
+      renderTables(summaryData);
       
-      showNotification(`Loaded ${users.length} users, ${meals.length} meal offers, ${items.length} item offers`, 'success');
+      if (!quiet) {
+        const c = summaryData.counts;
+        showNotification(`Loaded ${c.users} users, ${c.meal_offers} meal offers, ${c.item_offers} item offers`, 'success');
+      }
       
     } catch (err) {
       console.error('Admin load error:', err);
+      if (quiet) return;
       if (container) {
         container.innerHTML = `
           <div style="color:#ef4444; padding: 40px; text-align: center; background: var(--panel); border-radius: 12px; border: 1px solid var(--border);">
@@ -213,25 +174,34 @@
     }
   }
 
+  // Full table dumps, only fetched when the admin asks for an export
+  async function fetchAllData() {
+    const paths = {
+      users: '/admin/users',
+      meals: '/admin/offers/meals',
+      items: '/admin/offers/items',
+      transactions: '/admin/transactions',
+      messages: '/admin/messages',
+      comments: '/admin/comments',
+      mealprices: '/admin/mealprices',
+      usageAdjustments: '/admin/usage-adjustments',
+      activities: '/admin/activities'
+    };
+    const out = {};
+    await Promise.all(Object.entries(paths).map(async ([key, path]) => {
+      out[key] = await fetchAuth(path).catch(e => {
+        console.error(`${key} error:`, e);
+        return [];
+      });
+    }));
+    return out;
+  }
+
   function renderTables(data) {
-    const { 
-      users, 
-      meals, 
-      items, 
-      transactions, 
-      messages, 
-      comments, 
-      mealprices, 
-      usageAdjustments,
-      activities 
-    } = data;
-    
-    // Build a map of userId -> email for cross referencing
-    const idToEmail = {};
-    users.forEach(u => { idToEmail[u.id] = u.email; });
+    const { counts, latest } = data;
 
     // Helper to build table HTML
-    function buildTable(title, headers, rows) {
+    function buildTable(title, headers, rows, total) {
       if (!rows || rows.length === 0) {
         return `
           <div class="card">
@@ -244,7 +214,8 @@
       }
       
       let html = '<div class="card">';
-      html += `<h4 class="h5">${title} <span style="color: var(--muted); font-size: 14px;">(${rows.length} records)</span></h4>`;
+      const shown = total > rows.length ? `latest ${rows.length} of ${total} records` : `${rows.length} records`;
+      html += `<h4 class="h5">${title} <span style="color: var(--muted); font-size: 14px;">(${shown})</span></h4>`;
       html += '<div class="table-scroll"><table class="table"><thead><tr>';
       headers.forEach(h => { html += `<th>${h}</th>`; });
       html += '</tr></thead><tbody>';
@@ -267,7 +238,7 @@
     let html = '';
     
     // Users
-    const userRows = users.map(u => [
+    const userRows = latest.users.map(u => [
       u.id,
       u.email,
       u.university || '-',
@@ -277,49 +248,49 @@
       u.expires_on,
       new Date(u.created_at).toLocaleString()
     ]);
-    html += buildTable('Users', ['ID','Email','University','Total Meals','Plan','Weekly Meals','Expires','Created'], userRows);
+    html += buildTable('Users', ['ID','Email','University','Total Meals','Plan','Weekly Meals','Expires','Created'], userRows, counts.users);
 
     // Meal offers
-    const mealRows = meals.map(o => [
+    const mealRows = latest.meal_offers.map(o => [
       o.id,
-      idToEmail[o.seller_id] || o.seller_id,
+      o.seller,
       o.meals,
       o.location,
       o.meal_type || 'lunch',
       `$${o.price?.toFixed(2) || '0.00'}`,
       o.status,
-      o.accepted_by_id ? (idToEmail[o.accepted_by_id] || o.accepted_by_id) : '-',
+      o.accepted_by || '-',
       new Date(o.created_at).toLocaleString()
     ]);
-    html += buildTable('Meal Offers', ['ID','Seller','Meals','Location','Type','Price','Status','Accepted By','Posted'], mealRows);
+    html += buildTable('Meal Offers', ['ID','Seller','Meals','Location','Type','Price','Status','Accepted By','Posted'], mealRows, counts.meal_offers);
 
     // Item offers
-    const itemRows = items.map(it => [
+    const itemRows = latest.item_offers.map(it => [
       it.id,
-      idToEmail[it.seller_id] || it.seller_id,
+      it.seller,
       it.name,
       it.category,
       `$${it.price?.toFixed(2) || '0.00'}`,
-      `${it.discount || 0}%`,
+      `${it.baseline ? Math.max(0, Math.round((1 - it.price / it.baseline) * 100)) : 0}%`,
       it.status,
-      it.accepted_by_id ? (idToEmail[it.accepted_by_id] || it.accepted_by_id) : '-',
+      it.accepted_by || '-',
       new Date(it.created_at).toLocaleString()
     ]);
-    html += buildTable('Item Offers', ['ID','Seller','Name','Category','Price','Discount','Status','Accepted By','Posted'], itemRows);
+    html += buildTable('Item Offers', ['ID','Seller','Name','Category','Price','Discount','Status','Accepted By','Posted'], itemRows, counts.item_offers);
 
     // Transactions
-    const txnRows = transactions.map(t => [
+    const txnRows = latest.transactions.map(t => [
       t.id,
       t.kind,
       t.listing_id,
-      idToEmail[t.seller_id] || t.seller_id,
-      idToEmail[t.buyer_id] || t.buyer_id,
+      t.seller,
+      t.buyer,
       new Date(t.created_at).toLocaleString()
     ]);
-    html += buildTable('Transactions', ['ID','Kind','Listing','Seller','Buyer','Created'], txnRows);
+    html += buildTable('Transactions', ['ID','Kind','Listing','Seller','Buyer','Created'], txnRows, counts.transactions);
 
     // Messages
-    const msgRows = messages.map(m => [
+    const msgRows = latest.messages.map(m => [
       m.id,
       m.thread_id || '-',
       m.kind || '-',
@@ -328,47 +299,47 @@
       m.body ? (m.body.length > 50 ? m.body.substring(0, 50) + '...' : m.body) : '-',
       new Date(m.created_at).toLocaleString()
     ]);
-    html += buildTable('Messages', ['ID','Thread','Kind','Listing','From','Message','When'], msgRows);
+    html += buildTable('Messages', ['ID','Thread','Kind','Listing','From','Message','When'], msgRows, counts.messages);
 
     // Comments
-    const commentRows = comments.map(c => [
+    const commentRows = latest.comments.map(c => [
       c.id,
-      c.user_id ? (idToEmail[c.user_id] || c.user_id) : 'Anonymous',
+      c.user || 'Anonymous',
       c.university || '-',
       c.body ? (c.body.length > 50 ? c.body.substring(0, 50) + '...' : c.body) : '-',
       new Date(c.created_at).toLocaleString()
     ]);
-    html += buildTable('Comments', ['ID','User','University','Comment','When'], commentRows);
+    html += buildTable('Comments', ['ID','User','University','Comment','When'], commentRows, counts.comments);
 
     // Meal prices
-    const priceRows = mealprices.map(mp => [
+    const priceRows = latest.meal_prices.map(mp => [
       mp.id,
       mp.university,
       mp.meal_type,
       `$${mp.price?.toFixed(2) || '0.00'}`,
       new Date(mp.created_at).toLocaleString()
     ]);
-    html += buildTable('Meal Prices', ['ID','University','Type','Price','Created'], priceRows);
+    html += buildTable('Meal Prices', ['ID','University','Type','Price','Created'], priceRows, counts.meal_prices);
 
     // Usage adjustments
-    const usageRows = usageAdjustments.map(u => [
+    const usageRows = latest.usage_adjustments.map(u => [
       u.id,
-      idToEmail[u.user_id] || u.user_id,
+      u.user,
       u.meals_used_delta,
       u.note || '-',
       new Date(u.created_at).toLocaleString()
     ]);
-    html += buildTable('Usage Adjustments', ['ID','User','Delta','Note','When'], usageRows);
+    html += buildTable('Usage Adjustments', ['ID','User','Delta','Note','When'], usageRows, counts.usage_adjustments);
 
     // Activities
-    const activityRows = activities.map(a => [
+    const activityRows = latest.activities.map(a => [
       a.id,
-      idToEmail[a.user_id] || a.user_id || 'System',
+      a.user || 'System',
       a.action,
       a.details ? (a.details.length > 50 ? a.details.substring(0, 50) + '...' : a.details) : '-',
       new Date(a.created_at).toLocaleString()
     ]);
-    html += buildTable('Activities', ['ID','User','Action','Details','When'], activityRows);
+    html += buildTable('Activities', ['ID','User','Action','Details','When'], activityRows, counts.activities);
 
     // Meal price form card
     html += `
@@ -480,19 +451,13 @@
     // Export button handler
     const exportBtn = document.getElementById('exportData');
     if (exportBtn) {
-      exportBtn.addEventListener('click', () => {
+      exportBtn.addEventListener('click', async () => {
+        exportBtn.disabled = true;
         const exportData = {
           timestamp: new Date().toISOString(),
-          users,
-          meals,
-          items,
-          transactions,
-          messages,
-          comments,
-          mealprices,
-          usageAdjustments,
-          activities
+          ...(await fetchAllData())
         };
+        exportBtn.disabled = false;
         
         const blob = new Blob([JSON.stringify(exportData, null, 2)], { type: 'application/json' });
         const url = URL.createObjectURL(blob);
@@ -512,10 +477,10 @@
   // Load data when page loads
   loadData();
 
-  // Auto-refresh every 5 minutes
+  // Auto-refresh every 30 seconds; unchanged polls are answered with 304
   setInterval(() => {
     if (document.visibilityState === 'visible') {
-      loadData();
+      loadData(true);
     }
-  }, 300000);
+  }, 30000);
 })();
\ No newline at end of file
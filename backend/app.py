@@ -1,49 +1,68 @@
+import hashlib
+import json
+import math
 import os
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, timezone
+from contextlib import asynccontextmanager
 from typing import List
-from fastapi import FastAPI, Depends, HTTPException, Header, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, Header, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from db import SessionLocal, Base, engine
-from models import User, MealOffer, ItemOffer, OfferStatus, Transaction, Thread, Message, UsageAdjustment, MealPrice, Comment, Activity
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import and_, case, event, func, insert, literal, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+from db import SessionLocal, AsyncSessionLocal, engine, pool_waits, dialect_insert
+# schemas first: its OfferStatus must not shadow the ORM enum compared against below
 from schemas import *
-from auth import hash_password, verify_password, make_token, parse_token
-from ws import hub
-
-Base.metadata.create_all(bind=engine)
-
-def create_admin_user():
-    from auth import hash_password
-    session = SessionLocal()
-    try:
-        # Check if admin user already exists
-        admin_user = session.query(User).filter_by(email="admin@dinemarketplace.com").first()
-        if not admin_user:
-            admin_user = User(
-                email="admin@dinemarketplace.com",
-                password_hash=hash_password("admin123"),
-                university="Admin",
-                total_meals=0,
-                expires_on=date.today(),
-                meal_distribution="semester",
-                weekly_meals=0
-            )
-            session.add(admin_user)
-            session.commit()
-            print("Admin user created successfully")
-    except Exception as e:
-        print(f"Error creating admin user: {e}")
-        session.rollback()
-    finally:
-        session.close()
-
-# Call this function after database creation
-create_admin_user()
-
-app = FastAPI()
-
+from models import User, MealOffer, ItemOffer, OfferStatus, Transaction, Thread, ThreadRead, Message, UsageAdjustment, UsageWeek, UsageTotal, MealPrice, Comment, Activity
+from auth import ahash_password, averify_and_update, HashBusy, make_token, parse_claims, Principal, user_cache, forget_user
+from cache import TTLCache, caches
+from ws import hub, campus_room
+from pagination import seek_before, decode_cursor, next_cursor, encode_cursor, encode_offset, decode_offset
+import expiry
+import limits
+import manage
+import metrics
+import prices
+import search
+import summary
+import usage
+from export import MEDIA_TYPES, discount, stream_rows
+from fastjson import rows_response
+from images import ImageError, decode_data_url, store_image, get_blob, sniff_type, image_url
+
+# Migrations and admin seeding run when the server starts, not at import. Deployments that
+# run `python manage.py init` on release can set STARTUP_MIGRATE=0 to keep cold starts lean.
+STARTUP_MIGRATE = os.getenv("STARTUP_MIGRATE", "1") != "0"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if STARTUP_MIGRATE:
+        manage.init()
+    sweeper = expiry.start()
+    yield
+    if sweeper:
+        sweeper.cancel()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.exception_handler(HashBusy)
+def hash_busy(request, exc):
+    # Password hashing is saturated; shed the request quickly and let the client retry
+    return JSONResponse({"detail": "Too many login attempts, try again shortly"}, status_code=503, headers={"Retry-After": "1"})
+
+@app.exception_handler(limits.RateLimited)
+def rate_limited(request, exc):
+    return JSONResponse({"detail": "Too many requests, slow down"}, status_code=429,
+                        headers={"Retry-After": str(math.ceil(exc.retry_after))})
+
+# Innermost of the three, so shed requests still get CORS headers and are counted in /metrics
+app.add_middleware(limits.AdmissionMiddleware)
 origins = os.getenv("CORS_ORIGINS", "http://localhost:5173,http://localhost:5500,http://127.0.0.1:5500").split(",")
-app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"], expose_headers=["X-Next-Cursor", "X-Latest-Cursor", "ETag"])
+# Outermost, so latency covers CORS and error handling and every status is counted
+app.add_middleware(metrics.MetricsMiddleware)
 
 def db():
     s = SessionLocal()
@@ -52,29 +71,117 @@ def db():
     finally:
         s.close()
 
-def authed(authorization: str = Header(None), session: Session = Depends(db)) -> User:
+async def adb():
+    async with AsyncSessionLocal() as s:
+        yield s
+
+async def authed(authorization: str = Header(None), session: AsyncSession = Depends(adb)) -> Principal:
+    """Resolve the bearer token to a cached Principal snapshot; the DB is only hit on a cache miss."""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing token")
-    token = authorization.split(" ", 1)[1].strip()
+    return await principal_for_token(authorization.split(" ", 1)[1].strip(), session)
+
+async def principal_for_token(token: str, session: AsyncSession) -> Principal:
     try:
-        email = parse_token(token)
+        claims = parse_claims(token)
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid token")
-    user = session.query(User).filter_by(email=email).first()
-    if not user:
+    uid = claims.get("uid")
+    principal = user_cache.get(uid) if uid is not None else None
+    if principal is None:
+        # Tokens issued before uid was added only carry the email
+        q = select(User).filter_by(id=uid) if uid is not None else select(User).filter_by(email=claims["sub"])
+        user = (await session.execute(q)).scalars().first()
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        principal = Principal.from_user(user)
+        user_cache.set(user.id, principal)
+    if principal.email != claims["sub"]:
         raise HTTPException(status_code=401, detail="User not found")
-    return user
+    return principal
+
+# Registered on Session itself so the sync sessions behind AsyncSession are covered too
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    changed = {o.id for o in list(session.dirty) + list(session.deleted) if isinstance(o, User)}
+    if changed:
+        session.info.setdefault("changed_users", set()).update(changed)
+        for uid in changed:
+            forget_user(uid)
+
+@event.listens_for(Session, "after_commit")
+def _forget_changed_users(session):
+    # Forget again after commit in case a concurrent request re-cached the old row meanwhile
+    for uid in session.info.pop("changed_users", ()):
+        forget_user(uid)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_users(session):
+    session.info.pop("changed_users", None)
+
+def ip_write_limit(request: Request):
+    limits.ip_writes.check(limits.client_ip(request))
+
+async def write_limit(request: Request, user: Principal = Depends(authed)):
+    """Per-user and per-IP token buckets for write routes; an empty bucket answers 429."""
+    # The user's own bucket first, so a user over their limit cannot drain a shared (campus NAT) IP bucket
+    limits.user_writes.check(user.id)
+    try:
+        limits.ip_writes.check(limits.client_ip(request))
+    except limits.RateLimited:
+        limits.user_writes.refund(user.id)
+        raise
 
 def admin_required(user: User = Depends(authed)):
     """Check if user is admin"""
-    if user.email != "admin@dinemarketplace.com":
+    if user.email != manage.ADMIN_EMAIL:
         raise HTTPException(status_code=403, detail="Admin access required")
     return user
 
-@app.post("/auth/signup", response_model=UserOut)
-def signup(p: AuthSignup, session: Session = Depends(db)):
-    if session.query(User).filter_by(email=p.email).first():
+@app.get("/admin/caches")
+def admin_caches(user: User = Depends(admin_required)):
+    """Size and hit/miss counters for the in-process caches."""
+    return {name: c.stats() for name, c in caches.items()}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_text(authorization: str = Header(None)):
+    """Prometheus scrape target for this worker. Set METRICS_TOKEN to require it as a bearer token."""
+    if metrics.METRICS_TOKEN and authorization != f"Bearer {metrics.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/summary")
+def admin_summary(limit: int = Query(10, ge=1, le=100), if_none_match: str | None = Header(None),
+                  user: User = Depends(admin_required), session: Session = Depends(db)):
+    """Table counts and the newest `limit` rows of each admin table. Poll with If-None-Match;
+    an unchanged summary answers 304 after reading only the counters."""
+    values = summary.stored(session)
+    etag = summary.etag(values, limit)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    cached_etag, body = summary.bodies.get(limit, (None, None))
+    if cached_etag != etag:
+        body = jsonable_encoder({"counts": summary.counts(session, values), "latest": summary.latest(session, limit)})
+        summary.bodies[limit] = (etag, body)
+    return JSONResponse(body, headers=headers)
+
+@app.get("/admin/db-pool")
+def admin_db_pool(user: User = Depends(admin_required)):
+    """Connection pool occupancy and checkout-wait distribution, for sizing DB_POOL_SIZE."""
+    pool = engine.pool
+    out = {"status": pool.status(), **pool_waits.snapshot()}
+    if hasattr(pool, "checkedout"):
+        out.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    return out
+
+@app.post("/auth/signup", response_model=UserOut, dependencies=[Depends(ip_write_limit)])
+async def signup(p: AuthSignup, session: AsyncSession = Depends(adb)):
+    if (await session.execute(select(User.id).where(User.email == p.email))).first():
         raise HTTPException(400, "Email exists")
+    # Hand the connection back to the pool while bcrypt runs
+    await session.close()
+    password_hash = await ahash_password(p.password)
     # On sign‑up capture meal distribution and optional weekly meals.
     # For weekly plans, if weekly_meals isn't provided, default to evenly dividing total meals across the term (16 weeks).
     meal_dist = p.meal_distribution or "semester"
@@ -82,20 +189,29 @@ def signup(p: AuthSignup, session: Session = Depends(db)):
     if meal_dist == "weekly" and not weekly:
         # Default weekly allotment: total meals divided by 16 weeks (approx. 112 days / 7)
         weekly = max(0, round(p.total_meals / 16))
-    u = User(email=p.email, password_hash=hash_password(p.password), university=p.university,
+    u = User(email=p.email, password_hash=password_hash, university=p.university,
              total_meals=p.total_meals, expires_on=p.expires_on,
              meal_distribution=meal_dist, weekly_meals=weekly)
     session.add(u)
-    session.commit()
-    session.refresh(u)
+    await session.commit()
+    await session.refresh(u)
     return u
 
 @app.post("/auth/login")
-def login(p: AuthLogin, session: Session = Depends(db)):
-    u = session.query(User).filter_by(email=p.email).first()
-    if not u or not verify_password(p.password, u.password_hash):
+async def login(p: AuthLogin, session: AsyncSession = Depends(adb)):
+    u = (await session.execute(select(User.id, User.email, User.password_hash).where(User.email == p.email))).first()
+    if not u:
         raise HTTPException(401, "Invalid credentials")
-    token = make_token(u.email, p.remember)
+    uid, email, hashed = u
+    # Hand the connection back to the pool while bcrypt runs
+    await session.close()
+    ok, new_hash = await averify_and_update(p.password, hashed)
+    if not ok:
+        raise HTTPException(401, "Invalid credentials")
+    if new_hash:
+        await session.execute(update(User).where(User.id == uid).values(password_hash=new_hash))
+        await session.commit()
+    token = make_token(email, p.remember, uid=uid)
     return {"token": token}
 
 @app.get("/me", response_model=UserOut)
@@ -103,7 +219,7 @@ def me(user: User = Depends(authed)):
     return user
 
 @app.get("/stats", response_model=StatsOut)
-def stats(user: User = Depends(authed), session: Session = Depends(db)):
+async def stats(user: User = Depends(authed), session: AsyncSession = Depends(adb)):
     # Determine number of days left in the current term and compute usage accordingly.
     dleft = max(0, (user.expires_on - date.today()).days)
     # Base metrics depend on whether meals are distributed for the semester or weekly.
@@ -115,15 +231,13 @@ def stats(user: User = Depends(authed), session: Session = Depends(db)):
         week_end = week_start + timedelta(days=7)
         # Total allowed meals this week
         weekly_total = user.weekly_meals
-        # Sum adjustments within current week (negative deltas represent meals used)
-        adj = session.query(UsageAdjustment).filter(UsageAdjustment.user_id == user.id, UsageAdjustment.at >= week_start, UsageAdjustment.at < week_end).all()
-        used_total = -sum(a.meals_used_delta for a in adj if a.meals_used_delta < 0)
+        # Meals used this week and last week come from the weekly rollups (negative deltas represent meals used)
+        last_week_start = week_start - timedelta(days=7)
+        used_by_week = dict((await session.execute(select(UsageWeek.week_start, UsageWeek.used).where(UsageWeek.user_id == user.id, UsageWeek.week_start.in_([week_start, last_week_start])))).all())
+        used_total = used_by_week.get(week_start, 0)
         remaining = max(0, weekly_total - used_total)
         # For weekly plan, usage trend compares this week's used meals vs last week's used meals
-        last_week_start = week_start - timedelta(days=7)
-        last_week_end = week_start
-        adj_last = session.query(UsageAdjustment).filter(UsageAdjustment.user_id == user.id, UsageAdjustment.at >= last_week_start, UsageAdjustment.at < last_week_end).all()
-        used_last_week = -sum(a.meals_used_delta for a in adj_last if a.meals_used_delta < 0)
+        used_last_week = used_by_week.get(last_week_start, 0)
         this_week = used_total
         last_week = used_last_week
         trend = 0 if last_week == 0 else round(((this_week - last_week) / last_week) * 100)
@@ -138,8 +252,7 @@ def stats(user: User = Depends(authed), session: Session = Depends(db)):
         if user.total_meals > 0 and dleft >= 0:
             elapsed = min(term_days, max(0, term_days - dleft))
             used_total = round(user.total_meals * (elapsed / term_days))
-        adj = session.query(UsageAdjustment).filter_by(user_id=user.id).all()
-        adj_used = sum(a.meals_used_delta for a in adj)
+        adj_used = (await session.execute(select(UsageTotal.net_delta).where(UsageTotal.user_id == user.id))).scalar() or 0
         used_total = max(0, used_total + adj_used)
         remaining = max(0, user.total_meals - used_total)
         avg_per_day = user.total_meals / term_days if user.total_meals > 0 else 0
@@ -149,136 +262,138 @@ def stats(user: User = Depends(authed), session: Session = Depends(db)):
         waste = 0 if dleft <= 0 else max(0, min(100, round((remaining / max(1, dleft)) * 8)))
         return {"remaining": remaining, "used_total": used_total, "used_this_week": this_week, "used_last_week": last_week, "trend_pct": trend, "waste_pct": waste, "days_left": dleft}
 
-@app.post("/usage/adjust")
+@app.post("/usage/adjust", dependencies=[Depends(write_limit)])
 def usage_adjust(p: UsageAdjustIn, user: User = Depends(authed), session: Session = Depends(db)):
-    r = UsageAdjustment(user_id=user.id, meals_used_delta=p.meals_used_delta, note=p.note or "")
+    now = datetime.now(timezone.utc)
+    r = UsageAdjustment(user_id=user.id, meals_used_delta=p.meals_used_delta, note=p.note or "", at=now)
     session.add(r)
+    usage.bump(session, user.id, now, [p.meals_used_delta])
     session.commit()
     return {"ok": True}
 
+@app.post("/usage/adjust/batch", dependencies=[Depends(write_limit)])
+def usage_adjust_batch(p: UsageAdjustBatchIn, user: User = Depends(authed), session: Session = Depends(db)):
+    """Record adjustments queued on the client, in one transaction. Each keeps its client timestamp
+    (future ones are clamped to now); an entry whose `key` was already recorded is skipped, so a
+    batch can be retried safely."""
+    now = datetime.now(timezone.utc)
+    rows, seen = [], set()
+    for a in p.adjustments:
+        if a.key is not None:
+            if a.key in seen:
+                continue
+            seen.add(a.key)
+        at = a.at.astimezone(timezone.utc) if a.at and a.at.tzinfo else (a.at or now).replace(tzinfo=timezone.utc)
+        rows.append({"user_id": user.id, "meals_used_delta": a.meals_used_delta, "note": a.note or "",
+                     "at": min(at, now), "client_key": a.key})
+    # One executemany; keys already on record are skipped by the unique index and not returned
+    stmt = (dialect_insert(session.bind)(UsageAdjustment)
+            .on_conflict_do_nothing(index_elements=["user_id", "client_key"]).returning(UsageAdjustment.client_key))
+    inserted = {k for (k,) in session.execute(stmt, rows)}
+    recorded = [r for r in rows if r["client_key"] is None or r["client_key"] in inserted]
+    # Core inserts bypass the flush hooks that count rows; the rollups take one upsert per table
+    usage.bump_many(session, user.id, [(r["at"], r["meals_used_delta"]) for r in recorded])
+    summary.record(session, {"usage_adjustments": len(recorded)})
+    session.commit()
+    return {"ok": True, "recorded": len(recorded), "duplicates": len(p.adjustments) - len(recorded)}
+
+# Public, read-mostly responses (/mealprices, /comments) are cached serialized, keyed by
+# (endpoint, university). Writes invalidate every worker's copy through the hub; the ETag is a
+# hash of the body, so browsers and the CDN revalidate with a cheap 304.
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+response_cache = TTLCache("responses", maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+RESPONSE_CACHE_ROOM = "cache:responses"
+hub.on(RESPONSE_CACHE_ROOM, lambda text: response_cache.discard_where(lambda key, _: key[0] == json.loads(text)["endpoint"]))
+
+def invalidate_responses(endpoint: str):
+    hub.publish(RESPONSE_CACHE_ROOM, {"endpoint": endpoint})
+
+def cached_response(key: tuple, if_none_match: str | None, build) -> Response:
+    entry = response_cache.get(key)
+    if entry is None:
+        generation = response_cache.generation
+        body = json.dumps(jsonable_encoder(build())).encode()
+        entry = (body, '"' + hashlib.sha1(body).hexdigest()[:20] + '"')
+        response_cache.set(key, entry, if_generation=generation)
+    body, etag = entry
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=0, must-revalidate"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 # Comments API
-@app.post("/comments", response_model=CommentOut)
+@app.post("/comments", response_model=CommentOut, dependencies=[Depends(write_limit)])
 def create_comment(p: CommentIn, user: User = Depends(authed), session: Session = Depends(db)):
     """Allow an authenticated user to post a comment. Comments can optionally specify a university."""
-    from .models import Comment
     comment = Comment(user_id=user.id, university=p.university or user.university, body=p.body)
     session.add(comment)
     session.commit()
     session.refresh(comment)
+    invalidate_responses("comments")
     return comment
 
 @app.get("/comments", response_model=List[CommentOut])
-def list_comments(university: str | None = None, session: Session = Depends(db)):
+def list_comments(university: str | None = None, if_none_match: str | None = Header(None), session: Session = Depends(db)):
     """Return latest 100 comments. Optionally filter by university."""
-    from .models import Comment
-    query = session.query(Comment)
-    if university:
-        query = query.filter(Comment.university == university)
-    rows = query.order_by(Comment.created_at.desc()).limit(100).all()
-    return rows
+    def build():
+        query = session.query(Comment)
+        if university:
+            query = query.filter(Comment.university == university)
+        rows = query.order_by(Comment.created_at.desc()).limit(100).all()
+        return [CommentOut.model_validate(c) for c in rows]
+    return cached_response(("comments", university), if_none_match, build)
 
 # Admin endpoints
 @app.get("/admin/users")
 def admin_users(user: User = Depends(admin_required), session: Session = Depends(db)):
     """Return basic information about all users."""
-    rows = session.query(User).all()
-    return [{
-        "id": u.id,
-        "email": u.email,
-        "university": u.university,
-        "total_meals": u.total_meals,
-        "meal_distribution": u.meal_distribution,
-        "weekly_meals": u.weekly_meals,
-        "expires_on": u.expires_on,
-        "created_at": u.created_at
-    } for u in rows]
+    rows = session.execute(select(User.id, User.email, User.university, User.total_meals, User.meal_distribution,
+                                  User.weekly_meals, User.expires_on, User.created_at)).all()
+    return rows_response([r._asdict() for r in rows])
 
 @app.get("/admin/offers/meals")
 def admin_meal_offers(user: User = Depends(admin_required), session: Session = Depends(db)):
     """Return all meal offers."""
-    rows = session.query(MealOffer).all()
-    out = []
-    for o in rows:
-        out.append({
-            "id": o.id,
-            "seller_id": o.seller_id,
-            "meals": o.meals,
-            "location": o.location,
-            "price": o.price,
-            "meal_type": o.meal_type,
-            "status": o.status.value,
-            "accepted_by_id": o.accepted_by_id,
-            "created_at": o.created_at
-        })
-    return out
+    rows = session.execute(select(MealOffer.id, MealOffer.seller_id, MealOffer.meals, MealOffer.location, MealOffer.price,
+                                  MealOffer.meal_type, MealOffer.status, MealOffer.accepted_by_id, MealOffer.created_at)).all()
+    return rows_response([r._asdict() for r in rows])
 
 @app.get("/admin/offers/items")
 def admin_item_offers(user: User = Depends(admin_required), session: Session = Depends(db)):
     """Return all item offers."""
-    rows = session.query(ItemOffer).all()
-    out = []
-    for it in rows:
-        discount = 0 if not it.baseline else max(0, round((1 - it.price / it.baseline) * 100))
-        out.append({
-            "id": it.id,
-            "seller_id": it.seller_id,
-            "name": it.name,
-            "category": it.category,
-            "price": it.price,
-            "discount": discount,
-            "status": it.status.value,
-            "accepted_by_id": it.accepted_by_id,
-            "created_at": it.created_at
-        })
-    return out
+    rows = session.execute(select(ItemOffer.id, ItemOffer.seller_id, ItemOffer.name, ItemOffer.category, ItemOffer.price,
+                                  ItemOffer.baseline, ItemOffer.status, ItemOffer.accepted_by_id, ItemOffer.created_at)).all()
+    return rows_response([{"id": r.id, "seller_id": r.seller_id, "name": r.name, "category": r.category, "price": r.price,
+                           "discount": discount(r), "status": r.status, "accepted_by_id": r.accepted_by_id,
+                           "created_at": r.created_at} for r in rows])
 
 @app.get("/admin/comments")
 def admin_comments(user: User = Depends(admin_required), session: Session = Depends(db)):
     """Return all comments."""
-    from .models import Comment
-    rows = session.query(Comment).order_by(Comment.created_at.desc()).limit(500).all()
-    return [{
-        "id": c.id,
-        "user_id": c.user_id,
-        "university": c.university,
-        "body": c.body,
-        "created_at": c.created_at
-    } for c in rows]
+    rows = session.execute(select(Comment.id, Comment.user_id, Comment.university, Comment.body, Comment.created_at)
+                           .order_by(Comment.created_at.desc()).limit(500)).all()
+    return rows_response([r._asdict() for r in rows])
 
 # Admin transactions endpoint
 @app.get("/admin/transactions")
 def admin_transactions(user: User = Depends(admin_required), session: Session = Depends(db)):
     """Return all transactions."""
-    rows = session.query(Transaction).order_by(Transaction.created_at.desc()).all()
-    out = []
-    for t in rows:
-        out.append({
-            "id": t.id,
-            "kind": t.kind,
-            "listing_id": t.listing_id,
-            "seller_id": t.seller_id,
-            "buyer_id": t.buyer_id,
-            "created_at": t.created_at
-        })
-    return out
+    rows = session.execute(select(Transaction.id, Transaction.kind, Transaction.listing_id, Transaction.seller_id,
+                                  Transaction.buyer_id, Transaction.created_at).order_by(Transaction.created_at.desc())).all()
+    return rows_response([r._asdict() for r in rows])
 
 # Admin messages endpoint
 @app.get("/admin/messages")
 def admin_messages(user: User = Depends(admin_required), session: Session = Depends(db)):
     """Return all messages with sender email and thread info."""
-    rows = session.query(Message, User.email, Thread.kind, Thread.listing_id).join(User, Message.sender_id == User.id).join(Thread, Message.thread_id == Thread.id).order_by(Message.created_at.desc()).limit(1000).all()
-    out = []
-    for m, email, kind, listing_id in rows:
-        out.append({
-            "id": m.id,
-            "thread_id": m.thread_id,
-            "from_email": email or "",
-            "kind": kind,
-            "listing_id": listing_id,
-            "body": m.body,
-            "created_at": m.created_at
-        })
-    return out
+    rows = session.execute(
+        select(Message.id, Message.thread_id, User.email.label("from_email"), Thread.kind,
+               Thread.listing_id, Message.body, Message.created_at)
+        .join(User, Message.sender_id == User.id).join(Thread, Message.thread_id == Thread.id)
+        .order_by(Message.created_at.desc()).limit(1000)
+    ).all()
+    return rows_response([r._asdict() for r in rows])
 
 # Usage adjustments for admins
 @app.get("/admin/usage-adjustments")
@@ -288,30 +403,67 @@ def admin_usage_adjustments(user: User = Depends(admin_required), session: Sessi
     deducted (negative values indicate usage), optional note, and timestamp. This allows administrators
     to audit meal deduction logs and monitor usage trends.
     """
-    rows = session.query(UsageAdjustment).order_by(UsageAdjustment.at.desc()).all()
-    out = []
-    for ua in rows:
-        out.append({
-            "id": ua.id,
-            "user_id": ua.user_id,
-            "meals_used_delta": ua.meals_used_delta,
-            "note": ua.note,
-            "created_at": ua.at
-        })
-    return out
+    rows = session.execute(select(UsageAdjustment.id, UsageAdjustment.user_id, UsageAdjustment.meals_used_delta,
+                                  UsageAdjustment.note, UsageAdjustment.at.label("created_at"))
+                           .order_by(UsageAdjustment.at.desc())).all()
+    return rows_response([r._asdict() for r in rows])
+
+# Streaming exports of the admin tables above. `since`/`until` bound the row timestamp and
+# `after_id` resumes after the last id of a previous export; rows come in id order.
+
+def export_response(name: str, format: str, since: datetime | None, until: datetime | None,
+                    after_id: int | None, limit: int | None):
+    filename = f"{name}.{'csv' if format == 'csv' else 'ndjson'}"
+    return StreamingResponse(
+        stream_rows(name, format, since=since, until=until, after_id=after_id, limit=limit),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/admin/users/export")
+def admin_users_export(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), since: datetime | None = None,
+                       until: datetime | None = None, after_id: int | None = None, limit: int | None = Query(None, ge=1),
+                       user: User = Depends(admin_required)):
+    return export_response("users", format, since, until, after_id, limit)
+
+@app.get("/admin/offers/meals/export")
+def admin_meal_offers_export(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), since: datetime | None = None,
+                             until: datetime | None = None, after_id: int | None = None, limit: int | None = Query(None, ge=1),
+                             user: User = Depends(admin_required)):
+    return export_response("meal-offers", format, since, until, after_id, limit)
+
+@app.get("/admin/offers/items/export")
+def admin_item_offers_export(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), since: datetime | None = None,
+                             until: datetime | None = None, after_id: int | None = None, limit: int | None = Query(None, ge=1),
+                             user: User = Depends(admin_required)):
+    return export_response("item-offers", format, since, until, after_id, limit)
+
+@app.get("/admin/transactions/export")
+def admin_transactions_export(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), since: datetime | None = None,
+                              until: datetime | None = None, after_id: int | None = None, limit: int | None = Query(None, ge=1),
+                              user: User = Depends(admin_required)):
+    return export_response("transactions", format, since, until, after_id, limit)
+
+@app.get("/admin/usage-adjustments/export")
+def admin_usage_adjustments_export(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), since: datetime | None = None,
+                                   until: datetime | None = None, after_id: int | None = None, limit: int | None = Query(None, ge=1),
+                                   user: User = Depends(admin_required)):
+    return export_response("usage-adjustments", format, since, until, after_id, limit)
 
 # Meal Prices APIs
 
 @app.get("/mealprices", response_model=List[MealPriceOut])
-def get_meal_prices(university: str | None = None, session: Session = Depends(db)):
+def get_meal_prices(university: str | None = None, if_none_match: str | None = Header(None), session: Session = Depends(db)):
     """
     Return meal price definitions. If a university is provided, only prices for that campus are returned.
     This endpoint does not require admin privileges.
     """
-    q = session.query(MealPrice)
-    if university:
-        q = q.filter(MealPrice.university == university)
-    return q.all()
+    def build():
+        q = session.query(MealPrice)
+        if university:
+            q = q.filter(MealPrice.university == university)
+        return [MealPriceOut.model_validate(mp) for mp in q.all()]
+    return cached_response(("mealprices", university), if_none_match, build)
 
 @app.get("/admin/mealprices")
 def admin_meal_prices(user: User = Depends(admin_required), university: str | None = None, session: Session = Depends(db)):
@@ -344,16 +496,100 @@ def upsert_meal_price(p: MealPriceIn, user: User = Depends(admin_required), sess
         session.add(mp)
     session.commit()
     session.refresh(mp)
+    invalidate_responses("mealprices")
+    prices.changed()
     return mp
 
+def publish_offer_event(university: str, event: str, kind: str, offer_id: int, offer: dict | None = None):
+    """Push an offer change to sockets on the seller's campus, e.g. {"type": "offer.created", "kind": "meal", ...}."""
+    msg = {"type": f"offer.{event}", "kind": kind, "id": offer_id}
+    if offer is not None:
+        msg["offer"] = jsonable_encoder(offer)
+    hub.publish(campus_room(university), msg)
+
+async def accept_offer(session: AsyncSession, model, kind: str, offer_id: int, buyer_id: int, note: str) -> str:
+    """Claim an active offer for `buyer_id` and open its thread. Returns the seller's campus.
+
+    The status flip is a single conditional UPDATE, so concurrent accepts cannot both win:
+    exactly one sees its row come back and the rest get 400 without reading the offer first.
+    """
+    won = (await session.execute(
+        update(model)
+        .where(model.id == offer_id, model.status == OfferStatus.active)
+        .values(status=OfferStatus.accepted, accepted_by_id=buyer_id, buyer_message=note)
+        .returning(model.seller_id, model.university)
+        .execution_options(synchronize_session=False)
+    )).first()
+    if not won:
+        raise HTTPException(400, "Unavailable")
+    seller_id, university = won
+    await session.execute(insert(Transaction).values(kind=kind, listing_id=offer_id, seller_id=seller_id, buyer_id=buyer_id))
+    await session.execute(insert(Thread).values(kind=kind, listing_id=offer_id, seller_id=seller_id, buyer_id=buyer_id, open=True))
+    await session.execute(insert(Message).from_select(
+        ["thread_id", "sender_id", "body"],
+        select(Thread.id, literal(buyer_id), literal(note or "Accepted")).where(Thread.kind == kind, Thread.listing_id == offer_id),
+    ))
+    name = summary.TRACKED[model]
+    def bookkeeping(s):
+        # These Core statements bypass the flush hooks that maintain the counters and search index
+        summary.record(s, {f"{name}.active": -1, f"{name}.accepted": 1, "transactions": 1, "messages": 1})
+        if model is ItemOffer:
+            search.unindex_item(s.connection(), offer_id)
+    await session.run_sync(bookkeeping)
+    await session.commit()
+    return university
+
+def item_out(it, seller_email: str) -> dict:
+    """ItemOfferOut fields from an ItemOffer or a row of ITEM_COLUMNS."""
+    return {"id": it.id, "seller": seller_email, "name": it.name, "category": it.category, "price": it.price, "discount": discount(it),
+            "img": image_url(it.thumb_key), "img_full": image_url(it.img_key), "status": it.status.value, "accepted_by": None,
+            "created_at": it.created_at}
+
+# Listings select just the columns their response needs rather than whole offer rows
+MEAL_COLUMNS = (MealOffer.id, MealOffer.meals, MealOffer.location, MealOffer.price, MealOffer.meal_type,
+                MealOffer.status, MealOffer.created_at)
+ITEM_COLUMNS = (ItemOffer.id, ItemOffer.name, ItemOffer.category, ItemOffer.price, ItemOffer.baseline,
+                ItemOffer.img_key, ItemOffer.thumb_key, ItemOffer.status, ItemOffer.created_at)
+
+async def page_offers(session: AsyncSession, q, model, response: Response, cursor: str | None, limit: int):
+    """Apply keyset pagination to an offer listing select and set the X-Next-Cursor header."""
+    if cursor:
+        try:
+            q = q.where(seek_before(model.created_at, model.id, cursor))
+        except ValueError:
+            raise HTTPException(400, "Invalid cursor")
+    rows = (await session.execute(q.order_by(model.created_at.desc(), model.id.desc()).limit(limit))).all()
+    nxt = next_cursor(rows, limit)
+    if nxt:
+        response.headers["X-Next-Cursor"] = nxt
+    return rows
+
 @app.get("/offers/meals", response_model=List[MealOfferOut])
-def meals_list(user: User = Depends(authed), session: Session = Depends(db)):
-    rows = session.query(MealOffer, User.email).join(User, MealOffer.seller_id == User.id).order_by(MealOffer.created_at.desc()).all()
+async def meals_list(response: Response, status: OfferStatus = OfferStatus.active, university: str | None = None,
+               meal_type: str | None = None, location: str | None = None,
+               min_price: float | None = None, max_price: float | None = None,
+               cursor: str | None = None, limit: int = Query(50, ge=1, le=200),
+               user: User = Depends(authed), session: AsyncSession = Depends(adb)):
+    """Page through a campus's meal offers newest first, the caller's campus unless `university` is given.
+    Pass the X-Next-Cursor header back as `cursor` for the next page."""
+    q = (select(*MEAL_COLUMNS, MealOffer.university, User.email).join(User, MealOffer.seller_id == User.id)
+         .where(MealOffer.university == (university or user.university), MealOffer.status == status.value))
+    if meal_type:
+        q = q.where(MealOffer.meal_type == meal_type)
+    if location:
+        q = q.where(MealOffer.location == location)
+    if min_price is not None:
+        q = q.where(MealOffer.price >= min_price)
+    if max_price is not None:
+        q = q.where(MealOffer.price <= max_price)
+    rows = await page_offers(session, q, MealOffer, response, cursor, limit)
+    price_table = await prices.table.get(session)
     out = []
-    for o, email in rows:
+    for o in rows:
+        base = price_table.get((o.university, o.meal_type))
         out.append({
             "id": o.id,
-            "seller": email,
+            "seller": o.email,
             "meals": o.meals,
             "location": o.location,
             "price": o.price,
@@ -361,14 +597,30 @@ def meals_list(user: User = Depends(authed), session: Session = Depends(db)):
             "status": o.status.value,
             "accepted_by": None,
             "created_at": o.created_at,
+            "base_price": base,
+            "savings": prices.savings(base, o.price),
         })
-    return out
-
-@app.post("/offers/meals", response_model=MealOfferOut)
+    return rows_response(out, response)
+
+@app.get("/offers/meals/savings")
+async def meals_savings(university: str | None = None, status: OfferStatus = OfferStatus.active,
+                        user: User = Depends(authed), session: AsyncSession = Depends(adb)):
+    """Savings of a campus's meal offers against its meal prices, overall and per meal type.
+    Defaults to the caller's campus."""
+    university = university or user.university
+    rows = (await session.execute(
+        select(MealOffer.meal_type, MealOffer.price, func.sum(MealOffer.meals), func.count())
+        .where(MealOffer.university == university, MealOffer.status == status.value)
+        .group_by(MealOffer.meal_type, MealOffer.price)
+    )).all()
+    return prices.campus_savings(await prices.table.get(session), university, rows)
+
+@app.post("/offers/meals", response_model=MealOfferOut, dependencies=[Depends(write_limit)])
 def meals_create(p: MealOfferIn, user: User = Depends(authed), session: Session = Depends(db)):
     # Persist new meal offer with explicit meal type. Default to lunch if none provided.
     o = MealOffer(
         seller_id=user.id,
+        university=user.university,
         meals=p.meals,
         location=p.location,
         price=p.price,
@@ -377,7 +629,7 @@ def meals_create(p: MealOfferIn, user: User = Depends(authed), session: Session
     session.add(o)
     session.commit()
     session.refresh(o)
-    return {
+    out = {
         "id": o.id,
         "seller": user.email,
         "meals": o.meals,
@@ -388,152 +640,241 @@ def meals_create(p: MealOfferIn, user: User = Depends(authed), session: Session
         "accepted_by": None,
         "created_at": o.created_at,
     }
+    # Sync endpoint: use the price table if a listing has loaded it rather than querying here
+    base = (prices.table.prices or {}).get((user.university, o.meal_type))
+    out.update(base_price=base, savings=prices.savings(base, o.price))
+    publish_offer_event(user.university, "created", "meal", o.id, out)
+    return out
 
 @app.post("/offers/meals/{offer_id}/accept")
-def meals_accept(offer_id: int, p: AcceptIn, user: User = Depends(authed), session: Session = Depends(db)):
-    o = session.query(MealOffer).filter_by(id=offer_id).first()
-    if not o or o.status != OfferStatus.active:
-        raise HTTPException(400, "Unavailable")
-    o.status = OfferStatus.accepted
-    o.accepted_by_id = user.id
-    o.buyer_message = p.message or ""
-    t = Transaction(kind="meal", listing_id=o.id, seller_id=o.seller_id, buyer_id=user.id)
-    session.add(t)
-    th = session.query(Thread).filter_by(kind="meal", listing_id=o.id).first()
-    if not th:
-        th = Thread(kind="meal", listing_id=o.id, seller_id=o.seller_id, buyer_id=user.id, open=True)
-        session.add(th)
-        session.flush()
-    m = Message(thread_id=th.id, sender_id=user.id, body=o.buyer_message or "Accepted")
-    session.add(m)
-    session.commit()
+async def meals_accept(offer_id: int, p: AcceptIn, user: User = Depends(authed), session: AsyncSession = Depends(adb)):
+    campus = await accept_offer(session, MealOffer, "meal", offer_id, user.id, p.message or "")
+    publish_offer_event(campus, "accepted", "meal", offer_id)
     return {"ok": True}
 
-@app.delete("/offers/meals/{offer_id}")
+@app.delete("/offers/meals/{offer_id}", dependencies=[Depends(write_limit)])
 def meals_cancel(offer_id: int, user: User = Depends(authed), session: Session = Depends(db)):
     o = session.query(MealOffer).filter_by(id=offer_id, seller_id=user.id).first()
     if not o or o.status != OfferStatus.active:
         raise HTTPException(404, "Not found")
     o.status = OfferStatus.cancelled
     session.commit()
+    publish_offer_event(user.university, "cancelled", "meal", offer_id)
     return {"ok": True}
 
 @app.get("/offers/items", response_model=List[ItemOfferOut])
-def items_list(user: User = Depends(authed), session: Session = Depends(db)):
-    rows = session.query(ItemOffer, User.email).join(User, ItemOffer.seller_id == User.id).order_by(ItemOffer.created_at.desc()).all()
-    out = []
-    for it, email in rows:
-        discount = 0 if not it.baseline else max(0, round((1 - it.price / it.baseline) * 100))
-        out.append({"id": it.id, "seller": email, "name": it.name, "category": it.category, "price": it.price, "discount": discount, "img": it.img_data_url or None, "status": it.status.value, "accepted_by": None, "created_at": it.created_at})
-    return out
-
-@app.post("/offers/items", response_model=ItemOfferOut)
+async def items_list(response: Response, status: OfferStatus = OfferStatus.active, university: str | None = None,
+               category: str | None = None, min_price: float | None = None, max_price: float | None = None,
+               cursor: str | None = None, limit: int = Query(50, ge=1, le=200),
+               user: User = Depends(authed), session: AsyncSession = Depends(adb)):
+    """Page through a campus's item offers newest first, the caller's campus unless `university` is given.
+    Pass the X-Next-Cursor header back as `cursor` for the next page."""
+    q = (select(*ITEM_COLUMNS, User.email).join(User, ItemOffer.seller_id == User.id)
+         .where(ItemOffer.university == (university or user.university), ItemOffer.status == status.value))
+    if category:
+        q = q.where(ItemOffer.category == category)
+    if min_price is not None:
+        q = q.where(ItemOffer.price >= min_price)
+    if max_price is not None:
+        q = q.where(ItemOffer.price <= max_price)
+    rows = await page_offers(session, q, ItemOffer, response, cursor, limit)
+    return rows_response([item_out(r, r.email) for r in rows], response)
+
+@app.get("/offers/items/search", response_model=List[ItemOfferOut])
+async def items_search(response: Response, q: str = Query(..., min_length=1, max_length=200), university: str | None = None,
+                       category: str | None = None, cursor: str | None = None, limit: int = Query(20, ge=1, le=100),
+                       user: User = Depends(authed), session: AsyncSession = Depends(adb)):
+    """Search a campus's active item offers (the caller's unless `university` is given) by name, category,
+    ISBN or course code, best match first. Words match by prefix; ISBNs and course codes (e.g. "CS 101") match exactly."""
+    clauses = search.parse_query(q)
+    if not clauses:
+        raise HTTPException(400, "Empty query")
+    try:
+        offset = decode_offset(cursor) if cursor else 0
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    hits = search.hits(session.bind.dialect.name, clauses)
+    stmt = (select(*ITEM_COLUMNS, User.email).join(hits, hits.c.id == ItemOffer.id).join(User, ItemOffer.seller_id == User.id)
+            .where(ItemOffer.university == (university or user.university), ItemOffer.status == OfferStatus.active)
+            .order_by(hits.c.rank, ItemOffer.id).offset(offset).limit(limit))
+    if category:
+        stmt = stmt.where(ItemOffer.category == category)
+    rows = (await session.execute(stmt)).all()
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_offset(offset + limit)
+    return rows_response([item_out(r, r.email) for r in rows], response)
+
+@app.post("/offers/items", response_model=ItemOfferOut, dependencies=[Depends(write_limit)])
 def items_create(p: ItemOfferIn, user: User = Depends(authed), session: Session = Depends(db)):
-    it = ItemOffer(seller_id=user.id, name=p.name, category=p.category, price=p.price, img_data_url=p.img_data_url or None, baseline=p.baseline or 0)
+    img_key = thumb_key = None
+    if p.img_data_url:
+        try:
+            img_key, thumb_key = store_image(decode_data_url(p.img_data_url))
+        except ImageError as e:
+            raise HTTPException(400, str(e))
+    it = ItemOffer(seller_id=user.id, university=user.university, name=p.name, category=p.category, price=p.price, img_key=img_key, thumb_key=thumb_key, baseline=p.baseline or 0)
     session.add(it)
     session.commit()
     session.refresh(it)
-    discount = 0 if not it.baseline else max(0, round((1 - it.price / it.baseline) * 100))
-    return {"id": it.id, "seller": user.email, "name": it.name, "category": it.category, "price": it.price, "discount": discount, "img": it.img_data_url or None, "status": it.status.value, "accepted_by": None, "created_at": it.created_at}
+    out = item_out(it, user.email)
+    publish_offer_event(user.university, "created", "item", it.id, out)
+    return out
+
+@app.get("/images/{key}")
+def get_image(key: str, if_none_match: str | None = Header(None)):
+    """Serve a stored image. Keys are content hashes, so responses are immutable."""
+    headers = {"ETag": f'"{key}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if if_none_match and headers["ETag"] in if_none_match:
+        return Response(status_code=304, headers=headers)
+    data = get_blob(key)
+    if data is None:
+        raise HTTPException(404, "Not found")
+    return Response(content=data, media_type=sniff_type(data), headers=headers)
 
 @app.post("/offers/items/{offer_id}/accept")
-def items_accept(offer_id: int, p: AcceptIn, user: User = Depends(authed), session: Session = Depends(db)):
-    it = session.query(ItemOffer).filter_by(id=offer_id).first()
-    if not it or it.status != OfferStatus.active:
-        raise HTTPException(400, "Unavailable")
-    it.status = OfferStatus.accepted
-    it.accepted_by_id = user.id
-    it.buyer_message = p.message or ""
-    t = Transaction(kind="item", listing_id=it.id, seller_id=it.seller_id, buyer_id=user.id)
-    session.add(t)
-    th = session.query(Thread).filter_by(kind="item", listing_id=it.id).first()
-    if not th:
-        th = Thread(kind="item", listing_id=it.id, seller_id=it.seller_id, buyer_id=user.id, open=True)
-        session.add(th)
-        session.flush()
-    m = Message(thread_id=th.id, sender_id=user.id, body=it.buyer_message or "Accepted")
-    session.add(m)
-    session.commit()
+async def items_accept(offer_id: int, p: AcceptIn, user: User = Depends(authed), session: AsyncSession = Depends(adb)):
+    campus = await accept_offer(session, ItemOffer, "item", offer_id, user.id, p.message or "")
+    publish_offer_event(campus, "accepted", "item", offer_id)
     return {"ok": True}
 
-@app.delete("/offers/items/{offer_id}")
+@app.delete("/offers/items/{offer_id}", dependencies=[Depends(write_limit)])
 def items_cancel(offer_id: int, user: User = Depends(authed), session: Session = Depends(db)):
     it = session.query(ItemOffer).filter_by(id=offer_id, seller_id=user.id).first()
     if not it or it.status != OfferStatus.active:
         raise HTTPException(404, "Not found")
     it.status = OfferStatus.cancelled
     session.commit()
+    publish_offer_event(user.university, "cancelled", "item", offer_id)
     return {"ok": True}
 
+async def mark_read(session: AsyncSession, thread_id: int, user_id: int, message_id: int):
+    """Advance the user's read cursor for a thread. Never moves it backwards."""
+    # An upsert, since the same user can read a thread from two tabs at once
+    stmt = dialect_insert(session.bind)(ThreadRead).values(user_id=user_id, thread_id=thread_id, last_read_message_id=message_id)
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=["user_id", "thread_id"],
+        set_={"last_read_message_id": stmt.excluded.last_read_message_id, "updated_at": func.now()},
+        where=ThreadRead.last_read_message_id < stmt.excluded.last_read_message_id,
+    ))
+
 @app.get("/inbox/threads", response_model=List[ThreadOut])
-def threads(user: User = Depends(authed), session: Session = Depends(db)):
-    ths = session.query(Thread).filter((Thread.seller_id == user.id) | (Thread.buyer_id == user.id)).order_by(Thread.created_at.desc()).all()
-    out = []
-    for t in ths:
-        other_id = t.buyer_id if t.seller_id == user.id else t.seller_id
-        other_email = session.query(User.email).filter(User.id == other_id).scalar()
-        last = session.query(Message).filter_by(thread_id=t.id).order_by(Message.created_at.desc()).first()
-        unread = 0
-        out.append({"id": t.id, "kind": t.kind, "other_party": other_email or "", "last_body": last.body if last else None, "unread": unread})
-    return out
+async def threads(user: User = Depends(authed), session: AsyncSession = Depends(adb)):
+    # One statement for the whole inbox. The last message and unread count are correlated
+    # subqueries (a lateral top-1 and a range count) that both seek ix_messages_thread_id_id.
+    other = aliased(User)
+    last_msg = aliased(Message)
+    read_upto = func.coalesce(ThreadRead.last_read_message_id, 0)
+    last_id = (select(func.max(Message.id)).where(Message.thread_id == Thread.id)
+               .correlate(Thread).scalar_subquery())
+    unread = (select(func.count(Message.id))
+              .where(Message.thread_id == Thread.id, Message.id > read_upto, Message.sender_id != user.id)
+              .correlate(Thread, ThreadRead).scalar_subquery())
+    last_at = func.coalesce(last_msg.created_at, Thread.created_at)
+    q = (select(Thread.id, Thread.kind, other.email, last_msg.body, last_at, unread)
+         .join(other, other.id == case((Thread.seller_id == user.id, Thread.buyer_id), else_=Thread.seller_id))
+         .outerjoin(last_msg, last_msg.id == last_id)
+         .outerjoin(ThreadRead, and_(ThreadRead.thread_id == Thread.id, ThreadRead.user_id == user.id))
+         .where(or_(Thread.seller_id == user.id, Thread.buyer_id == user.id))
+         .order_by(last_at.desc(), Thread.id.desc()))
+    rows = (await session.execute(q)).all()
+    return rows_response([{"id": tid, "kind": kind, "other_party": email or "", "last_body": body, "last_at": at, "unread": n or 0}
+                          for tid, kind, email, body, at, n in rows])
 
 @app.get("/inbox/threads/{thread_id}/messages", response_model=List[MessageOut])
-def messages(thread_id: int, user: User = Depends(authed), session: Session = Depends(db)):
-    t = session.query(Thread).filter_by(id=thread_id).first()
+async def messages(thread_id: int, response: Response, before: str | None = None, after: str | None = None,
+                   limit: int = Query(50, ge=1, le=200), user: User = Depends(authed), session: AsyncSession = Depends(adb)):
+    """A page of the thread, oldest first. Without a cursor this is the newest `limit` messages.
+    X-Next-Cursor, when set, is the `before` cursor for the page of older messages; X-Latest-Cursor
+    is the `after` cursor that fetches only messages newer than this page."""
+    if before and after:
+        raise HTTPException(400, "Pass either before or after, not both")
+    t = await session.get(Thread, thread_id)
     if not t or (t.seller_id != user.id and t.buyer_id != user.id):
         raise HTTPException(404, "Not found")
-    msgs = session.query(Message, User.email).join(User, Message.sender_id == User.id).filter(Message.thread_id == thread_id).order_by(Message.created_at.asc()).all()
-    return [{"from_email": em, "body": m.body, "when": m.created_at} for m, em in msgs]
-
-@app.post("/inbox/threads/{thread_id}/messages", response_model=MessageOut)
-def send_message(thread_id: int, p: MessageIn, user: User = Depends(authed), session: Session = Depends(db)):
-    t = session.query(Thread).filter_by(id=thread_id).first()
+    q = (select(Message.id, Message.body, Message.created_at, User.email)
+         .join(User, Message.sender_id == User.id).where(Message.thread_id == thread_id))
+    try:
+        if after:
+            # By id alone: on Postgres created_at is the sending transaction's start time, so a
+            # message that commits just after a poll can carry an earlier created_at than the
+            # newest one that poll saw
+            q = q.where(Message.id > decode_cursor(after)[1])
+        elif before:
+            q = q.where(seek_before(Message.created_at, Message.id, before))
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    # These seek ix_messages_thread_id_id and ix_messages_thread_id_created; an `after` poll
+    # with nothing new reads no rows
+    if after:
+        rows = (await session.execute(q.order_by(Message.id.asc()).limit(limit))).all()
+    else:
+        rows = (await session.execute(q.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit))).all()
+        nxt = next_cursor(rows, limit)
+        if nxt:
+            response.headers["X-Next-Cursor"] = nxt
+        rows.reverse()
+    if rows:
+        newest = max(rows, key=lambda r: r.id)
+        response.headers["X-Latest-Cursor"] = encode_cursor(newest.created_at, newest.id)
+        await mark_read(session, thread_id, user.id, newest.id)
+        await session.commit()
+    elif after:
+        response.headers["X-Latest-Cursor"] = after
+    return rows_response([{"id": r.id, "from_email": r.email, "body": r.body, "when": r.created_at} for r in rows], response)
+
+@app.post("/inbox/threads/{thread_id}/messages", response_model=MessageOut, dependencies=[Depends(write_limit)])
+async def send_message(thread_id: int, p: MessageIn, user: User = Depends(authed), session: AsyncSession = Depends(adb)):
+    t = await session.get(Thread, thread_id)
     if not t or (t.seller_id != user.id and t.buyer_id != user.id):
         raise HTTPException(404, "Not found")
+    if not t.open:
+        t.open = True
     m = Message(thread_id=thread_id, sender_id=user.id, body=p.body)
     session.add(m)
-    session.commit()
-    em = session.query(User.email).filter(User.id == user.id).scalar() or ""
-    return {"from_email": em, "body": m.body, "when": m.created_at}
+    await session.flush()
+    await mark_read(session, thread_id, user.id, m.id)
+    await session.commit()
+    # created_at is a server default; load it explicitly since async sessions cannot lazy-load
+    await session.refresh(m, ["created_at"])
+    return {"id": m.id, "from_email": user.email, "body": m.body, "when": m.created_at}
 
 @app.websocket("/ws")
-async def ws_endpoint(ws: WebSocket):
-    room = "global"
-    await hub.join(room, ws)
+async def ws_endpoint(ws: WebSocket, token: str | None = None):
+    """Live offer feed for the caller's campus. Browsers cannot set headers, so the token is a query param."""
+    try:
+        async with AsyncSessionLocal() as session:
+            user = await principal_for_token(token or "", session)
+    except HTTPException:
+        await ws.close(code=1008)
+        return
+    room = campus_room(user.university)
+    conn = await hub.join(room, ws)
     try:
         while True:
             await ws.receive_text()
     except WebSocketDisconnect:
-        hub.leave(room, ws)
-
-def log_activity(session, user_id, action, details=None):
-    try:
-        from .models import Activity
-        a = Activity(user_id=user_id, action=action, details=details or "")
-        session.add(a)
-        session.commit()
-    except Exception:
-        session.rollback()
+        pass
+    finally:
+        hub.leave(room, conn)
 
 @app.get("/admin/activities")
 def admin_activities(user: User = Depends(admin_required), session = Depends(db)):
-    from .models import Activity
-    rows = session.query(Activity).order_by(Activity.created_at.desc()).limit(200).all()
-    return [{
-        "id": r.id,
-        "user_id": r.user_id,
-        "action": r.action,
-        "details": r.details,
-        "created_at": r.created_at
-    } for r in rows]
+    rows = session.execute(select(Activity.id, Activity.user_id, Activity.action, Activity.details, Activity.created_at)
+                           .order_by(Activity.created_at.desc()).limit(200)).all()
+    return rows_response([r._asdict() for r in rows])
 
 @app.post("/me/change-password")
-def change_password(current_password: str, new_password: str, user: User = Depends(authed), session = Depends(db)):
-    from .auth import verify_password, hash_password
-    if not verify_password(current_password, user.password_hash):
+async def change_password(current_password: str, new_password: str, user: User = Depends(authed),
+                          session: AsyncSession = Depends(adb)):
+    # `user` is a cached snapshot; read the stored hash, then update it without holding a connection while hashing
+    hashed = (await session.execute(select(User.password_hash).where(User.id == user.id))).scalar_one()
+    await session.close()
+    ok, _ = await averify_and_update(current_password, hashed)
+    if not ok:
         raise HTTPException(status_code=400, detail="Current password incorrect")
-    user.password_hash = hash_password(new_password)
-    session.add(user)
-    session.commit()
-    log_activity(session, user.id, "change_password", "User changed password")
+    new_hash = await ahash_password(new_password)
+    await session.execute(update(User).where(User.id == user.id).values(password_hash=new_hash))
+    session.add(Activity(user_id=user.id, action="change_password", details="User changed password"))
+    await session.commit()
+    forget_user(user.id)
     return {"ok": True}
\ No newline at end of file
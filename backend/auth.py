@@ -1,26 +1,129 @@
-from datetime import datetime, timedelta, timezone
-from passlib.context import CryptContext
-from jose import jwt
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from functools import cache
+import multiprocessing
 import os
+import threading
+from cache import TTLCache
 
-pwd = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes with a different cost are upgraded transparently on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
 JWT_SECRET = os.getenv("JWT_SECRET", "change-me")
 JWT_ISS = os.getenv("JWT_ISS", "meal-arb")
 JWT_AUD = os.getenv("JWT_AUD", "meal-arb-web")
 JWT_EXPIRE_MIN = int(os.getenv("JWT_EXPIRE_MIN", "43200"))
 
+# Decoded tokens and user snapshots are cached per process so most requests authenticate
+# without a database round trip. Entries are dropped when a user row changes in this
+# process; AUTH_CACHE_TTL bounds how long other workers can serve a stale snapshot.
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+token_cache = TTLCache("auth_tokens", maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+user_cache = TTLCache("auth_users", maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+@dataclass(frozen=True)
+class Principal:
+    """Read-only snapshot of the authenticated User. Load the row itself before writing to it."""
+    id: int
+    email: str
+    university: str
+    total_meals: int
+    expires_on: date
+    meal_distribution: str
+    weekly_meals: int
+
+    @classmethod
+    def from_user(cls, u) -> "Principal":
+        return cls(id=u.id, email=u.email, university=u.university, total_meals=u.total_meals,
+                   expires_on=u.expires_on, meal_distribution=u.meal_distribution, weekly_meals=u.weekly_meals)
+
+# bcrypt runs in its own process pool so a login burst cannot starve the threadpool that
+# serves every other sync endpoint. The auth endpoints are async and await the pool's
+# future on the event loop, so a queued hash holds no thread at all. At most
+# HASH_MAX_PENDING hashes may be running or queued; beyond that callers get HashBusy
+# immediately instead of waiting in line. HASH_WORKERS=0 hashes inline on a threadpool
+# thread (hash_password, used by the CLI, hashes on the calling thread).
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(max(1, HASH_WORKERS) * 4)))
+_hash_slots = threading.BoundedSemaphore(HASH_MAX_PENDING)
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+class HashBusy(Exception):
+    pass
+
+def _get_hash_pool():
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _hash_pool
+
+def _run_hash(fn, *args):
+    if not _hash_slots.acquire(blocking=False):
+        raise HashBusy()
+    try:
+        if HASH_WORKERS <= 0:
+            return fn(*args)
+        return _get_hash_pool().submit(fn, *args).result()
+    finally:
+        _hash_slots.release()
+
+async def _run_hash_async(fn, *args):
+    if not _hash_slots.acquire(blocking=False):
+        raise HashBusy()
+    try:
+        if HASH_WORKERS <= 0:
+            from anyio import to_thread
+            return await to_thread.run_sync(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(_get_hash_pool(), fn, *args)
+    finally:
+        _hash_slots.release()
+
+# passlib and jose are imported on first use rather than at startup
+@cache
+def _pwd():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=BCRYPT_ROUNDS,
+                        bcrypt__min_rounds=BCRYPT_ROUNDS, bcrypt__max_rounds=BCRYPT_ROUNDS)
+
+def _hash(raw: str) -> str:
+    return _pwd().hash(raw)
+
+def _verify_and_update(raw: str, hashed: str) -> tuple:
+    return _pwd().verify_and_update(raw, hashed)
+
 def hash_password(raw: str) -> str:
-    return pwd.hash(raw)
+    return _run_hash(_hash, raw)
+
+async def ahash_password(raw: str) -> str:
+    return await _run_hash_async(_hash, raw)
 
-def verify_password(raw: str, hashed: str) -> bool:
-    return pwd.verify(raw, hashed)
+async def averify_and_update(raw: str, hashed: str) -> tuple:
+    """(ok, new_hash); new_hash is set when the stored hash uses an outdated cost factor."""
+    return await _run_hash_async(_verify_and_update, raw, hashed)
 
-def make_token(sub: str, remember: bool) -> str:
+def make_token(sub: str, remember: bool, uid: int | None = None) -> str:
     exp_min = JWT_EXPIRE_MIN if remember else 120
     now = datetime.now(timezone.utc)
     payload = {"sub": sub, "iss": JWT_ISS, "aud": JWT_AUD, "iat": int(now.timestamp()), "exp": int((now + timedelta(minutes=exp_min)).timestamp())}
+    if uid is not None:
+        payload["uid"] = uid
+    from jose import jwt
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
-def parse_token(token: str) -> str:
-    data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"], audience=JWT_AUD, issuer=JWT_ISS)
-    return data["sub"]
+def parse_claims(token: str) -> dict:
+    data = token_cache.get(token)
+    if data is None:
+        from jose import jwt
+        data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"], audience=JWT_AUD, issuer=JWT_ISS)
+        # Never cache a token past its own expiry
+        token_cache.set(token, data, ttl=data["exp"] - datetime.now(timezone.utc).timestamp())
+    return data
+
+def forget_user(user_id: int):
+    """Drop the cached snapshot and decoded tokens for a user whose row changed."""
+    user_cache.pop(user_id)
+    token_cache.discard_where(lambda _, claims: claims.get("uid") == user_id)
@@ -0,0 +1,2 @@
+# Benchmarks that drive a real uvicorn server against a scratch SQLite database.
+# Run them from the backend directory, e.g. `python -m bench.login_storm`.
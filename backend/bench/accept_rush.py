@@ -0,0 +1,58 @@
+"""Many buyers racing to accept the same offers.
+
+    python -m bench.accept_rush [--buyers 20] [--accepts 300] [--offers 5]
+
+For each offer, fires `--accepts` simultaneous accepts spread over `--buyers` accounts
+and reports how many won (must be exactly one), how many were turned away, and the
+accept throughput, as JSON.
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bench.server import UNLIMITED, Server, call, percentiles
+from bench.login_storm import signup_and_login
+
+def rush(base: str, tokens: list, kind: str, offer_id: int, accepts: int, concurrency: int = 64) -> dict:
+    def accept(i):
+        return call(base, "POST", f"/offers/{kind}s/{offer_id}/accept", {"message": f"#{i}"}, token=tokens[i % len(tokens)])
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as ex:
+        results = list(ex.map(accept, range(accepts)))
+    wall = time.monotonic() - start
+    statuses = [status for status, _, _ in results]
+    return {
+        "winners": statuses.count(200),
+        "rejected": statuses.count(400),
+        "errors": len(statuses) - statuses.count(200) - statuses.count(400),
+        "accepts_per_sec": round(accepts / wall, 1),
+        "latency": percentiles([elapsed for _, _, elapsed in results]),
+    }
+
+def create_offers(base: str, token: str, offers: int) -> list:
+    ids = []
+    for i in range(offers):
+        kind = "meal" if i % 2 == 0 else "item"
+        body = ({"meals": 1, "location": "Commons", "price": 1.0, "meal_type": "lunch"} if kind == "meal"
+                else {"name": f"Textbook {i}", "category": "books", "price": 5.0})
+        status, out, _ = call(base, "POST", f"/offers/{kind}s", body, token=token)
+        assert status == 200, (status, out)
+        ids.append((kind, out["id"]))
+    return ids
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--buyers", type=int, default=20)
+    ap.add_argument("--accepts", type=int, default=300)
+    ap.add_argument("--offers", type=int, default=5)
+    args = ap.parse_args()
+
+    with Server(env={"BCRYPT_ROUNDS": "4", **UNLIMITED}) as srv:
+        seller = signup_and_login(srv.base, "seller@bench.edu")
+        buyers = [signup_and_login(srv.base, f"buyer{i}@bench.edu") for i in range(args.buyers)]
+        runs = [rush(srv.base, buyers, kind, offer_id, args.accepts) for kind, offer_id in create_offers(srv.base, seller, args.offers)]
+    print(json.dumps({"buyers": args.buyers, "accepts_per_offer": args.accepts, "runs": runs}, indent=2))
+
+if __name__ == "__main__":
+    main()
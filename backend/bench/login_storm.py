@@ -0,0 +1,81 @@
+"""Read-endpoint latency while a burst of logins hammers bcrypt.
+
+    python -m bench.login_storm [--storm 64] [--seconds 10] [--hash-workers N]
+
+Measures GET /offers/meals and GET /stats latency alone, then again while `--storm`
+threads log in continuously, and prints both as JSON. Pass --hash-workers 0 to compare
+against hashing inline on the request threadpool.
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bench.server import Server, call, percentiles
+
+def signup_and_login(base: str, email: str) -> str:
+    call(base, "POST", "/auth/signup", {"email": email, "password": "pw", "university": "Bench U",
+                                         "total_meals": 100, "expires_on": "2030-01-01"})
+    status, body, _ = call(base, "POST", "/auth/login", {"email": email, "password": "pw"})
+    assert status == 200, (status, body)
+    return body["token"]
+
+def read_latencies(base: str, token: str, seconds: float, readers: int) -> dict:
+    samples, errors = [], 0
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def reader(i):
+        nonlocal errors
+        path = "/offers/meals" if i % 2 else "/stats"
+        while time.monotonic() < stop:
+            status, _, elapsed = call(base, "GET", path, token=token)
+            with lock:
+                if status == 200:
+                    samples.append(elapsed)
+                else:
+                    errors += 1
+
+    with ThreadPoolExecutor(readers) as ex:
+        list(ex.map(reader, range(readers)))
+    return {**percentiles(samples), "errors": errors}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--storm", type=int, default=64, help="concurrent login threads")
+    ap.add_argument("--readers", type=int, default=4)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--hash-workers", type=str, default=None)
+    args = ap.parse_args()
+
+    env = {"HASH_WORKERS": args.hash_workers} if args.hash_workers is not None else {}
+    with Server(env=env) as srv:
+        token = signup_and_login(srv.base, "reader@bench.edu")
+        signup_and_login(srv.base, "storm@bench.edu")
+        baseline = read_latencies(srv.base, token, args.seconds, args.readers)
+
+        logins = {"ok": 0, "shed": 0, "other": 0}
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def storm():
+            while not done.is_set():
+                status, _, _ = call(srv.base, "POST", "/auth/login", {"email": "storm@bench.edu", "password": "pw"})
+                key = "ok" if status == 200 else "shed" if status == 503 else "other"
+                with lock:
+                    logins[key] += 1
+
+        threads = [threading.Thread(target=storm, daemon=True) for _ in range(args.storm)]
+        for t in threads:
+            t.start()
+        time.sleep(1)
+        during = read_latencies(srv.base, token, args.seconds, args.readers)
+        done.set()
+        for t in threads:
+            t.join(30)
+
+    print(json.dumps({"hash_workers": args.hash_workers, "storm_threads": args.storm,
+                      "reads_baseline": baseline, "reads_during_storm": during, "logins": logins}, indent=2))
+
+if __name__ == "__main__":
+    main()
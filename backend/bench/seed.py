@@ -0,0 +1,182 @@
+"""Fill the database at DATABASE_URL with synthetic campus data.
+
+    python -m bench.seed bench.db [--scale 1] [--seed 1] [--users N] [--offers N] [--messages N] [--adjustments N]
+
+At --scale 1 that is 10k users across 20 universities, 100k meal and item offers, 1M messages
+and 1M usage adjustments; each size can also be set on its own. The same --seed always
+produces the same rows (timestamps are relative to today). Every seeded user's password is
+SEED_PASSWORD. Rows go in with bulk Core inserts, then the search index, usage rollups and
+summary counters are built from them the way a migration would.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+SEED_PASSWORD = "pw"
+FULL_SIZE = {"users": 10_000, "offers": 100_000, "messages": 1_000_000, "adjustments": 1_000_000}
+UNIVERSITIES = 20
+CHUNK = 10_000
+
+MEAL_TYPES = ["breakfast", "lunch", "dinner"]
+LOCATIONS = ["Commons", "North Hall", "Student Union", "Library Cafe", "West Dining", "Grill"]
+CATEGORIES = ["Books", "Electronics", "Furniture", "Clothing", "Other"]
+WORDS = ["used", "new", "calculus", "chemistry", "lamp", "desk", "chair", "jacket", "laptop", "charger",
+         "monitor", "notes", "lab", "coat", "kettle", "textbook", "guide", "bundle", "mini", "fridge"]
+DEPTS = ["CS", "MATH", "CHEM", "BIO", "PHYS", "ECON", "HIST", "PSYC"]
+# status mix of seeded offers
+STATUSES = [("active", 0.7), ("accepted", 0.2), ("cancelled", 0.1)]
+
+def sizes(scale: float, **overrides) -> dict:
+    out = {k: max(1, int(v * scale)) for k, v in FULL_SIZE.items()}
+    out.update({k: v for k, v in overrides.items() if v is not None})
+    return out
+
+def university(i: int) -> str:
+    return f"Bench University {i:02d}"
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _insert(conn, table, rows) -> int:
+    n = 0
+    for chunk in _chunks(rows):
+        conn.execute(table.insert(), chunk)
+        n += len(chunk)
+    return n
+
+def _item_name(rng: random.Random) -> str:
+    name = f"{rng.choice(WORDS).title()} {rng.choice(WORDS)}"
+    if rng.random() < 0.3:
+        name += f" {rng.choice(DEPTS)} {rng.randint(100, 499)}"
+    return name
+
+def seed(scale: float = 1.0, seed: int = 1, **overrides) -> dict:
+    """Seed an empty database and return the number of rows written per table."""
+    from sqlalchemy.orm import Session
+    from auth import hash_password
+    from db import engine, sync_schema
+    from models import (User, MealOffer, ItemOffer, OfferStatus, Transaction, Thread, Message, UsageAdjustment,
+                        Comment, MealPrice)
+    import manage
+    import search
+    import summary
+    import usage
+
+    n = sizes(scale, **overrides)
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None)
+    today = now.date()
+    def ago(days: float) -> datetime:
+        return now - timedelta(seconds=int(days * 86400))
+
+    sync_schema()
+    password_hash = hash_password(SEED_PASSWORD)
+    campuses = min(UNIVERSITIES, n["users"])
+    written = {}
+    with engine.begin() as conn:
+        users = [{"id": 1, "email": manage.ADMIN_EMAIL, "password_hash": password_hash, "university": "Admin",
+                  "total_meals": 0, "expires_on": today, "meal_distribution": "semester", "weekly_meals": 0,
+                  "created_at": ago(120)}]
+        for i in range(n["users"]):
+            weekly = rng.random() < 0.2
+            users.append({"id": i + 2, "email": f"user{i}@bench.edu", "password_hash": password_hash,
+                          "university": university(i % campuses), "total_meals": rng.choice([80, 120, 160, 200]),
+                          "expires_on": today + timedelta(days=rng.randint(20, 110)),
+                          "meal_distribution": "weekly" if weekly else "semester",
+                          "weekly_meals": rng.choice([10, 14, 19]) if weekly else 0, "created_at": ago(rng.uniform(30, 120))})
+        written["users"] = _insert(conn, User.__table__, users)
+        campus_of = {u["id"]: u["university"] for u in users}
+        user_ids = [u["id"] for u in users[1:]]
+        by_campus = {}
+        for uid in user_ids:
+            by_campus.setdefault(campus_of[uid], []).append(uid)
+
+        written["meal_prices"] = _insert(conn, MealPrice.__table__, (
+            {"university": university(c), "meal_type": t, "price": round(rng.uniform(6, 16), 2), "created_at": ago(60)}
+            for c in range(campuses) for t in MEAL_TYPES))
+
+        meals, items, accepted = [], [], []
+        for i in range(n["offers"]):
+            seller = rng.choice(user_ids)
+            status = rng.choices([s for s, _ in STATUSES], [w for _, w in STATUSES])[0]
+            buyer = None
+            if status == "accepted":
+                buyer = rng.choice(by_campus[campus_of[seller]])
+            row = {"id": i // 2 + 1, "seller_id": seller, "university": campus_of[seller], "status": OfferStatus[status], "accepted_by_id": buyer,
+                   "price": round(rng.uniform(1, 60), 2), "created_at": ago(rng.uniform(0, 10))}
+            if i % 2 == 0:
+                row.update(meals=rng.randint(1, 10), location=rng.choice(LOCATIONS), meal_type=rng.choice(MEAL_TYPES))
+                meals.append(row)
+            else:
+                row.update(name=_item_name(rng), category=rng.choice(CATEGORIES), baseline=round(row["price"] * rng.uniform(1, 3), 2))
+                items.append(row)
+            if buyer:
+                accepted.append(("meal" if i % 2 == 0 else "item", row))
+        written["meal_offers"] = _insert(conn, MealOffer.__table__, meals)
+        written["item_offers"] = _insert(conn, ItemOffer.__table__, items)
+
+        threads = []
+        for i, (kind, o) in enumerate(accepted):
+            at = o["created_at"] + timedelta(minutes=rng.randint(1, 600))
+            threads.append({"id": i + 1, "kind": kind, "listing_id": o["id"], "seller_id": o["seller_id"],
+                            "buyer_id": o["accepted_by_id"], "open": True, "created_at": min(at, now)})
+        written["transactions"] = _insert(conn, Transaction.__table__, (
+            {"kind": t["kind"], "listing_id": t["listing_id"], "seller_id": t["seller_id"], "buyer_id": t["buyer_id"],
+             "created_at": t["created_at"]} for t in threads))
+        written["threads"] = _insert(conn, Thread.__table__, threads)
+
+        def messages():
+            if not threads:
+                return
+            for i in range(n["messages"]):
+                # Every thread opens with the buyer's accept message, the rest land at random
+                first = i < len(threads)
+                t = threads[i] if first else rng.choice(threads)
+                sender = t["buyer_id"] if first or rng.random() < 0.5 else t["seller_id"]
+                at = t["created_at"] if first else t["created_at"] + timedelta(seconds=rng.randint(1, 86400))
+                yield {"thread_id": t["id"], "sender_id": sender, "body": f"Message {i} about the {t['kind']}",
+                       "created_at": min(at, now)}
+        written["messages"] = _insert(conn, Message.__table__, messages())
+
+        written["usage_adjustments"] = _insert(conn, UsageAdjustment.__table__, (
+            {"user_id": rng.choice(user_ids), "meals_used_delta": rng.choice([-1, -1, -1, -2, 1]),
+             "note": "", "at": ago(rng.uniform(0, 60))} for _ in range(n["adjustments"])))
+        written["comments"] = _insert(conn, Comment.__table__, (
+            {"user_id": uid, "university": campus_of[uid], "body": f"Comment from user {uid}", "created_at": ago(rng.uniform(0, 30))}
+            for uid in (rng.choice(user_ids) for _ in range(max(1, n["users"] // 5)))))
+
+    # Derived state, built from the rows above just like a migration does for existing data
+    search.ensure_index(engine)
+    with Session(engine) as session:
+        usage.rebuild(session)
+        summary.rebuild(session)
+    return written
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("db", help="SQLite file to create")
+    ap.add_argument("--scale", type=float, default=1.0)
+    ap.add_argument("--seed", type=int, default=1)
+    for name in FULL_SIZE:
+        ap.add_argument(f"--{name}", type=int)
+    args = ap.parse_args()
+    if os.path.exists(args.db):
+        sys.exit(f"{args.db} already exists")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+    start = time.perf_counter()
+    written = seed(args.scale, args.seed, **{k: getattr(args, k) for k in FULL_SIZE})
+    print(json.dumps({"rows": written, "seconds": round(time.perf_counter() - start, 1)}, indent=2))
+
+if __name__ == "__main__":
+    main()
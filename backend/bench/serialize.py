@@ -0,0 +1,150 @@
+"""CPU cost of building list responses: the ORM + response_model path against column rows + orjson.
+
+    python -m bench.serialize [--rows 1000] [--repeat 20] [--out result.json]
+
+Seeds a scratch database with --rows active meal and item offers, then builds the same
+responses two ways for each listing:
+
+  orm     load whole ORM rows, build dicts, validate and serialize them through the route's
+          response_model the way FastAPI does, then render with JSONResponse
+  rows    select only the needed columns, build dicts and render with FastJSONResponse
+
+Each is timed with process CPU time over --repeat builds and reported in CPU milliseconds per
+1,000 rows, split into fetch (query and dict building) and render. The two bodies are checked to
+decode to the same JSON before anything is timed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+def _timed(build, repeat: int, reset) -> tuple:
+    fetch = render = 0.0
+    for _ in range(repeat):
+        reset()
+        start = time.process_time()
+        content = build.fetch()
+        mid = time.process_time()
+        body = build.render(content)
+        end = time.process_time()
+        fetch += mid - start
+        render += end - mid
+    return fetch, render, body
+
+class Build:
+    def __init__(self, fetch, render):
+        self.fetch = fetch
+        self.render = render
+
+def builds(session, rows: int) -> dict:
+    """route -> {"orm": Build, "rows": Build} over the newest `rows` active offers."""
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import APIRoute, serialize_response
+    from sqlalchemy import select
+    import app as A
+    import prices
+    from fastjson import rows_response
+    from models import MealOffer, ItemOffer, MealPrice, OfferStatus, User
+
+    fields = {(m, r.path): r.secure_cloned_response_field for r in A.app.routes if isinstance(r, APIRoute) for m in r.methods}
+    price_table = {(uni, meal_type): price for uni, meal_type, price in
+                   session.execute(select(MealPrice.university, MealPrice.meal_type, MealPrice.price))}
+
+    def validated(route, content) -> bytes:
+        # What FastAPI does with a plain return value: validate against response_model, dump, render
+        field = fields[("GET", route)]
+        return JSONResponse(asyncio.run(serialize_response(field=field, response_content=content))).body
+
+    def newest(q, model):
+        return session.execute(q.where(model.status == OfferStatus.active)
+                               .order_by(model.created_at.desc(), model.id.desc()).limit(rows)).all()
+
+    def meal_dict(o, email, campus):
+        base = price_table.get((campus, o.meal_type))
+        return {"id": o.id, "seller": email, "meals": o.meals, "location": o.location, "price": o.price,
+                "meal_type": o.meal_type, "status": o.status.value, "accepted_by": None, "created_at": o.created_at,
+                "base_price": base, "savings": prices.savings(base, o.price)}
+
+    def admin_meal_dict(o):
+        return {"id": o.id, "seller_id": o.seller_id, "meals": o.meals, "location": o.location, "price": o.price,
+                "meal_type": o.meal_type, "status": o.status.value, "accepted_by_id": o.accepted_by_id,
+                "created_at": o.created_at}
+
+    meal_join = lambda *cols: select(*cols).join(User, MealOffer.seller_id == User.id)
+    item_join = lambda *cols: select(*cols).join(User, ItemOffer.seller_id == User.id)
+    admin_meal_columns = (MealOffer.id, MealOffer.seller_id, MealOffer.meals, MealOffer.location, MealOffer.price,
+                          MealOffer.meal_type, MealOffer.status, MealOffer.accepted_by_id, MealOffer.created_at)
+    return {
+        "GET /offers/meals": {
+            "orm": Build(lambda: [meal_dict(o, e, o.university) for o, e in newest(meal_join(MealOffer, User.email), MealOffer)],
+                         lambda out: validated("/offers/meals", out)),
+            "rows": Build(lambda: [meal_dict(r, r.email, r.university)
+                                   for r in newest(meal_join(*A.MEAL_COLUMNS, MealOffer.university, User.email), MealOffer)],
+                          lambda out: rows_response(out).body),
+        },
+        "GET /offers/items": {
+            "orm": Build(lambda: [A.item_out(it, e) for it, e in newest(item_join(ItemOffer, User.email), ItemOffer)],
+                         lambda out: validated("/offers/items", out)),
+            "rows": Build(lambda: [A.item_out(r, r.email) for r in newest(item_join(*A.ITEM_COLUMNS, User.email), ItemOffer)],
+                          lambda out: rows_response(out).body),
+        },
+        "GET /admin/offers/meals": {
+            # No response_model here, so FastAPI runs the return value through jsonable_encoder
+            "orm": Build(lambda: [admin_meal_dict(o) for o in session.query(MealOffer).order_by(MealOffer.id).limit(rows)],
+                         lambda out: validated("/admin/offers/meals", out)),
+            "rows": Build(lambda: [r._asdict() for r in session.execute(
+                              select(*admin_meal_columns).order_by(MealOffer.id).limit(rows))],
+                          lambda out: rows_response(out).body),
+        },
+    }
+
+def run(rows: int, repeat: int) -> dict:
+    tmp = tempfile.TemporaryDirectory()
+    os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(tmp.name, 'bench.db')}", EXPIRY_INTERVAL="0",
+                      STARTUP_MIGRATE="0", IMAGE_DIR=os.path.join(tmp.name, "images"))
+    try:
+        from sqlalchemy.orm import Session
+        from bench.seed import seed
+        from db import engine
+        # Offers alternate meal/item and about 70% are active
+        seed(users=200, offers=int(rows * 2 / 0.7) + 100, messages=1, adjustments=1)
+        out = {}
+        with Session(engine) as session:
+            for route, ways in builds(session, rows).items():
+                bodies = {}
+                for way, b in ways.items():
+                    session.expunge_all()
+                    bodies[way] = b.render(b.fetch())
+                decoded = {way: json.loads(body) for way, body in bodies.items()}
+                if decoded["orm"] != decoded["rows"]:
+                    raise AssertionError(f"{route}: the two paths return different JSON")
+                n = len(decoded["rows"])
+                result = {"n": n}
+                for way, b in ways.items():
+                    # Each request gets a fresh session, so never let the ORM path reuse loaded objects
+                    fetch, render, _ = _timed(b, repeat, session.expunge_all)
+                    per = 1000 / (n * repeat) * 1000 if n else 0.0
+                    result[way] = {"fetch_ms": round(fetch * per, 2), "render_ms": round(render * per, 2),
+                                   "total_ms": round((fetch + render) * per, 2)}
+                result["speedup"] = round(result["orm"]["total_ms"] / result["rows"]["total_ms"], 2) if result["rows"]["total_ms"] else None
+                out[route] = result
+        return out
+    finally:
+        tmp.cleanup()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1000)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    text = json.dumps(run(args.rows, args.repeat), indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main()
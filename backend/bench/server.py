@@ -0,0 +1,86 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Rate limits and admission control off, for benchmarks that deliberately overload one client
+UNLIMITED = {"WRITE_RATE_PER_USER": "0", "WRITE_RATE_PER_IP": "0", "ADMISSION_MAX_WAITING": "0",
+             "ADMISSION_MAX_WAITING_WRITES": "0"}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class Server:
+    """Run `uvicorn app:app` in a subprocess against a throwaway SQLite file."""
+
+    def __init__(self, env: dict | None = None, db_path: str | None = None, workers: int = 1):
+        self.port = free_port()
+        self.base = f"http://127.0.0.1:{self.port}"
+        self._tmp = None
+        if db_path is None:
+            self._tmp = tempfile.TemporaryDirectory()
+            db_path = os.path.join(self._tmp.name, "bench.db")
+        self.db_path = db_path
+        self.env = {**os.environ, "DATABASE_URL": f"sqlite:///{db_path}", **(env or {})}
+        self.workers = workers
+        self.proc = None
+
+    def __enter__(self):
+        cmd = [sys.executable, "-m", "uvicorn", "app:app", "--port", str(self.port), "--log-level", "warning"]
+        if self.workers > 1:
+            cmd += ["--workers", str(self.workers)]
+        self.proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=self.env)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            try:
+                urllib.request.urlopen(self.base + "/openapi.json", timeout=1)
+                return self
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.1)
+        self.__exit__()
+        raise RuntimeError("server did not start")
+
+    def __exit__(self, *exc):
+        if self.proc:
+            self.proc.terminate()
+            self.proc.wait(10)
+        if self._tmp:
+            self._tmp.cleanup()
+
+def call(base: str, method: str, path: str, body=None, token: str | None = None, timeout: float = 30):
+    """Return (status, parsed JSON body or None, elapsed seconds)."""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base + path, data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    if token:
+        req.add_header("Authorization", "Bearer " + token)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            raw = r.read()
+            status = r.status
+    except urllib.error.HTTPError as e:
+        raw = e.read()
+        status = e.code
+    elapsed = time.perf_counter() - start
+    try:
+        parsed = json.loads(raw) if raw else None
+    except ValueError:
+        parsed = None
+    return status, parsed, elapsed
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {"n": 0}
+    s = sorted(samples)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))]
+    return {"n": len(s), "p50_ms": round(pick(0.50) * 1000, 2), "p95_ms": round(pick(0.95) * 1000, 2),
+            "p99_ms": round(pick(0.99) * 1000, 2), "max_ms": round(s[-1] * 1000, 2)}
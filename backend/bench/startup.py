@@ -0,0 +1,82 @@
+"""Cold start: time to import app, and time from process start to the first response.
+
+    python -m bench.startup [--runs 5] [--update-baseline]
+
+Runs against a scratch SQLite database that is migrated up front, with STARTUP_MIGRATE=0,
+the way a serverless deployment starts. Prints medians as JSON and exits non-zero when
+either exceeds bench/startup_baseline.json by more than the allowed slack.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from bench.server import BACKEND_DIR, free_port
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_baseline.json")
+# A run regresses when it is slower than baseline * (1 + TOLERANCE) + SLACK_S
+TOLERANCE = 0.5
+SLACK_S = 0.1
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+def import_time(env: dict) -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def first_response_time(env: dict, path: str = "/mealprices") -> float:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}{path}"
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=BACKEND_DIR, env=env)
+    try:
+        while time.perf_counter() - start < 60:
+            try:
+                urllib.request.urlopen(url, timeout=1).read()
+                return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.005)
+        raise RuntimeError("server did not start")
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+def measure(runs: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'startup.db')}",
+               "STARTUP_MIGRATE": "0", "HASH_WORKERS": "0"}
+        subprocess.run([sys.executable, "manage.py", "init"], cwd=BACKEND_DIR, env=env, check=True, capture_output=True)
+        imports = [import_time(env) for _ in range(runs)]
+        firsts = [first_response_time(env) for _ in range(runs)]
+    return {"import_s": round(statistics.median(imports), 3), "first_response_s": round(statistics.median(firsts), 3)}
+
+def regressions(result: dict, baseline: dict) -> list:
+    return [f"{key}: {result[key]}s vs baseline {base}s" for key, base in baseline.items()
+            if result[key] > base * (1 + TOLERANCE) + SLACK_S]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--update-baseline", action="store_true")
+    args = ap.parse_args()
+
+    result = measure(args.runs)
+    if args.update_baseline:
+        with open(BASELINE, "w") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    problems = regressions(result, baseline)
+    print(json.dumps({**result, "baseline": baseline, "regressions": problems}, indent=2))
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Per-route latency, throughput and SQL query counts for every HTTP endpoint, in-process.
+
+    python -m bench.suite [--scale 0.1 | --db seeded.db] [--clients 16] [--requests 200] [--only /offers] [--out run.json]
+    python -m bench.suite --compare before.json after.json
+
+Seeds a scratch database with bench.seed (or uses --db, which must already be seeded; the
+run writes to it), then gives each route its own phase: --clients concurrent clients send
+--requests requests through an ASGI transport to the app in this process. The bcrypt routes
+and the full-table admin dumps get a fraction of that. Every SQL statement is counted against
+the request that issued it. The result is JSON keyed by route; --compare reports each
+metric's before/after ratio for two results. /ws is not a request/response route and is left
+to test_pubsub.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from bench.server import UNLIMITED, percentiles
+
+# Share of --requests given to routes that are slow by design
+BCRYPT_SHARE = 0.1
+ADMIN_SHARE = 0.25
+DUMP_SHARE = 0.02
+COMPARED = ("p50_ms", "p95_ms", "p99_ms", "rps", "queries_mean")
+# Smallest valid PNG, served back by GET /images/{key}
+PIXEL = bytes.fromhex("89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+                      "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082")
+
+_queries: ContextVar = ContextVar("bench_queries", default=None)
+
+def _count_query(*_):
+    box = _queries.get()
+    if box is not None:
+        box[0] += 1
+
+class Route:
+    def __init__(self, name: str, make, share: float = 1.0):
+        self.name = name
+        self.make = make
+        self.share = share
+
+def load_fixtures(rng: random.Random, sample: int = 500) -> dict:
+    """Ids and tokens to aim requests at, drawn from the seeded rows."""
+    from sqlalchemy import select
+    from auth import make_token
+    from db import SessionLocal
+    from images import put_blob
+    from models import User, MealOffer, ItemOffer, OfferStatus, Thread
+    import manage
+    session = SessionLocal()
+    try:
+        users = session.execute(select(User.id, User.email, User.university).where(User.email != manage.ADMIN_EMAIL)
+                                .order_by(User.id)).all()
+        admin = session.execute(select(User.id).where(User.email == manage.ADMIN_EMAIL)).scalar_one()
+        def offers(model):
+            rows = session.execute(select(model.id, User.id, User.email).join(User, model.seller_id == User.id)
+                                   .where(model.status == OfferStatus.active).order_by(model.id)).all()
+            rng.shuffle(rows)
+            return rows
+        threads = session.execute(select(Thread.id, User.id, User.email).join(User, Thread.buyer_id == User.id)
+                                  .order_by(Thread.id)).all()
+        categories = list(session.execute(select(ItemOffer.category).distinct()).scalars())
+        meal_types = list(session.execute(select(MealOffer.meal_type).distinct()).scalars())
+    finally:
+        session.close()
+    meals, items = offers(MealOffer), offers(ItemOffer)
+    users, threads = rng.sample(users, min(sample, len(users))), rng.sample(threads, min(sample, len(threads)))
+    # Disjoint halves, so every accept and cancel finds its offer still active
+    return {
+        "users": [(make_token(email, False, uid=uid), uid, email, uni) for uid, email, uni in users],
+        "admin": make_token(manage.ADMIN_EMAIL, False, uid=admin),
+        "universities": sorted({uni for _, _, uni in users}),
+        "meals_to_accept": iter(meals[::2]), "meals_to_cancel": iter(meals[1::2]),
+        "items_to_accept": iter(items[::2]), "items_to_cancel": iter(items[1::2]),
+        "threads": [(tid, make_token(email, False, uid=uid)) for tid, uid, email in threads],
+        "categories": categories,
+        "meal_types": meal_types,
+        "image": put_blob(PIXEL),
+    }
+
+def routes(fx: dict, rng: random.Random, run_id: str) -> list:
+    """Every HTTP route, each as a function from request number to (method, path, body, token)."""
+    from auth import make_token
+    from bench.seed import DEPTS, WORDS, SEED_PASSWORD
+    user = lambda: rng.choice(fx["users"])
+    token = lambda: user()[0]
+    admin = fx["admin"]
+    uni = lambda: rng.choice(fx["universities"])
+    def take(pool, path):
+        def make(i):
+            row = next(pool, None)
+            if row is None:
+                return None
+            offer_id, uid, email = row
+            seller = make_token(email, False, uid=uid)
+            return path(offer_id, seller)
+        return make
+    def query():
+        return rng.choice([rng.choice(WORDS), f"{rng.choice(DEPTS)} {rng.randint(100, 499)}",
+                           f"{rng.choice(WORDS)} {rng.choice(WORDS)}"])
+    def change_password(i):
+        tok, _, _, _ = fx["users"][i % len(fx["users"])]
+        return "POST", f"/me/change-password?current_password={SEED_PASSWORD}&new_password={SEED_PASSWORD}", None, tok
+    out = [
+        # reads
+        Route("GET /me", lambda i: ("GET", "/me", None, token())),
+        Route("GET /stats", lambda i: ("GET", "/stats", None, token())),
+        Route("GET /mealprices", lambda i: ("GET", f"/mealprices?university={uni()}", None, None)),
+        Route("GET /metrics", lambda i: ("GET", "/metrics", None, None), ADMIN_SHARE),
+        Route("GET /comments", lambda i: ("GET", f"/comments?university={uni()}", None, None)),
+        Route("GET /offers/meals", lambda i: ("GET", "/offers/meals", None, token())),
+        Route("GET /offers/meals?university&meal_type", lambda i: (
+            "GET", f"/offers/meals?university={uni()}&meal_type={rng.choice(fx['meal_types'])}", None, token())),
+        Route("GET /offers/meals/savings", lambda i: ("GET", "/offers/meals/savings", None, token())),
+        Route("GET /offers/items", lambda i: ("GET", "/offers/items", None, token())),
+        Route("GET /offers/items?category", lambda i: (
+            "GET", f"/offers/items?category={rng.choice(fx['categories'])}", None, token())),
+        Route("GET /offers/items/search", lambda i: ("GET", f"/offers/items/search?q={query()}", None, token())),
+        Route("GET /inbox/threads", lambda i: ("GET", "/inbox/threads", None, rng.choice(fx["threads"])[1])),
+        Route("GET /inbox/threads/{thread_id}/messages", lambda i: (
+            lambda t: ("GET", f"/inbox/threads/{t[0]}/messages", None, t[1]))(rng.choice(fx["threads"]))),
+        Route("GET /images/{key}", lambda i: ("GET", f"/images/{fx['image']}", None, None)),
+        # writes
+        Route("POST /auth/signup", lambda i: ("POST", "/auth/signup", {
+            "email": f"new{i}-{run_id}@bench.edu", "password": SEED_PASSWORD, "university": uni(),
+            "total_meals": 100, "expires_on": "2030-01-01"}, None), BCRYPT_SHARE),
+        Route("POST /auth/login", lambda i: ("POST", "/auth/login", {"email": user()[2], "password": SEED_PASSWORD}, None),
+              BCRYPT_SHARE),
+        Route("POST /me/change-password", change_password, BCRYPT_SHARE),
+        Route("POST /usage/adjust", lambda i: ("POST", "/usage/adjust", {"meals_used_delta": -1, "note": "bench"}, token())),
+        Route("POST /usage/adjust/batch", lambda i: ("POST", "/usage/adjust/batch", {"adjustments": [
+            {"meals_used_delta": -1, "key": f"{run_id}-{i}-{j}", "at": f"{datetime.now(timezone.utc) - timedelta(hours=j):%Y-%m-%dT%H:%M:%SZ}"}
+            for j in range(10)]}, token())),
+        Route("POST /comments", lambda i: ("POST", "/comments", {"body": f"Bench comment {i}"}, token())),
+        Route("POST /offers/meals", lambda i: ("POST", "/offers/meals", {
+            "meals": 2, "location": "Commons", "price": 5.5, "meal_type": rng.choice(fx["meal_types"])}, token())),
+        Route("POST /offers/items", lambda i: ("POST", "/offers/items", {
+            "name": f"Bench {rng.choice(WORDS)} {i}", "category": rng.choice(fx["categories"]), "price": 12.0}, token())),
+        Route("POST /offers/meals/{offer_id}/accept", take(fx["meals_to_accept"], lambda oid, _: (
+            "POST", f"/offers/meals/{oid}/accept", {"message": "bench"}, token()))),
+        Route("POST /offers/items/{offer_id}/accept", take(fx["items_to_accept"], lambda oid, _: (
+            "POST", f"/offers/items/{oid}/accept", {"message": "bench"}, token()))),
+        Route("DELETE /offers/meals/{offer_id}", take(fx["meals_to_cancel"], lambda oid, seller: (
+            "DELETE", f"/offers/meals/{oid}", None, seller))),
+        Route("DELETE /offers/items/{offer_id}", take(fx["items_to_cancel"], lambda oid, seller: (
+            "DELETE", f"/offers/items/{oid}", None, seller))),
+        Route("POST /inbox/threads/{thread_id}/messages", lambda i: (
+            lambda t: ("POST", f"/inbox/threads/{t[0]}/messages", {"body": f"bench {i}"}, t[1]))(rng.choice(fx["threads"]))),
+        Route("POST /admin/mealprices", lambda i: ("POST", "/admin/mealprices", {
+            "university": uni(), "meal_type": rng.choice(fx["meal_types"]), "price": round(rng.uniform(6, 16), 2)}, admin),
+              ADMIN_SHARE),
+    ]
+    for path in ("/admin/caches", "/admin/db-pool", "/admin/summary", "/admin/mealprices", "/admin/comments",
+                 "/admin/messages", "/admin/activities"):
+        out.append(Route(f"GET {path}", lambda i, path=path: ("GET", path, None, admin), ADMIN_SHARE))
+    for path in ("/admin/users", "/admin/offers/meals", "/admin/offers/items", "/admin/transactions",
+                 "/admin/usage-adjustments", "/admin/users/export", "/admin/offers/meals/export",
+                 "/admin/offers/items/export", "/admin/transactions/export", "/admin/usage-adjustments/export"):
+        out.append(Route(f"GET {path}", lambda i, path=path: ("GET", path, None, admin), DUMP_SHARE))
+    return out
+
+async def phase(client, route: Route, requests: int, clients: int) -> dict:
+    samples, queries, statuses = [], [], {}
+    numbers = iter(range(requests))
+
+    async def worker():
+        for i in numbers:
+            req = route.make(i)
+            if req is None:
+                return
+            method, path, body, token = req
+            headers = {"Authorization": f"Bearer {token}"} if token else {}
+            box = [0]
+            reset = _queries.set(box)
+            start = time.perf_counter()
+            try:
+                r = await client.request(method, path, json=body, headers=headers)
+            finally:
+                elapsed = time.perf_counter() - start
+                _queries.reset(reset)
+            samples.append(elapsed)
+            queries.append(box[0])
+            statuses[str(r.status_code)] = statuses.get(str(r.status_code), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, min(clients, requests)))))
+    wall = time.perf_counter() - start
+    return {
+        **percentiles(samples),
+        "rps": round(len(samples) / wall, 1) if samples else 0.0,
+        "queries_mean": round(sum(queries) / len(queries), 2) if queries else 0.0,
+        "queries_max": max(queries, default=0),
+        "status": dict(sorted(statuses.items())),
+    }
+
+async def drive(selected: list, requests: int, clients: int) -> dict:
+    import httpx
+    from app import app
+    out = {}
+    # Unhandled errors count as 500s rather than ending the run
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for route in selected:
+            n = max(2, int(requests * route.share))
+            out[route.name] = await phase(client, route, n, clients)
+            print(f"{route.name}: {out[route.name]}", file=sys.stderr)
+    return out
+
+def table_counts(db_path: str) -> dict:
+    con = sqlite3.connect(db_path)
+    try:
+        names = [n for (n,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite%' "
+                                           "AND name NOT LIKE 'item_search%' ORDER BY name")]
+        return {n: con.execute(f'SELECT count(*) FROM "{n}"').fetchone()[0] for n in names}
+    finally:
+        con.close()
+
+def run(db_path: str | None, scale: float, seed: int, clients: int, requests: int, only: str | None) -> dict:
+    tmp = tempfile.TemporaryDirectory()
+    fresh = db_path is None
+    db_path = os.path.abspath(db_path or os.path.join(tmp.name, "bench.db"))
+    # Configure the app before anything imports db
+    os.environ.update(DATABASE_URL=f"sqlite:///{db_path}", EXPIRY_INTERVAL="0", STARTUP_MIGRATE="0", METRICS_TOKEN="",
+                      IMAGE_DIR=os.path.join(tmp.name, "images"), **UNLIMITED)
+    try:
+        if fresh:
+            from bench.seed import seed as seed_db
+            seed_db(scale, seed)
+        from sqlalchemy import event
+        import sqlalchemy
+        from db import async_engine, engine
+        for e in (engine, async_engine.sync_engine):
+            event.listen(e, "before_cursor_execute", _count_query)
+        rows = table_counts(db_path)
+        rng = random.Random(seed)
+        selected = [r for r in routes(load_fixtures(rng), rng, f"{seed}-{int(time.time())}") if not only or only in r.name]
+        started = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        results = asyncio.run(drive(selected, requests, clients))
+        return {
+            "meta": {"started_at": started, "scale": scale if fresh else None, "seed": seed, "clients": clients,
+                     "requests": requests, "rows": rows, "python": platform.python_version(),
+                     "sqlalchemy": sqlalchemy.__version__, "sqlite": sqlite3.sqlite_version},
+            "routes": results,
+        }
+    finally:
+        tmp.cleanup()
+
+def compare(before: dict, after: dict) -> dict:
+    """after/before ratio of each metric, per route present in both runs."""
+    out = {}
+    for name, a in before["routes"].items():
+        b = after["routes"].get(name)
+        if b is None:
+            continue
+        out[name] = {k: {"before": a[k], "after": b[k], "ratio": round(b[k] / a[k], 2) if a[k] else None}
+                     for k in COMPARED if k in a and k in b}
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", help="already-seeded SQLite file (default: seed a scratch one)")
+    ap.add_argument("--scale", type=float, default=0.1, help="bench.seed scale for the scratch database")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--requests", type=int, default=200, help="requests per route")
+    ap.add_argument("--only", help="run routes whose name contains this")
+    ap.add_argument("--out", help="also write the JSON result here")
+    ap.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = ap.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            print(json.dumps(compare(json.load(f), json.load(g)), indent=2))
+        return
+    result = run(args.db, args.scale, args.seed, args.clients, args.requests, args.only)
+    text = json.dumps(result, indent=2, sort_keys=True, default=str)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc, inspect, make_url, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 import os
+import threading
+import time
 
 # Read from env; fall back to local sqlite for dev
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
@@ -15,17 +19,176 @@ connect_args = {}
 if DATABASE_URL.startswith("sqlite"):
     connect_args = {"check_same_thread": False}
 
+# Pool sizing; keep pool_size + max_overflow under the pgBouncer/Postgres client limit per worker
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+class PoolWaitStats:
+    """How long requests wait to check out a pooled connection."""
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Checkouts in progress right now, across both engines; limits.py sheds load on it
+        self.waiting = 0
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.bucket_counts = [0] * (len(self.BUCKETS) + 1)
+
+    def enter(self):
+        with self._lock:
+            self.waiting += 1
+
+    def leave(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def record(self, waited: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            i = next((i for i, b in enumerate(self.BUCKETS) if waited <= b), len(self.BUCKETS))
+            self.bucket_counts[i] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [f"le_{b}" for b in self.BUCKETS] + ["le_inf"]
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+                "wait_buckets": dict(zip(labels, self.bucket_counts)),
+            }
+
+    def histogram(self) -> tuple:
+        # (bounds, per-bucket counts, total seconds, checkouts, timeouts) for /metrics
+        with self._lock:
+            return self.BUCKETS, self.bucket_counts[:], self.wait_total, self.checkouts, self.timeouts
+
+pool_waits = PoolWaitStats()
+
+class _TimedCheckout:
+    # Times each checkout; a long wait means the pool is too small for the request load
+    def _do_get(self):
+        pool_waits.enter()
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            pool_waits.record(time.perf_counter() - start, timed_out=True)
+            raise
+        finally:
+            pool_waits.leave()
+        pool_waits.record(time.perf_counter() - start)
+        return conn
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+engine_kwargs = {}
+async_engine_kwargs = {}
+if ":memory:" not in DATABASE_URL:
+    engine_kwargs = dict(poolclass=TimedQueuePool, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    async_engine_kwargs = dict(engine_kwargs, poolclass=TimedAsyncQueuePool)
+
 # Pooling-friendly engine (works with Supabase pgBouncer)
 engine = create_engine(
     DATABASE_URL,
     pool_pre_ping=True,
-    pool_size=1,
-    max_overflow=0,
-    pool_recycle=1800,
+    pool_recycle=DB_POOL_RECYCLE,
     connect_args=connect_args,
+    **engine_kwargs,
 )
 
+def async_url(url: str):
+    """Map the sync DATABASE_URL onto its async driver: aiosqlite for SQLite, asyncpg for Postgres."""
+    u = make_url(url)
+    if u.get_backend_name() == "sqlite":
+        return u.set(drivername="sqlite+aiosqlite"), {}
+    if u.get_backend_name() == "postgresql":
+        # asyncpg takes `ssl` rather than libpq's sslmode, and pgBouncer in transaction
+        # mode cannot keep prepared statements, so statement caching is disabled.
+        args = {"statement_cache_size": 0}
+        if "sslmode" in u.query:
+            args["ssl"] = u.query["sslmode"]
+        query = {k: v for k, v in u.query.items() if k != "sslmode"}
+        query["prepared_statement_cache_size"] = "0"
+        return u.set(drivername="postgresql+asyncpg", query=query), args
+    return u, {}
+
+ASYNC_DATABASE_URL, async_connect_args = async_url(DATABASE_URL)
+
+# Async engine for the async endpoints; shares pool settings with the sync engine
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_pre_ping=True,
+    pool_recycle=DB_POOL_RECYCLE,
+    connect_args=async_connect_args,
+    **async_engine_kwargs,
+)
+
+if DATABASE_URL.startswith("sqlite"):
+    # WAL lets readers proceed while a writer commits; NORMAL sync is durable across app
+    # crashes and only risks the last commits on power loss.
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    }
+
+    @event.listens_for(engine, "connect")
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, record):
+        cur = dbapi_conn.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cur.execute(f"PRAGMA {name}={value}")
+        cur.close()
+
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: attribute access after commit would need an implicit (sync) refresh
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+def dialect_insert(bind):
+    """The dialect's INSERT construct (for on_conflict_do_update); imported on first use."""
+    if bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+def sync_schema(bind=None):
+    """Create missing tables, then add the nullable columns and indexes create_all skips on existing tables."""
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+    quote = bind.dialect.identifier_preparer.quote
+    with bind.begin() as conn:
+        insp = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            have = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name not in have and col.nullable:
+                    coltype = col.type.compile(dialect=bind.dialect)
+                    conn.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(col.name)} {coltype}"))
+    for table in Base.metadata.sorted_tables:
+        for ix in table.indexes:
+            try:
+                ix.create(bind=bind, checkfirst=True)
+            except exc.IntegrityError:
+                # Existing rows violate a new unique index; keep serving and let an operator clean up
+                print(f"Skipping index {ix.name}: {table.name} has duplicate rows")
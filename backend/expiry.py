@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import delete, exists, false, func, insert, or_, select, update
+from db import SessionLocal
+from models import (User, MealOffer, ItemOffer, OfferStatus, Transaction, Thread, Message, ThreadRead,
+                    meal_offers_archive, item_offers_archive, transactions_archive, threads_archive, messages_archive)
+from ws import hub, campus_room
+import search
+import summary
+
+# Housekeeping for the offer tables, run every EXPIRY_INTERVAL seconds by each worker (0 turns
+# the scheduler off, e.g. when `python expiry.py run` is scheduled externally instead):
+#
+#   expire   active meal offers whose seller's meal plan has ended, and active offers older
+#            than MEAL_OFFER_TTL_DAYS / ITEM_OFFER_TTL_DAYS, become expired
+#   close    threads with no message for ARCHIVE_AFTER_DAYS are closed
+#   archive  finished offers older than ARCHIVE_AFTER_DAYS, with their transactions and
+#            (closed) thread and messages, move to the *_archive tables
+#
+# Everything happens in batches of EXPIRY_BATCH rows, each in its own short transaction with a
+# pause in between, so request traffic is never stuck behind a long sweep. On Postgres the
+# batch's offer rows are claimed with SKIP LOCKED, so workers sweeping at once split the work.
+EXPIRY_INTERVAL = float(os.getenv("EXPIRY_INTERVAL", "300"))
+EXPIRY_BATCH = int(os.getenv("EXPIRY_BATCH", "200"))
+EXPIRY_PAUSE = float(os.getenv("EXPIRY_PAUSE", "0.05"))
+MEAL_OFFER_TTL_DAYS = int(os.getenv("MEAL_OFFER_TTL_DAYS", "14"))
+ITEM_OFFER_TTL_DAYS = int(os.getenv("ITEM_OFFER_TTL_DAYS", "90"))
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+
+log = logging.getLogger("expiry")
+
+KINDS = {MealOffer: "meal", ItemOffer: "item"}
+ARCHIVES = {MealOffer: meal_offers_archive, ItemOffer: item_offers_archive}
+FINISHED = (OfferStatus.accepted, OfferStatus.cancelled, OfferStatus.expired)
+
+def _days_ago(now: datetime, days: int) -> datetime:
+    return now - timedelta(days=days)
+
+def _stale(model, now: datetime, today: date):
+    ttl = MEAL_OFFER_TTL_DAYS if model is MealOffer else ITEM_OFFER_TTL_DAYS
+    rules = [model.created_at < _days_ago(now, ttl)] if ttl > 0 else []
+    if model is MealOffer:
+        # Swipes cannot be used after the plan ends
+        rules.append(User.expires_on < today)
+    return or_(*rules) if rules else false()
+
+def _claim(session, q):
+    # Postgres: lock the batch so a concurrent sweep in another worker takes different rows
+    return session.execute(q.limit(EXPIRY_BATCH).with_for_update(skip_locked=True, of=q.selected_columns[0].table)).scalars().all()
+
+def expire_batch(session, model, now: datetime, today: date) -> int:
+    ids = _claim(session, select(model.id).join(User, model.seller_id == User.id)
+                 .where(model.status == OfferStatus.active, _stale(model, now, today)).order_by(model.id))
+    if not ids:
+        session.rollback()
+        return 0
+    rows = session.execute(
+        update(model).where(model.id.in_(ids), model.status == OfferStatus.active)
+        .values(status=OfferStatus.expired).returning(model.id, model.university)
+        .execution_options(synchronize_session=False)
+    ).all()
+    name = summary.TRACKED[model]
+    summary.record(session, {f"{name}.active": -len(rows), f"{name}.expired": len(rows)})
+    if model is ItemOffer:
+        conn = session.connection()
+        for offer_id, _ in rows:
+            search.unindex_item(conn, offer_id)
+    session.commit()
+    for offer_id, university in rows:
+        hub.publish(campus_room(university), {"type": "offer.expired", "kind": KINDS[model], "id": offer_id})
+    return len(ids)
+
+def close_batch(session, now: datetime) -> int:
+    cutoff = _days_ago(now, ARCHIVE_AFTER_DAYS)
+    recent = exists().where(Message.thread_id == Thread.id, Message.created_at >= cutoff)
+    ids = _claim(session, select(Thread.id).where(Thread.open.is_(True), Thread.created_at < cutoff, ~recent).order_by(Thread.id))
+    if ids:
+        session.execute(update(Thread).where(Thread.id.in_(ids)).values(open=False).execution_options(synchronize_session=False))
+    session.commit()
+    return len(ids)
+
+def _move(session, source, archive, where) -> int:
+    columns = [c.name for c in source.columns]
+    session.execute(insert(archive).from_select(columns, select(*source.columns).where(where)))
+    return session.execute(delete(source).where(where).execution_options(synchronize_session=False)).rowcount
+
+def archive_batch(session, model, now: datetime) -> int:
+    kind = KINDS[model]
+    cutoff = _days_ago(now, ARCHIVE_AFTER_DAYS)
+    talking = exists().where(Thread.kind == kind, Thread.listing_id == model.id, Thread.open.is_(True))
+    ids = _claim(session, select(model.id).where(model.status.in_(FINISHED), model.created_at < cutoff, ~talking)
+                 .order_by(model.id))
+    if not ids:
+        session.rollback()
+        return 0
+    by_status = dict(session.execute(select(model.status, func.count()).where(model.id.in_(ids)).group_by(model.status)).all())
+    threads = select(Thread.id).where(Thread.kind == kind, Thread.listing_id.in_(ids))
+    session.execute(delete(ThreadRead).where(ThreadRead.thread_id.in_(threads)).execution_options(synchronize_session=False))
+    messages = _move(session, Message.__table__, messages_archive, Message.thread_id.in_(threads))
+    _move(session, Thread.__table__, threads_archive, Thread.id.in_(threads))
+    transactions = _move(session, Transaction.__table__, transactions_archive,
+                         (Transaction.kind == kind) & Transaction.listing_id.in_(ids))
+    offers = _move(session, model.__table__, ARCHIVES[model], model.id.in_(ids))
+    name = summary.TRACKED[model]
+    deltas = {name: -offers, "transactions": -transactions, "messages": -messages}
+    deltas.update({f"{name}.{status.value}": -n for status, n in by_status.items()})
+    summary.record(session, deltas)
+    session.commit()
+    return offers
+
+def _drain(step, *args) -> int:
+    total = 0
+    while True:
+        session = SessionLocal()
+        try:
+            n = step(session, *args)
+        finally:
+            session.close()
+        total += n
+        if n < EXPIRY_BATCH:
+            return total
+        time.sleep(EXPIRY_PAUSE)
+
+def run_once() -> dict:
+    """One full sweep; returns how many rows each step touched."""
+    now = datetime.now(timezone.utc)
+    today = now.date()
+    done = {}
+    for model, kind in KINDS.items():
+        done[f"{kind}s_expired"] = _drain(expire_batch, model, now, today)
+    done["threads_closed"] = _drain(close_batch, now)
+    for model, kind in KINDS.items():
+        done[f"{kind}s_archived"] = _drain(archive_batch, model, now)
+    return done
+
+async def scheduler(interval: float = EXPIRY_INTERVAL):
+    # Jitter the first sweep so workers started together do not all sweep together
+    await asyncio.sleep(interval * random.uniform(0.5, 1.0))
+    while True:
+        try:
+            done = await asyncio.to_thread(run_once)
+            if any(done.values()):
+                log.info("Expiry sweep: %s", done)
+        except Exception:
+            log.exception("Expiry sweep failed")
+        await asyncio.sleep(interval)
+
+def start() -> asyncio.Task | None:
+    if EXPIRY_INTERVAL <= 0:
+        return None
+    return asyncio.create_task(scheduler())
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["run"]:
+        sys.exit("usage: python expiry.py run")
+    print(run_once())
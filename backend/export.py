@@ -0,0 +1,88 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from enum import Enum
+from sqlalchemy import select
+from db import SessionLocal
+from models import User, MealOffer, ItemOffer, Transaction, UsageAdjustment
+
+# Streaming admin exports. Rows are fetched in batches of EXPORT_BATCH through a server-side
+# cursor (psycopg2 named cursor; SQLite steps its cursor lazily anyway) and written out as each
+# batch arrives, so memory stays flat however large the table is. Rows come in id order;
+# pass the last id seen as `after_id` to resume.
+EXPORT_BATCH = 1000
+
+def discount(row) -> int:
+    return 0 if not row.baseline else max(0, round((1 - row.price / row.baseline) * 100))
+
+# name -> (model, timestamp column, exported columns, computed fields)
+EXPORTS = {
+    "users": (User, User.created_at,
+              [User.id, User.email, User.university, User.total_meals, User.meal_distribution,
+               User.weekly_meals, User.expires_on, User.created_at], {}),
+    "meal-offers": (MealOffer, MealOffer.created_at,
+                    [MealOffer.id, MealOffer.seller_id, MealOffer.meals, MealOffer.location, MealOffer.price,
+                     MealOffer.meal_type, MealOffer.status, MealOffer.accepted_by_id, MealOffer.created_at], {}),
+    "item-offers": (ItemOffer, ItemOffer.created_at,
+                    [ItemOffer.id, ItemOffer.seller_id, ItemOffer.name, ItemOffer.category, ItemOffer.price,
+                     ItemOffer.baseline, ItemOffer.status, ItemOffer.accepted_by_id, ItemOffer.created_at],
+                    {"discount": discount}),
+    "transactions": (Transaction, Transaction.created_at,
+                     [Transaction.id, Transaction.kind, Transaction.listing_id, Transaction.seller_id,
+                      Transaction.buyer_id, Transaction.created_at], {}),
+    "usage-adjustments": (UsageAdjustment, UsageAdjustment.at,
+                          [UsageAdjustment.id, UsageAdjustment.user_id, UsageAdjustment.meals_used_delta,
+                           UsageAdjustment.note, UsageAdjustment.at.label("created_at")], {}),
+}
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def _plain(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def export_query(name: str, since: datetime | None = None, until: datetime | None = None,
+                 after_id: int | None = None, limit: int | None = None):
+    model, at, columns, _ = EXPORTS[name]
+    q = select(*columns).order_by(model.id)
+    if since is not None:
+        q = q.where(at >= since)
+    if until is not None:
+        q = q.where(at < until)
+    if after_id is not None:
+        q = q.where(model.id > after_id)
+    if limit is not None:
+        q = q.limit(limit)
+    return q.execution_options(yield_per=EXPORT_BATCH)
+
+def stream_rows(name: str, fmt: str, **filters):
+    """Yield the export as text chunks, one per fetched batch. Owns its session, since it
+    outlives the request's dependencies."""
+    _, _, _, computed = EXPORTS[name]
+    session = SessionLocal()
+    try:
+        result = session.execute(export_query(name, **filters))
+        fields = list(result.keys()) + list(computed)
+        buf = io.StringIO()
+        writer = csv.writer(buf) if fmt == "csv" else None
+        if writer:
+            writer.writerow(fields)
+        for batch in result.partitions():
+            for row in batch:
+                values = [_plain(v) for v in row] + [fn(row) for fn in computed.values()]
+                if writer:
+                    writer.writerow(values)
+                else:
+                    buf.write(json.dumps(dict(zip(fields, values))))
+                    buf.write("\n")
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+    finally:
+        session.close()
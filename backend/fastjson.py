@@ -0,0 +1,19 @@
+import orjson
+from fastapi import Response
+
+# List endpoints build plain dicts from column rows and hand them straight to orjson. Returning
+# a Response skips FastAPI's response_model pass, which would validate every row into a model
+# and serialize it again; the response_model stays on the route for the OpenAPI schema only,
+# so the dicts must already have its shape. OPT_UTC_Z writes UTC datetimes with a "Z" suffix
+# like pydantic does, and enums are written as their values.
+OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=OPTIONS)
+
+def rows_response(content, response: Response | None = None) -> FastJSONResponse:
+    """Wrap `content`, keeping any headers the handler set on its injected `response`."""
+    return FastJSONResponse(content, headers=dict(response.headers) if response is not None else None)
@@ -0,0 +1,131 @@
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+# Content-addressed blob store for listing images. Blobs live on local disk under
+# IMAGE_DIR/<first two hex chars>/<sha256>, so identical uploads share one file and a
+# key never changes meaning, which lets clients cache them forever.
+IMAGE_DIR = os.getenv("IMAGE_DIR", "./images")
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(5 * 1024 * 1024)))
+THUMB_PX = int(os.getenv("THUMB_PX", "320"))
+# Public origin of this API (e.g. https://api.example.com). Image URLs in responses are built on
+# it, since the frontend is served from another origin and would resolve a bare path against its own.
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+_DATA_URL_RE = re.compile(r"^data:([\w.+-]+/[\w.+-]+)?(;[^,]*)?,(.*)$", re.S)
+
+class ImageError(ValueError):
+    pass
+
+def _path(key: str) -> str:
+    return os.path.join(IMAGE_DIR, key[:2], key)
+
+def put_blob(data: bytes) -> str:
+    key = hashlib.sha256(data).hexdigest()
+    path = _path(key)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A private temp file per writer, so concurrent uploads of one blob never share a half-written file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return key
+
+def get_blob(key: str) -> bytes | None:
+    if not _KEY_RE.match(key or ""):
+        return None
+    try:
+        with open(_path(key), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def sniff_type(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+def decode_data_url(url: str) -> bytes:
+    m = _DATA_URL_RE.match(url or "")
+    if not m or "base64" not in (m.group(2) or ""):
+        raise ImageError("Image must be a base64 data URL")
+    try:
+        data = base64.b64decode(m.group(3), validate=False)
+    except (binascii.Error, ValueError):
+        raise ImageError("Invalid image data")
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ImageError("Image too large")
+    if sniff_type(data) == "application/octet-stream":
+        raise ImageError("Unsupported image type")
+    return data
+
+def make_thumbnail(data: bytes) -> bytes:
+    """Downscale to fit THUMB_PX; returns the original bytes if it is already small."""
+    # Imported on first use, like passlib in auth.py, so a cold start never pays for it
+    from PIL import Image
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            if max(im.size) <= THUMB_PX:
+                return data
+            im.thumbnail((THUMB_PX, THUMB_PX))
+            out = io.BytesIO()
+            im.convert("RGB").save(out, "JPEG", quality=80, optimize=True)
+            return out.getvalue()
+    except Exception:
+        raise ImageError("Invalid image data")
+
+def store_image(data: bytes) -> tuple:
+    """Store an upload and its thumbnail; returns (img_key, thumb_key)."""
+    thumb = make_thumbnail(data)
+    return put_blob(data), put_blob(thumb)
+
+def image_url(key: str | None) -> str | None:
+    """Absolute URL of a stored image; a root-relative path if PUBLIC_BASE_URL is unset."""
+    return f"{PUBLIC_BASE_URL}/images/{key}" if key else None
+
+def migrate_inline_images(session, batch: int = 100) -> int:
+    """Move legacy ItemOffer.img_data_url values into the blob store. Safe to re-run."""
+    from models import ItemOffer
+    moved = 0
+    last_id = 0
+    while True:
+        rows = (session.query(ItemOffer)
+                .filter(ItemOffer.id > last_id, ItemOffer.img_data_url.isnot(None), ItemOffer.img_key.is_(None))
+                .order_by(ItemOffer.id).limit(batch).all())
+        if not rows:
+            return moved
+        for it in rows:
+            last_id = it.id
+            try:
+                it.img_key, it.thumb_key = store_image(decode_data_url(it.img_data_url))
+            except ImageError as e:
+                print(f"Skipping item {it.id}: {e}")
+                continue
+            it.img_data_url = None
+            moved += 1
+        session.commit()
+
+if __name__ == "__main__":
+    from db import SessionLocal, sync_schema
+    sync_schema()
+    s = SessionLocal()
+    try:
+        print(f"Migrated {migrate_inline_images(s)} inline images to {IMAGE_DIR}")
+    finally:
+        s.close()
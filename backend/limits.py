@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from starlette.responses import JSONResponse
+from db import DB_MAX_OVERFLOW, DB_POOL_SIZE, pool_waits
+
+# Two guards against write bursts, both per worker process:
+#
+#   rate limits  token buckets for the write routes, one per user and one per client IP.
+#                A bucket holds up to *_BURST tokens and refills at *_RATE per second; a
+#                request that finds it empty gets 429 with Retry-After. 0 turns a limit off.
+#   admission    when more requests are already waiting for a pooled connection than the
+#                threshold, new requests get 503 with Retry-After instead of joining the
+#                queue. Writes are shed at a lower depth than reads, so a write burst
+#                cannot starve page loads. 0 turns a threshold off.
+WRITE_RATE_PER_USER = float(os.getenv("WRITE_RATE_PER_USER", "1"))
+WRITE_BURST_PER_USER = float(os.getenv("WRITE_BURST_PER_USER", "30"))
+# Loose, since a campus network can put many students behind one address
+WRITE_RATE_PER_IP = float(os.getenv("WRITE_RATE_PER_IP", "20"))
+WRITE_BURST_PER_IP = float(os.getenv("WRITE_BURST_PER_IP", "200"))
+# Proxies in front of the app that append to X-Forwarded-For (1 for a single load balancer).
+# Without them the peer address is the proxy's, and every user would share one IP bucket.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", str(4 * (DB_POOL_SIZE + DB_MAX_OVERFLOW))))
+ADMISSION_MAX_WAITING_WRITES = int(os.getenv("ADMISSION_MAX_WAITING_WRITES", str(2 * (DB_POOL_SIZE + DB_MAX_OVERFLOW))))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+# Never shed the scrape target; it is how overload gets noticed
+ADMISSION_EXEMPT = {"/metrics"}
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Requests turned away by admission control, by kind
+shed = {"read": 0, "write": 0}
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+
+class TokenBucketLimiter:
+    """Token bucket per key, for at most `maxkeys` keys (least recently seen dropped first)."""
+    def __init__(self, name: str, rate: float, burst: float, maxkeys: int = 100_000, clock=time.monotonic):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.maxkeys = maxkeys
+        self.clock = clock
+        self.limited = 0
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time of last update)
+        self._lock = threading.Lock()
+
+    def take(self, key) -> float:
+        """Spend a token for `key`. Returns 0 if there was one, else seconds until there will be."""
+        if self.rate <= 0:
+            return 0.0
+        now = self.clock()
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+                self.limited += 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxkeys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def check(self, key):
+        wait = self.take(key)
+        if wait:
+            raise RateLimited(wait)
+
+    def refund(self, key):
+        """Give back the token a request took, when a later check turned that request away."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            if key in self._buckets:
+                tokens, stamp = self._buckets[key]
+                self._buckets[key] = (min(self.burst, tokens + 1), stamp)
+
+def client_ip(request) -> str:
+    """The client address the IP bucket keys on: the one the outermost trusted proxy saw."""
+    if TRUSTED_PROXY_HOPS:
+        # Each trusted proxy appends its peer, so entries left of those may be forged by the client
+        hops = [h.strip() for h in ",".join(request.headers.getlist("x-forwarded-for")).split(",") if h.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else ""
+
+user_writes = TokenBucketLimiter("user_writes", WRITE_RATE_PER_USER, WRITE_BURST_PER_USER)
+ip_writes = TokenBucketLimiter("ip_writes", WRITE_RATE_PER_IP, WRITE_BURST_PER_IP)
+# The limiters /metrics reports on
+limiters = {l.name: l for l in (user_writes, ip_writes)}
+
+class AdmissionMiddleware:
+    """Pure ASGI; sheds a request before it is routed, so it costs no DB work at all."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in ADMISSION_EXEMPT:
+            kind = "read" if scope["method"] in READ_METHODS else "write"
+            limit = ADMISSION_MAX_WAITING if kind == "read" else ADMISSION_MAX_WAITING_WRITES
+            if limit and pool_waits.waiting >= limit:
+                shed[kind] += 1
+                response = JSONResponse({"detail": "Server busy, try again shortly"}, status_code=503,
+                                        headers={"Retry-After": str(ADMISSION_RETRY_AFTER)})
+                return await response(scope, receive, send)
+        await self.app(scope, receive, send)
@@ -0,0 +1,189 @@
+"""Schema migrations and seed data, run at deploy time or by the app's startup hook.
+
+    python manage.py migrate    create missing tables, columns and indexes; build the search
+                                index and summary counters if they are new; drop retired indexes
+    python manage.py seed       create the admin account if it does not exist
+    python manage.py init       migrate, then seed
+    python manage.py partition  Postgres only: LIST-partition the offer tables by campus (see below)
+"""
+import hashlib
+import re
+import sys
+from datetime import date
+
+ADMIN_EMAIL = "admin@dinemarketplace.com"
+
+# Full-table listing indexes replaced by the partial ones over active offers, then the
+# platform-wide partial ones replaced by campus-leading ones
+RETIRED_INDEXES = [
+    "ix_meal_offers_status_created", "ix_meal_offers_status_type_created", "ix_meal_offers_status_price",
+    "ix_item_offers_status_created", "ix_item_offers_status_category_created", "ix_item_offers_status_price",
+    "ix_meal_offers_active_type_created", "ix_meal_offers_active_price",
+    "ix_item_offers_active_category_created", "ix_item_offers_active_price",
+]
+OFFER_TABLES = ["meal_offers", "item_offers"]
+
+def add_enum_values(engine):
+    """Postgres enum types do not grow with the Python enum; add any new OfferStatus values."""
+    from sqlalchemy import text
+    from models import OfferStatus
+    if engine.dialect.name != "postgresql":
+        return
+    # ALTER TYPE ... ADD VALUE cannot run inside a transaction block before Postgres 12
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.execute(text("SELECT to_regtype('offerstatus') IS NOT NULL")).scalar():
+            for status in OfferStatus:
+                conn.execute(text(f"ALTER TYPE offerstatus ADD VALUE IF NOT EXISTS '{status.name}'"))
+
+def add_offer_campus(engine):
+    """Add the NOT NULL offers.university column (see models.py) to existing offer tables.
+
+    sync_schema only adds nullable columns, and this one must exist before the campus indexes
+    are built, so it is added here: nullable, filled from the seller's university, then made
+    NOT NULL. SQLite cannot add that constraint to an existing column, so there the column is
+    added NOT NULL with an empty default before the backfill. Tables that already have a
+    nullable column (from before the constraint) are backfilled and, on Postgres, constrained.
+    """
+    from sqlalchemy import inspect, text
+    postgres = engine.dialect.name == "postgresql"
+    with engine.begin() as conn:
+        insp = inspect(conn)
+        for table in OFFER_TABLES + [f"{t}_archive" for t in OFFER_TABLES]:
+            if not insp.has_table(table):
+                continue
+            column = {c["name"]: c for c in insp.get_columns(table)}.get("university")
+            if column is not None and not column["nullable"]:
+                continue
+            if column is None:
+                constraint = "" if postgres else " NOT NULL DEFAULT ''"
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN university VARCHAR(255){constraint}"))
+            n = conn.execute(text(f"UPDATE {table} SET university = COALESCE((SELECT university FROM users WHERE users.id = {table}.seller_id), '') "
+                                  "WHERE university IS NULL OR university = ''")).rowcount
+            if postgres:
+                conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN university SET NOT NULL"))
+            if n:
+                print(f"Set university on {n} rows of {table}")
+
+def migrate():
+    from sqlalchemy import text
+    from db import SessionLocal, engine, sync_schema
+    import search
+    import summary
+    import usage
+    add_enum_values(engine)
+    add_offer_campus(engine)
+    sync_schema()
+    with engine.begin() as conn:
+        for name in RETIRED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    search.ensure_index(engine)
+    session = SessionLocal()
+    try:
+        summary.ensure(session)
+        usage.ensure(session)
+    finally:
+        session.close()
+
+def seed_admin():
+    from auth import hash_password
+    from db import SessionLocal
+    from models import User
+    session = SessionLocal()
+    try:
+        # Check if admin user already exists
+        admin_user = session.query(User).filter_by(email=ADMIN_EMAIL).first()
+        if not admin_user:
+            admin_user = User(
+                email=ADMIN_EMAIL,
+                password_hash=hash_password("admin123"),
+                university="Admin",
+                total_meals=0,
+                expires_on=date.today(),
+                meal_distribution="semester",
+                weekly_meals=0
+            )
+            session.add(admin_user)
+            session.commit()
+            print("Admin user created successfully")
+    except Exception as e:
+        print(f"Error creating admin user: {e}")
+        session.rollback()
+    finally:
+        session.close()
+
+def init():
+    migrate()
+    seed_admin()
+
+# Campus partitioning (optional, Postgres only). The campus-leading indexes already keep listing
+# queries to their own campus's index entries; partitioning goes further and gives every campus
+# its own physical table, so a campus's listings, vacuum and cache footprint are independent of
+# the rest of the platform. The first run turns each offer table into a LIST-partitioned table
+# with a DEFAULT partition; every run (first included) then moves each campus found in DEFAULT
+# into a partition of its own, so run it again after new campuses sign up. Queries, models and
+# migrations are unchanged: Postgres routes rows and prunes partitions itself. Every step takes
+# an exclusive lock on the table it rewrites, so run it in a quiet window. The primary key
+# becomes (id, university), and foreign keys that point at an offer table (only item_search's)
+# are dropped, since they could only reference the full key.
+def partition_name(table: str, university: str) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "_", university.lower()).strip("_")[:30]
+    return f"{table}_c_{slug}_{hashlib.sha1(university.encode()).hexdigest()[:6]}"
+
+def _partition_table(conn, table: str):
+    from sqlalchemy import text
+    from sqlalchemy.schema import AddConstraint
+    from models import Base
+    old = f"{table}_unpartitioned"
+    for (name, child) in conn.execute(text("SELECT conname, conrelid::regclass::text FROM pg_constraint "
+                                           "WHERE contype = 'f' AND confrelid = CAST(:t AS regclass)"), {"t": table}).all():
+        print(f"Dropping foreign key {name} on {child}")
+        conn.execute(text(f'ALTER TABLE {child} DROP CONSTRAINT "{name}"'))
+    seq = conn.execute(text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": table}).scalar()
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    conn.execute(text(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY LIST (university)"))
+    conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, university)"))
+    conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+    conn.execute(text(f"INSERT INTO {table} SELECT * FROM {old}"))
+    if seq:
+        conn.execute(text(f"ALTER SEQUENCE {seq} OWNED BY {table}.id"))
+    conn.execute(text(f"DROP TABLE {old}"))
+    for fk in Base.metadata.tables[table].foreign_key_constraints:
+        conn.execute(AddConstraint(fk))
+    print(f"Partitioned {table} by university")
+
+def _split_campuses(conn, table: str):
+    from sqlalchemy import text
+    default = f"{table}_default"
+    for (university,) in conn.execute(text(f"SELECT DISTINCT university FROM {default}")).all():
+        part = partition_name(table, university)
+        conn.execute(text(f"CREATE TABLE {part} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        n = conn.execute(text(f"INSERT INTO {part} SELECT * FROM {default} WHERE university = :u"), {"u": university}).rowcount
+        conn.execute(text(f"DELETE FROM {default} WHERE university = :u"), {"u": university})
+        # DDL takes no bind parameters (and text() still parses colons). Attaching builds the
+        # parent's indexes on the new partition.
+        quoted = "'" + university.replace("'", "''").replace(":", "\\:") + "'"
+        conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {part} FOR VALUES IN ({quoted})"))
+        print(f"Moved {n} {table} rows for {university!r} into {part}")
+
+def partition():
+    from sqlalchemy import text
+    from db import engine, sync_schema
+    if engine.dialect.name != "postgresql":
+        sys.exit("Campus partitioning needs Postgres; on SQLite the campus-leading indexes already scope listings")
+    migrate()
+    for table in OFFER_TABLES:
+        with engine.begin() as conn:
+            kind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table}).scalar()
+            if kind != "p":
+                _partition_table(conn, table)
+        # The old table took its indexes with it; recreate them on the partitioned table
+        sync_schema()
+        with engine.begin() as conn:
+            _split_campuses(conn, table)
+
+if __name__ == "__main__":
+    commands = {"migrate": migrate, "seed": seed_admin, "init": init, "partition": partition}
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd not in commands:
+        sys.exit("usage: python manage.py migrate|seed|init|partition")
+    commands[cmd]()
@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+from cache import caches
+from db import async_engine, engine, pool_waits
+from ws import hub
+import limits
+
+# Per-process request metrics, served by GET /metrics in the Prometheus text format. Each
+# worker reports its own numbers; scrape every worker (or sum them) for the whole picture.
+#
+# The middleware keeps a RequestStats in a context variable for the life of each request;
+# the engine's cursor hooks add to it, so every query and its DB time count against the
+# route that issued it, including ones run on the threadpool or through the async engine.
+# With SLOW_REQUEST_MS set, requests slower than that are logged as a warning, one JSON line
+# with the SQL they ran (statements only, never parameters).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+SLOW_LOG_STATEMENTS = 50
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+log = logging.getLogger(__name__)
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self, keep_statements: bool):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = [] if keep_statements else None
+
+current: ContextVar = ContextVar("request_stats", default=None)
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.latency = {}     # (method, route) -> Histogram of seconds
+        self.queries = {}     # (method, route) -> Histogram of queries per request
+        self.db_seconds = {}  # (method, route) -> total DB time
+        self.responses = {}   # (method, route, status) -> count
+        self.slow = 0
+
+    def record(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        key = (method, route)
+        with self._lock:
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.queries[key] = Histogram(QUERY_BUCKETS)
+                self.db_seconds[key] = 0.0
+            self.latency[key].observe(seconds)
+            self.queries[key].observe(stats.queries)
+            self.db_seconds[key] += stats.db_seconds
+            self.responses[key + (status,)] = self.responses.get(key + (status,), 0) + 1
+
+registry = Registry()
+
+@event.listens_for(engine, "before_cursor_execute")
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's own context, so a statement that raises leaves nothing behind
+    if current.get() is not None and context is not None:
+        context._metrics_start = time.perf_counter()
+
+@event.listens_for(engine, "after_cursor_execute")
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    stats = current.get()
+    started = getattr(context, "_metrics_start", None)
+    if stats is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats.queries += 1
+    stats.db_seconds += elapsed
+    if stats.statements is not None and len(stats.statements) < SLOW_LOG_STATEMENTS:
+        stats.statements.append({"sql": statement[:500], "ms": round(elapsed * 1000, 2)})
+
+def route_of(scope) -> str:
+    # The path template, so /offers/meals/1 and /offers/meals/2 share a series
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+def log_slow(method: str, route: str, path: str, status: int, seconds: float, stats: RequestStats):
+    registry.slow += 1
+    log.warning(json.dumps({"slow_request": {"method": method, "route": route, "path": path, "status": status,
+                                             "ms": round(seconds * 1000, 1), "queries": stats.queries,
+                                             "db_ms": round(stats.db_seconds * 1000, 1), "sql": stats.statements}}))
+
+class MetricsMiddleware:
+    """Pure ASGI, so streamed bodies are timed to their last chunk and nothing is buffered."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats(keep_statements=SLOW_REQUEST_MS > 0)
+        token = current.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            current.reset(token)
+            method, route = scope["method"], route_of(scope)
+            registry.record(method, route, status, elapsed, stats)
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                log_slow(method, route, scope["path"], status, elapsed, stats)
+
+def _labels(**labels) -> str:
+    def esc(v):
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels.items()) + "}"
+
+class _Writer:
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name: str, kind: str, help_text: str):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value, **labels):
+        self.lines.append(f"{name}{_labels(**labels) if labels else ''} {value}")
+
+    def histogram(self, name: str, buckets: tuple, counts: list, total: float, count: int, **labels):
+        running = 0
+        for bound, n in zip(buckets, counts):
+            running += n
+            self.sample(f"{name}_bucket", running, **labels, le=bound)
+        self.sample(f"{name}_bucket", count, **labels, le="+Inf")
+        self.sample(f"{name}_sum", round(total, 6), **labels)
+        self.sample(f"{name}_count", count, **labels)
+
+def render() -> str:
+    w = _Writer()
+    with registry._lock:
+        latency = {k: (h.counts[:], h.sum, h.count) for k, h in registry.latency.items()}
+        queries = {k: (h.counts[:], h.sum, h.count) for k, h in registry.queries.items()}
+        db_seconds = dict(registry.db_seconds)
+        responses = dict(registry.responses)
+        slow = registry.slow
+
+    w.family("http_requests_total", "counter", "Responses by route and status code.")
+    for (method, route, status), n in sorted(responses.items()):
+        w.sample("http_requests_total", n, method=method, route=route, status=status)
+    w.family("http_request_duration_seconds", "histogram", "Request latency by route, to the last body byte.")
+    for (method, route), (counts, total, count) in sorted(latency.items()):
+        w.histogram("http_request_duration_seconds", LATENCY_BUCKETS, counts, total, count, method=method, route=route)
+    w.family("http_request_db_queries", "histogram", "SQL statements per request by route.")
+    for (method, route), (counts, total, count) in sorted(queries.items()):
+        w.histogram("http_request_db_queries", QUERY_BUCKETS, counts, total, count, method=method, route=route)
+    w.family("http_request_db_seconds_total", "counter", "Time spent executing SQL by route.")
+    for (method, route), total in sorted(db_seconds.items()):
+        w.sample("http_request_db_seconds_total", round(total, 6), method=method, route=route)
+    w.family("http_slow_requests_total", "counter", "Requests slower than SLOW_REQUEST_MS.")
+    w.sample("http_slow_requests_total", slow)
+
+    buckets, counts, total, count, timeouts = pool_waits.histogram()
+    w.family("db_pool_checkout_wait_seconds", "histogram", "Time spent waiting for a pooled connection.")
+    w.histogram("db_pool_checkout_wait_seconds", buckets, counts, total, count)
+    w.family("db_pool_checkout_timeouts_total", "counter", "Checkouts that gave up after DB_POOL_TIMEOUT.")
+    w.sample("db_pool_checkout_timeouts_total", timeouts)
+    w.family("db_pool_waiting", "gauge", "Requests waiting for a pooled connection right now.")
+    w.sample("db_pool_waiting", pool_waits.waiting)
+    w.family("db_pool_connections", "gauge", "Pooled connections by engine and state.")
+    for name, pool in (("sync", engine.pool), ("async", async_engine.pool)):
+        if hasattr(pool, "checkedout"):
+            w.sample("db_pool_connections", pool.checkedout(), engine=name, state="checked_out")
+            w.sample("db_pool_connections", pool.checkedin(), engine=name, state="idle")
+            w.sample("db_pool_connections", max(0, pool.overflow()), engine=name, state="overflow")
+
+    w.family("http_rate_limited_total", "counter", "Write requests refused with 429, by limiter.")
+    for name, limiter in sorted(limits.limiters.items()):
+        w.sample("http_rate_limited_total", limiter.limited, limiter=name)
+    w.family("http_shed_total", "counter", "Requests refused with 503 by admission control.")
+    for kind, n in sorted(limits.shed.items()):
+        w.sample("http_shed_total", n, kind=kind)
+
+    w.family("ws_room_connections", "gauge", "Open WebSockets per hub room in this worker.")
+    for room, n in sorted(hub.room_sizes().items()):
+        w.sample("ws_room_connections", n, room=room)
+    w.family("ws_dropped_total", "counter", "Sockets disconnected for falling behind.")
+    w.sample("ws_dropped_total", hub.dropped)
+    if hasattr(hub.broker, "sent"):
+        w.family("pubsub_datagrams_total", "counter", "Datagrams sent to sibling workers, and those dropped.")
+        w.sample("pubsub_datagrams_total", hub.broker.sent, result="sent")
+        w.sample("pubsub_datagrams_total", hub.broker.dropped, result="dropped")
+
+    stats = {name: c.stats() for name, c in sorted(caches.items())}
+    for metric, key, kind, help_text in (("cache_hits_total", "hits", "counter", "Cache lookups that hit."),
+                                         ("cache_misses_total", "misses", "counter", "Cache lookups that missed."),
+                                         ("cache_evictions_total", "evictions", "counter", "Entries evicted for space."),
+                                         ("cache_entries", "size", "gauge", "Entries currently cached."),
+                                         ("cache_hit_ratio", "hit_ratio", "gauge", "Hits over lookups since start.")):
+        w.family(metric, kind, help_text)
+        for name, s in stats.items():
+            w.sample(metric, s[key], cache=name)
+    return "\n".join(w.lines) + "\n"
@@ -1,19 +1,33 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, Float, ForeignKey, Text, Enum, Boolean
+from sqlalchemy import Column, Integer, String, Date, DateTime, Float, ForeignKey, Text, Enum, Boolean, Index, Table, text
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 from db import Base
 from enum import Enum as PyEnum
 
+# SQLite's CURRENT_TIMESTAMP has no fractional seconds. Bind datetimes in the same format so
+# range and keyset comparisons against server-default timestamps line up.
+Timestamp = DateTime(timezone=True).with_variant(sqlite.DATETIME(truncate_microseconds=True), "sqlite")
+
 class OfferStatus(PyEnum):
     active = "active"
     accepted = "accepted"
     cancelled = "cancelled"
+    expired = "expired"
+
+# Listings only show active offers, and finished ones are archived before long (see expiry.py),
+# so the listing indexes are partial over the active set and stay the size of the live market.
+ACTIVE = text("status = 'active'")
+
+def active_index(name: str, *columns) -> Index:
+    return Index(name, *columns, sqlite_where=ACTIVE, postgresql_where=ACTIVE)
 
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True)
     email = Column(String(255), unique=True, index=True, nullable=False)
     password_hash = Column(String(255), nullable=False)
-    university = Column(String(255), nullable=False)
+    university = Column(String(255), nullable=False, index=True)
     total_meals = Column(Integer, default=0, nullable=False)
     expires_on = Column(Date, nullable=False)
     # New field to capture how meals are distributed. Possible values:
@@ -21,12 +35,22 @@ class User(Base):
     meal_distribution = Column(String(32), default="semester", nullable=False)
     # For weekly plans, this holds the number of meals available each week. It is ignored for semester plans.
     weekly_meals = Column(Integer, default=0, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
 
 class MealOffer(Base):
     __tablename__ = "meal_offers"
+    # Listings page one campus's active offers by (created_at, id), so the campus leads the
+    # listing indexes and a query reads only its own campus's entries
+    __table_args__ = (
+        active_index("ix_meal_offers_active_created", "created_at", "id"),
+        active_index("ix_meal_offers_active_campus_created", "university", "created_at", "id"),
+        active_index("ix_meal_offers_active_campus_type_created", "university", "meal_type", "created_at", "id"),
+        active_index("ix_meal_offers_active_campus_price", "university", "price"),
+    )
     id = Column(Integer, primary_key=True)
-    seller_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    seller_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # The seller's campus, copied in when the offer is created (manage.py migrate fills older rows)
+    university = Column(String(255), nullable=False)
     meals = Column(Integer, nullable=False)
     location = Column(String(255), nullable=False)
     price = Column(Float, nullable=False)
@@ -35,21 +59,32 @@ class MealOffer(Base):
     status = Column(Enum(OfferStatus), default=OfferStatus.active, nullable=False)
     accepted_by_id = Column(Integer, ForeignKey("users.id"))
     buyer_message = Column(Text)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
 
 class ItemOffer(Base):
     __tablename__ = "item_offers"
+    __table_args__ = (
+        active_index("ix_item_offers_active_created", "created_at", "id"),
+        active_index("ix_item_offers_active_campus_created", "university", "created_at", "id"),
+        active_index("ix_item_offers_active_campus_category_created", "university", "category", "created_at", "id"),
+        active_index("ix_item_offers_active_campus_price", "university", "price"),
+    )
     id = Column(Integer, primary_key=True)
-    seller_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    seller_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    university = Column(String(255), nullable=False)
     name = Column(String(255), nullable=False)
     category = Column(String(100), nullable=False)
     price = Column(Float, nullable=False)
-    img_data_url = Column(Text)
+    # Legacy inline base64 image; new uploads go to the blob store (see images.py). Deferred so
+    # listings never load it.
+    img_data_url = deferred(Column(Text))
+    img_key = Column(String(64))
+    thumb_key = Column(String(64))
     baseline = Column(Float, default=0)
     status = Column(Enum(OfferStatus), default=OfferStatus.active, nullable=False)
     accepted_by_id = Column(Integer, ForeignKey("users.id"))
     buyer_message = Column(Text)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
 
 class Transaction(Base):
     __tablename__ = "transactions"
@@ -58,33 +93,71 @@ class Transaction(Base):
     listing_id = Column(Integer, nullable=False)
     seller_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     buyer_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
 
 class Thread(Base):
     __tablename__ = "threads"
+    # One conversation per listing; accept relies on this rather than a read-then-insert
+    __table_args__ = (Index("uq_threads_kind_listing", "kind", "listing_id", unique=True),)
     id = Column(Integer, primary_key=True)
     kind = Column(String(16), nullable=False)
     listing_id = Column(Integer, nullable=False)
-    seller_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    buyer_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    seller_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    buyer_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # Closed by expiry.py once the conversation goes quiet; a new message reopens it
     open = Column(Boolean, default=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
 
 class Message(Base):
     __tablename__ = "messages"
+    # Last-message lookups and unread counts seek by thread and message id; history pages seek
+    # by thread and (created_at, id)
+    __table_args__ = (
+        Index("ix_messages_thread_id_id", "thread_id", "id"),
+        Index("ix_messages_thread_id_created", "thread_id", "created_at", "id"),
+    )
     id = Column(Integer, primary_key=True)
     thread_id = Column(Integer, ForeignKey("threads.id"), nullable=False)
     sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     body = Column(Text, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
+
+# Per-user read cursor for a thread: messages with a higher id are unread.
+class ThreadRead(Base):
+    __tablename__ = "thread_reads"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    thread_id = Column(Integer, ForeignKey("threads.id"), primary_key=True)
+    last_read_message_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(Timestamp, server_default=func.now(), onupdate=func.now())
 
 class UsageAdjustment(Base):
     __tablename__ = "usage_adjustments"
+    # A replayed batch entry hits this index and is skipped (NULL keys never collide)
+    __table_args__ = (Index("uq_usage_adjustments_user_key", "user_id", "client_key", unique=True),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     meals_used_delta = Column(Integer, nullable=False)
     note = Column(String(255))
-    at = Column(DateTime(timezone=True), server_default=func.now())
+    at = Column(Timestamp, server_default=func.now())
+    # Idempotency key the client sent with a batched adjustment
+    client_key = Column(String(64))
+
+
+# Usage rollups maintained alongside every UsageAdjustment insert (see usage.py).
+class UsageWeek(Base):
+    __tablename__ = "usage_weeks"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    week_start = Column(Date, primary_key=True)  # Monday of the ISO week
+    used = Column(Integer, nullable=False, default=0)
+    net_delta = Column(Integer, nullable=False, default=0)
+    entries = Column(Integer, nullable=False, default=0)
+
+class UsageTotal(Base):
+    __tablename__ = "usage_totals"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    used = Column(Integer, nullable=False, default=0)
+    net_delta = Column(Integer, nullable=False, default=0)
+    entries = Column(Integer, nullable=False, default=0)
 
 
 # New model for user comments. Comments are displayed publicly on the home page and in user dashboards.
@@ -97,7 +170,7 @@ class Comment(Base):
     university = Column(String(255), nullable=True)
     # The comment text itself.
     body = Column(Text, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
 
 
 # Campus meal prices for different meal types (e.g., breakfast, lunch, dinner).
@@ -107,7 +180,7 @@ class MealPrice(Base):
     university = Column(String(255), nullable=False)
     meal_type = Column(String(64), nullable=False)  # e.g. breakfast, lunch, dinner
     price = Column(Float, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
 
 
 # Removed duplicate MealPrice model definition; see above for the single definition used.
@@ -123,4 +196,26 @@ class Activity(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     action = Column(String(128), nullable=False)
     details = Column(Text, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
+
+# Row counts for /admin/summary, kept current by summary.py as rows are flushed. A counter may
+# be split over several rows ("name", "name#1", ...) whose values add up to it.
+class Counter(Base):
+    __tablename__ = "counters"
+    name = Column(String(64), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+# Archive copies of finished offers with their transactions, threads and messages, moved out of
+# the hot tables by expiry.py. Same columns and ids as the originals, without foreign keys or
+# secondary indexes, plus the time the row was archived.
+def archive_of(model) -> Table:
+    columns = [Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False, nullable=c.nullable)
+               for c in model.__table__.columns]
+    return Table(f"{model.__tablename__}_archive", Base.metadata, *columns,
+                 Column("archived_at", Timestamp, server_default=func.now()))
+
+meal_offers_archive = archive_of(MealOffer)
+item_offers_archive = archive_of(ItemOffer)
+transactions_archive = archive_of(Transaction)
+threads_archive = archive_of(Thread)
+messages_archive = archive_of(Message)
@@ -0,0 +1,46 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+# Keyset ("seek") pagination over (created_at, id). Cursors are opaque to clients:
+# url-safe base64 of the last row's timestamp and id.
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        pad = "=" * (-len(cursor) % 4)
+        ts, row_id = json.loads(base64.urlsafe_b64decode(cursor + pad))
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def seek_before(created_col, id_col, cursor: str):
+    """Filter for rows that come after `cursor` in (created_at DESC, id DESC) order."""
+    ts, row_id = decode_cursor(cursor)
+    return or_(created_col < ts, and_(created_col == ts, id_col < row_id))
+
+def next_cursor(rows: list, limit: int, key=lambda r: r):
+    """Cursor for the page following `rows`, or None when the page was not full."""
+    if len(rows) < limit:
+        return None
+    last = key(rows[-1])
+    return encode_cursor(last.created_at, last.id)
+
+# Ranked results (search) have no stable sort key to seek on, so their cursors carry an offset.
+
+def encode_offset(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"o": offset}).encode()).decode().rstrip("=")
+
+def decode_offset(cursor: str) -> int:
+    try:
+        pad = "=" * (-len(cursor) % 4)
+        offset = int(json.loads(base64.urlsafe_b64decode(cursor + pad))["o"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if offset < 0:
+        raise ValueError("Invalid cursor")
+    return offset
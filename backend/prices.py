@@ -0,0 +1,73 @@
+import threading
+from sqlalchemy import select
+from models import MealPrice
+from ws import hub
+
+# Campus meal prices held in memory as {(university, meal_type): price}. The table is tiny and
+# read on every meal listing, so it is loaded once and reloaded only after upsert_meal_price
+# announces a change (to every worker, through the hub).
+
+PRICES_ROOM = "cache:mealprices"
+
+class PriceTable:
+    def __init__(self):
+        self.prices: dict | None = None
+        self.generation = 0
+        self.loads = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self, _text=None):
+        with self._lock:
+            self.generation += 1
+            self.prices = None
+
+    async def get(self, session) -> dict:
+        prices = self.prices
+        if prices is not None:
+            return prices
+        generation = self.generation
+        rows = (await session.execute(select(MealPrice.university, MealPrice.meal_type, MealPrice.price))).all()
+        prices = {(uni, meal_type): price for uni, meal_type, price in rows}
+        with self._lock:
+            # A change announced while loading wins; the next caller reloads
+            if generation == self.generation:
+                self.prices = prices
+                self.loads += 1
+        return prices
+
+table = PriceTable()
+hub.on(PRICES_ROOM, table.invalidate)
+
+def changed():
+    hub.publish(PRICES_ROOM, {})
+
+def savings(base: float | None, price: float) -> float | None:
+    """Per-meal saving against the campus price; None when the campus has no price for the type."""
+    if base is None:
+        return None
+    return round(max(0.0, base - price), 2)
+
+def campus_savings(prices: dict, university: str, rows) -> dict:
+    """Aggregate (meal_type, price, meals) rows for one campus. Only offers below the campus
+    price count towards the average, matching what the dashboard shows."""
+    by_type = {}
+    saved = meals_below = offers = meals = 0
+    for meal_type, price, n_meals, n_offers in rows:
+        offers += n_offers
+        meals += n_meals
+        t = by_type.setdefault(meal_type, {"base_price": prices.get((university, meal_type)), "offers": 0, "meals": 0, "savings": 0.0})
+        t["offers"] += n_offers
+        t["meals"] += n_meals
+        per_meal = savings(t["base_price"], price)
+        if per_meal:
+            t["savings"] = round(t["savings"] + per_meal * n_meals, 2)
+            saved += per_meal * n_meals
+            meals_below += n_meals
+    return {
+        "university": university,
+        "offers": offers,
+        "meals": meals,
+        "total_savings": round(saved, 2),
+        "avg_savings_per_meal": round(saved / meals_below, 2) if meals_below else 0.0,
+        "by_meal_type": by_type,
+    }
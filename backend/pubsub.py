@@ -0,0 +1,180 @@
+import glob
+import os
+import queue
+import socket
+import stat
+import tempfile
+import threading
+import time
+
+# Pub/sub transports behind the WebSocket Hub. A broker delivers every published message to
+# the local hub and, for multi-worker deployments, to the hubs in sibling worker processes.
+#
+#   HUB_BACKEND=memory  (default) single process only
+#   HUB_BACKEND=unix    workers on one host exchange datagrams over Unix sockets in PUBSUB_DIR
+#
+# Delivery is best effort, like the sockets it feeds. publish() only delivers locally and
+# queues the datagram; a sender thread does the socket writes, so a slow sibling never holds up
+# the caller (often the event loop). A send to a peer whose queue is full waits at most
+# PUBSUB_SEND_TIMEOUT seconds on that thread, then the peer misses the message; once
+# PUBSUB_QUEUE datagrams are waiting, new ones are dropped. Messages from one publisher
+# arrive in order.
+PUBSUB_SEND_TIMEOUT = float(os.getenv("PUBSUB_SEND_TIMEOUT", "0.05"))
+PUBSUB_QUEUE = int(os.getenv("PUBSUB_QUEUE", "1000"))
+
+class InProcessBroker:
+    def __init__(self):
+        self.deliver = None
+
+    def attach(self, deliver):
+        self.deliver = deliver
+
+    def start(self):
+        pass
+
+    def publish(self, room: str, text: str):
+        if self.deliver:
+            self.deliver(room, text)
+
+    def close(self):
+        pass
+
+class UnixSocketBroker(InProcessBroker):
+    """Fan out to every worker that has bound a datagram socket in `directory`.
+
+    The directory must be private to this user (it is created 0700), since any process that
+    can write a socket into it receives every message.
+    """
+    MAX_DATAGRAM = 64 * 1024
+    _STOP = object()
+
+    def __init__(self, directory: str, name: str | None = None):
+        super().__init__()
+        self.directory = directory
+        self.path = os.path.join(directory, f"{name or os.getpid()}.sock")
+        self.sent = 0
+        self.dropped = 0
+        self._send = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._send.settimeout(PUBSUB_SEND_TIMEOUT)
+        self._outbox = queue.Queue(maxsize=PUBSUB_QUEUE)
+        self._sender = None
+        self._peers = []
+        self._peers_mtime = None
+        self._recv = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_directory(self):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        st = os.stat(self.directory)
+        if st.st_uid != os.getuid() or st.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+            raise PermissionError(f"PUBSUB_DIR {self.directory} must be owned by this user with mode 0700")
+
+    def start(self):
+        with self._lock:
+            self._start_sender()
+            if self._recv is not None:
+                return
+            self._ensure_directory()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self._recv = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._recv.bind(self.path)
+            self._thread = threading.Thread(target=self._listen, name="pubsub-recv", daemon=True)
+            self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                data = self._recv.recv(self.MAX_DATAGRAM)
+            except OSError:
+                return
+            room, _, text = data.decode().partition("\n")
+            if self.deliver:
+                self.deliver(room, text)
+
+    def _start_sender(self):
+        # Called with self._lock held
+        if self._sender is None:
+            self._sender = threading.Thread(target=self._send_loop, name="pubsub-send", daemon=True)
+            self._sender.start()
+
+    def publish(self, room: str, text: str):
+        super().publish(room, text)
+        data = f"{room}\n{text}".encode()
+        if len(data) > self.MAX_DATAGRAM:
+            self.dropped += 1
+            return
+        if self._sender is None:
+            self.start()
+        try:
+            self._outbox.put_nowait(data)
+        except queue.Full:
+            self.dropped += 1
+
+    def peers(self) -> list:
+        """Sibling sockets, re-listed only when the directory changes (a worker came or went)."""
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if mtime != self._peers_mtime:
+            self._peers_mtime = mtime
+            self._peers = [p for p in glob.glob(os.path.join(self.directory, "*.sock")) if p != self.path]
+        return self._peers
+
+    def _send_loop(self):
+        while True:
+            data = self._outbox.get()
+            try:
+                if data is self._STOP:
+                    return
+                for peer in self.peers():
+                    self._send_one(data, peer)
+            finally:
+                self._outbox.task_done()
+
+    def _send_one(self, data: bytes, peer: str):
+        try:
+            self._send.sendto(data, peer)
+            self.sent += 1
+        except (ConnectionRefusedError, FileNotFoundError):
+            # The worker behind this socket has exited
+            try:
+                os.unlink(peer)
+            except OSError:
+                pass
+            self._peers_mtime = None
+        except OSError:
+            # Timed out or the peer's queue is full (EAGAIN/ENOBUFS); this thread must not die
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until the sender thread has sent (or dropped) every queued datagram."""
+        deadline = time.monotonic() + timeout
+        while self._outbox.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return not self._outbox.unfinished_tasks
+
+    def close(self):
+        with self._lock:
+            if self._sender is not None:
+                self._outbox.put(self._STOP)
+                self._sender.join(1)
+                self._sender = None
+            if self._recv is not None:
+                self._recv.close()
+                self._recv = None
+                try:
+                    os.unlink(self.path)
+                except OSError:
+                    pass
+        self._send.close()
+
+def make_broker():
+    backend = os.getenv("HUB_BACKEND", "memory")
+    if backend == "unix":
+        return UnixSocketBroker(os.getenv("PUBSUB_DIR", os.path.join(tempfile.gettempdir(), f"meal-pubsub-{os.getuid()}")))
+    if backend != "memory":
+        raise ValueError(f"Unknown HUB_BACKEND {backend!r}")
+    return InProcessBroker()
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List
 from datetime import date, datetime
 from enum import Enum
@@ -7,6 +7,7 @@ class OfferStatus(str, Enum):
     active = "active"
     accepted = "accepted"
     cancelled = "cancelled"
+    expired = "expired"
 
 class AuthSignup(BaseModel):
     email: EmailStr
@@ -51,6 +52,9 @@ class MealOfferOut(BaseModel):
     status: OfferStatus
     accepted_by: Optional[str] = None
     created_at: datetime
+    # Campus price for this meal type and the per-meal saving against it, when the campus has one
+    base_price: Optional[float] = None
+    savings: Optional[float] = None
     class Config:
         from_attributes = True
 
@@ -68,7 +72,8 @@ class ItemOfferOut(BaseModel):
     category: str
     price: float
     discount: int
-    img: Optional[str] = None
+    img: Optional[str] = None  # thumbnail URL
+    img_full: Optional[str] = None
     status: OfferStatus
     accepted_by: Optional[str] = None
     created_at: datetime
@@ -83,12 +88,14 @@ class ThreadOut(BaseModel):
     kind: str
     other_party: str
     last_body: Optional[str] = None
+    last_at: Optional[datetime] = None
     unread: int
 
 class MessageIn(BaseModel):
     body: str
 
 class MessageOut(BaseModel):
+    id: int
     from_email: str
     body: str
     when: datetime
@@ -97,6 +104,17 @@ class UsageAdjustIn(BaseModel):
     meals_used_delta: int
     note: Optional[str] = None
 
+class UsageAdjustBatchItem(BaseModel):
+    meals_used_delta: int
+    note: Optional[str] = Field(None, max_length=255)
+    # When the meal was recorded on the device; defaults to when the batch arrives
+    at: Optional[datetime] = None
+    # Unique per adjustment on the client, so a retried batch is not counted twice
+    key: Optional[str] = Field(None, min_length=1, max_length=64)
+
+class UsageAdjustBatchIn(BaseModel):
+    adjustments: List[UsageAdjustBatchItem] = Field(..., min_length=1, max_length=500)
+
 
 # Comment submission schema
 class CommentIn(BaseModel):
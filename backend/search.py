@@ -0,0 +1,140 @@
+import re
+from sqlalchemy import Float, Integer, event, inspect, select, text
+from sqlalchemy.orm import Session
+from models import ItemOffer, OfferStatus
+
+# Full-text search over active item offers. SQLite uses an FTS5 table and Postgres a tsvector
+# table with a GIN index; both are called item_search, keyed by item id, and hold only active
+# offers, so a status change out of active removes the row.
+#
+# Besides the words of name and category, each row gets normalized "codes" so the identifiers
+# students search by match however they are written: ISBNs (hyphens dropped, ISBN-10 mapped to
+# ISBN-13) become e.g. isbn9780134685991, and course codes like "CS 101" / "cs-101" become cs101.
+
+ISBN_RE = re.compile(r"(?<![\w-])\d[\d-]{8,15}[\dXx](?![\w-])")
+COURSE_RE = re.compile(r"\b([A-Za-z]{2,4})[\s-]?(\d{3,4}[A-Za-z]?)\b")
+WORD_RE = re.compile(r"[^\W_]+")
+
+# Relative weight of a match in each column
+WEIGHTS = {"name": 4.0, "category": 1.0, "codes": 8.0}
+
+def isbn13(raw: str) -> str | None:
+    """Canonical ISBN-13 for a 10- or 13-digit ISBN with a valid check digit, else None."""
+    s = re.sub(r"[^0-9Xx]", "", raw).upper()
+    if len(s) == 10 and s[:9].isdigit():
+        total = sum((10 - i) * (10 if c == "X" else int(c)) for i, c in enumerate(s))
+        if s[9] not in "0123456789X" or total % 11:
+            return None
+        s = "978" + s[:9]
+        return s + str((10 - sum((3 if i % 2 else 1) * int(c) for i, c in enumerate(s)) % 10) % 10)
+    if len(s) == 13 and s.isdigit():
+        return s if sum((3 if i % 2 else 1) * int(c) for i, c in enumerate(s)) % 10 == 0 else None
+    return None
+
+def codes(*texts: str) -> list:
+    out = set()
+    for t in texts:
+        for m in ISBN_RE.finditer(t or ""):
+            isbn = isbn13(m.group())
+            if isbn:
+                out.add("isbn" + isbn)
+        for dept, num in COURSE_RE.findall(t or ""):
+            out.add((dept + num).lower())
+    return sorted(out)
+
+def parse_query(q: str) -> list:
+    """Split a user query into AND-ed clauses, each a list of alternative token sequences.
+    A token is (text, prefix): ISBNs and course codes must match exactly, words by prefix."""
+    clauses = []
+    def take_isbn(m):
+        isbn = isbn13(m.group())
+        if not isbn:
+            return m.group()
+        clauses.append([[("isbn" + isbn, False)]])
+        return " "
+    def take_course(m):
+        dept, num = m.group(1).lower(), m.group(2).lower()
+        # Either the normalized code, or both halves as words for items that spell it differently
+        clauses.append([[(dept + num, False)], [(dept, True), (num, True)]])
+        return " "
+    rest = COURSE_RE.sub(take_course, ISBN_RE.sub(take_isbn, q))
+    clauses += [[[(w.lower(), True)]] for w in WORD_RE.findall(rest)]
+    return clauses
+
+def fts5_query(clauses: list) -> str:
+    def alt(tokens):
+        return "(" + " AND ".join(f'"{t}"' + ("*" if prefix else "") for t, prefix in tokens) + ")"
+    return " AND ".join("(" + " OR ".join(alt(a) for a in clause) + ")" for clause in clauses)
+
+def tsquery(clauses: list) -> str:
+    def alt(tokens):
+        return "(" + " & ".join(t + (":*" if prefix else "") for t, prefix in tokens) + ")"
+    return " & ".join("(" + " | ".join(alt(a) for a in clause) + ")" for clause in clauses)
+
+def _dialect(bind) -> str:
+    return bind.dialect.name
+
+def index_item(conn, item_id: int, name: str, category: str):
+    doc = {"id": item_id, "name": name or "", "category": category or "", "codes": " ".join(codes(name, category))}
+    if _dialect(conn) == "postgresql":
+        conn.execute(text(
+            "INSERT INTO item_search (item_id, document) VALUES (:id, "
+            "setweight(to_tsvector('simple', :name), 'B') || setweight(to_tsvector('simple', :category), 'D') "
+            "|| setweight(to_tsvector('simple', :codes), 'A')) "
+            "ON CONFLICT (item_id) DO UPDATE SET document = EXCLUDED.document"), doc)
+    else:
+        conn.execute(text("DELETE FROM item_search WHERE rowid = :id"), doc)
+        conn.execute(text("INSERT INTO item_search (rowid, name, category, codes) VALUES (:id, :name, :category, :codes)"), doc)
+
+def unindex_item(conn, item_id: int):
+    key = "item_id" if _dialect(conn) == "postgresql" else "rowid"
+    conn.execute(text(f"DELETE FROM item_search WHERE {key} = :id"), {"id": item_id})
+
+@event.listens_for(Session, "after_flush")
+def _sync_item_index(session, flush_context):
+    conn = None
+    for objs, removed in ((session.new, False), (session.dirty, False), (session.deleted, True)):
+        for obj in objs:
+            if not isinstance(obj, ItemOffer):
+                continue
+            if objs is session.dirty:
+                attrs = inspect(obj).attrs
+                if not any(attrs[a].history.has_changes() for a in ("status", "name", "category")):
+                    continue
+            conn = conn or session.connection()
+            if not removed and (obj.status or OfferStatus.active) == OfferStatus.active:
+                index_item(conn, obj.id, obj.name, obj.category)
+            else:
+                unindex_item(conn, obj.id)
+
+def hits(dialect: str, clauses: list):
+    """Subquery of (id, rank) for matching items; lower rank is a better match."""
+    if dialect == "postgresql":
+        q = text("SELECT item_id AS id, -ts_rank_cd(document, q) AS rank "
+                 "FROM item_search, to_tsquery('simple', :q) AS q WHERE document @@ q")
+        q = q.bindparams(q=tsquery(clauses))
+    else:
+        weights = ", ".join(str(w) for w in WEIGHTS.values())
+        q = text(f"SELECT rowid AS id, bm25(item_search, {weights}) AS rank FROM item_search WHERE item_search MATCH :q")
+        q = q.bindparams(q=fts5_query(clauses))
+    return q.columns(id=Integer, rank=Float).subquery("hits")
+
+def ensure_index(bind):
+    """Create item_search if missing and fill it from the active offers."""
+    with bind.begin() as conn:
+        if _dialect(conn) == "postgresql":
+            exists = conn.execute(text("SELECT to_regclass('item_search') IS NOT NULL")).scalar()
+            if not exists:
+                conn.execute(text("CREATE TABLE IF NOT EXISTS item_search (item_id INTEGER PRIMARY KEY REFERENCES item_offers(id) "
+                                  "ON DELETE CASCADE, document TSVECTOR NOT NULL)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_item_search_document ON item_search USING GIN (document)"))
+        else:
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'item_search'")).first() is not None
+            if not exists:
+                conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS item_search USING fts5(name, category, codes)"))
+        if exists:
+            return
+        rows = conn.execute(select(ItemOffer.id, ItemOffer.name, ItemOffer.category)
+                            .where(ItemOffer.status == OfferStatus.active)).all()
+        for item_id, name, category in rows:
+            index_item(conn, item_id, name, category)
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import random
+import sys
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.orm import Session, aliased
+from db import dialect_insert
+from models import User, MealOffer, ItemOffer, OfferStatus, Transaction, Thread, Message, Comment, MealPrice, UsageAdjustment, Activity, Counter
+
+# Counters and recent rows for /admin/summary. Row counts live in the `counters` table and are
+# adjusted in the same transaction as the rows they count: ORM writes are picked up from each
+# flush, and Core statements that bypass the unit of work call record() themselves. Offers also
+# get a per-status counter, e.g. "meal_offers.active".
+#
+# Each counter is split over SUMMARY_COUNTER_SHARDS rows ("messages", "messages#1", ...) that
+# are summed on read. A transaction adds its deltas to one shard picked at random, so concurrent
+# writers to the same table rarely wait on each other's row lock.
+#
+# The summary ETag is a hash of the stored counters, including CHANGES, which every recorded
+# change increments. An unchanged poll costs one read of the (small) counters table, and the
+# ETag moves with writes from any worker or from the CLI.
+SUMMARY_COUNTER_SHARDS = max(1, int(os.getenv("SUMMARY_COUNTER_SHARDS", "8")))
+CHANGES = "summary.changes"
+
+TRACKED = {
+    User: "users",
+    MealOffer: "meal_offers",
+    ItemOffer: "item_offers",
+    Transaction: "transactions",
+    Message: "messages",
+    Comment: "comments",
+    MealPrice: "meal_prices",
+    UsageAdjustment: "usage_adjustments",
+    Activity: "activities",
+}
+WITH_STATUS = (MealOffer, ItemOffer)
+
+def counter_names() -> list:
+    names = list(TRACKED.values())
+    for model in WITH_STATUS:
+        names += [f"{TRACKED[model]}.{s.value}" for s in OfferStatus]
+    return names
+
+def _upsert(session, values: dict, add: bool):
+    # Sorted so concurrent writers take the counter row locks in the same order
+    stmt = dialect_insert(session.get_bind())(Counter.__table__).values([{"name": k, "value": v} for k, v in sorted(values.items())])
+    value = Counter.__table__.c.value + stmt.excluded.value if add else stmt.excluded.value
+    return stmt.on_conflict_do_update(index_elements=["name"], set_={"value": value})
+
+def _shard_name(name: str, shard: int) -> str:
+    return name if shard == 0 else f"{name}#{shard}"
+
+def record(session, deltas: dict):
+    """Apply counter deltas inside the session's current transaction."""
+    deltas = {k: v for k, v in deltas.items() if v}
+    if deltas:
+        deltas[CHANGES] = 1
+        # One shard for the whole transaction, so it never holds locks on two shards of a counter
+        shard = session.info.setdefault("summary_shard", random.randrange(SUMMARY_COUNTER_SHARDS))
+        session.connection().execute(_upsert(session, {_shard_name(k, shard): v for k, v in deltas.items()}, add=True))
+
+def _status(obj) -> str:
+    status = obj.status or OfferStatus.active
+    return status.value if isinstance(status, OfferStatus) else status
+
+@event.listens_for(Session, "after_flush")
+def _count_flushed_rows(session, flush_context):
+    deltas = {}
+    def add(name, n):
+        deltas[name] = deltas.get(name, 0) + n
+    for objs, sign in ((session.new, 1), (session.deleted, -1)):
+        for obj in objs:
+            name = TRACKED.get(type(obj))
+            if name:
+                add(name, sign)
+                if isinstance(obj, WITH_STATUS):
+                    add(f"{name}.{_status(obj)}", sign)
+    for obj in session.dirty:
+        if isinstance(obj, WITH_STATUS):
+            hist = inspect(obj).attrs.status.history
+            if hist.added and hist.deleted:
+                name = TRACKED[type(obj)]
+                add(f"{name}.{hist.deleted[0].value}", -1)
+                add(f"{name}.{hist.added[0].value}", 1)
+    if deltas:
+        record(session, deltas)
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _new_shard(session):
+    session.info.pop("summary_shard", None)
+
+# limit -> (etag, body) of the last summary built in this worker
+bodies = {}
+
+def stored(session) -> dict:
+    """Every counter, summed over its shards."""
+    out = {}
+    for name, value in session.execute(select(Counter.name, Counter.value)):
+        name = name.partition("#")[0]
+        out[name] = out.get(name, 0) + value
+    return out
+
+def etag(values: dict, limit: int) -> str:
+    digest = hashlib.sha1(repr(sorted(values.items())).encode()).hexdigest()[:16]
+    return f'"{digest}-{limit}"'
+
+def counts(session, values: dict | None = None) -> dict:
+    have = stored(session) if values is None else values
+    return {name: have.get(name, 0) for name in counter_names()}
+
+def latest(session, limit: int) -> dict:
+    """The newest `limit` rows of each admin table, with user ids resolved to emails."""
+    buyer = aliased(User)
+    def rows(q):
+        return [dict(r._mapping) for r in session.execute(q.limit(limit))]
+    return {
+        "users": rows(select(User.id, User.email, User.university, User.total_meals, User.meal_distribution,
+                             User.weekly_meals, User.expires_on, User.created_at).order_by(User.id.desc())),
+        "meal_offers": rows(select(MealOffer.id, User.email.label("seller"), MealOffer.meals, MealOffer.location,
+                                   MealOffer.meal_type, MealOffer.price, MealOffer.status, buyer.email.label("accepted_by"),
+                                   MealOffer.created_at)
+                            .join(User, MealOffer.seller_id == User.id).outerjoin(buyer, MealOffer.accepted_by_id == buyer.id)
+                            .order_by(MealOffer.id.desc())),
+        "item_offers": rows(select(ItemOffer.id, User.email.label("seller"), ItemOffer.name, ItemOffer.category,
+                                   ItemOffer.price, ItemOffer.baseline, ItemOffer.status, buyer.email.label("accepted_by"),
+                                   ItemOffer.created_at)
+                            .join(User, ItemOffer.seller_id == User.id).outerjoin(buyer, ItemOffer.accepted_by_id == buyer.id)
+                            .order_by(ItemOffer.id.desc())),
+        "transactions": rows(select(Transaction.id, Transaction.kind, Transaction.listing_id, User.email.label("seller"),
+                                    buyer.email.label("buyer"), Transaction.created_at)
+                             .join(User, Transaction.seller_id == User.id).join(buyer, Transaction.buyer_id == buyer.id)
+                             .order_by(Transaction.id.desc())),
+        "messages": rows(select(Message.id, Message.thread_id, Thread.kind, Thread.listing_id, User.email.label("from_email"),
+                                Message.body, Message.created_at)
+                         .join(User, Message.sender_id == User.id).join(Thread, Message.thread_id == Thread.id)
+                         .order_by(Message.id.desc())),
+        "comments": rows(select(Comment.id, User.email.label("user"), Comment.university, Comment.body, Comment.created_at)
+                         .outerjoin(User, Comment.user_id == User.id).order_by(Comment.id.desc())),
+        "meal_prices": rows(select(MealPrice.id, MealPrice.university, MealPrice.meal_type, MealPrice.price, MealPrice.created_at)
+                            .order_by(MealPrice.id.desc())),
+        "usage_adjustments": rows(select(UsageAdjustment.id, User.email.label("user"), UsageAdjustment.meals_used_delta,
+                                         UsageAdjustment.note, UsageAdjustment.at.label("created_at"))
+                                  .join(User, UsageAdjustment.user_id == User.id).order_by(UsageAdjustment.id.desc())),
+        "activities": rows(select(Activity.id, User.email.label("user"), Activity.action, Activity.details, Activity.created_at)
+                           .outerjoin(User, Activity.user_id == User.id).order_by(Activity.id.desc())),
+    }
+
+def _exact(session) -> dict:
+    out = {name: 0 for name in counter_names()}
+    for model, name in TRACKED.items():
+        if model in WITH_STATUS:
+            for status, n in session.execute(select(model.status, func.count()).group_by(model.status)):
+                out[name] += n
+                out[f"{name}.{status.value}"] = n
+        else:
+            out[name] = session.execute(select(func.count()).select_from(model)).scalar_one()
+    return out
+
+def rebuild(session) -> dict:
+    """Recount every table and overwrite the counters."""
+    exact = _exact(session)
+    # The recount goes into shard 0; other shards of the counted names are cleared
+    session.execute(delete(Counter).where(Counter.name.contains("#"), ~Counter.name.startswith(f"{CHANGES}#")))
+    session.execute(_upsert(session, exact, add=False))
+    session.execute(_upsert(session, {CHANGES: 1}, add=True))
+    session.commit()
+    return exact
+
+def ensure(session):
+    """Seed the counters on first start against an existing database."""
+    if not set(counter_names()) <= set(stored(session)):
+        rebuild(session)
+
+def check(session) -> list:
+    """Compare the counters against real row counts; returns a description of each mismatch."""
+    exact, stored = _exact(session), counts(session)
+    return [f"{name}: counter {stored[name]}, actual {n}" for name, n in exact.items() if stored[name] != n]
+
+if __name__ == "__main__":
+    from db import SessionLocal, sync_schema
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd not in ("rebuild", "check"):
+        sys.exit("usage: python summary.py rebuild|check")
+    sync_schema()
+    s = SessionLocal()
+    try:
+        if cmd == "rebuild":
+            print(f"Rebuilt {len(rebuild(s))} summary counters")
+        else:
+            problems = check(s)
+            for p in problems:
+                print(p)
+            print("Summary counters consistent" if not problems else f"{len(problems)} mismatched counters")
+            sys.exit(1 if problems else 0)
+    finally:
+        s.close()
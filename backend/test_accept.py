@@ -0,0 +1,26 @@
+import sqlite3
+from bench.accept_rush import create_offers, rush
+from bench.login_storm import signup_and_login
+from bench.server import UNLIMITED, Server
+
+def test_concurrent_accepts_have_one_winner():
+    with Server(env={"BCRYPT_ROUNDS": "4", "HASH_WORKERS": "0", **UNLIMITED}) as srv:
+        seller = signup_and_login(srv.base, "seller@bench.edu")
+        buyers = [signup_and_login(srv.base, f"buyer{i}@bench.edu") for i in range(10)]
+        offers = create_offers(srv.base, seller, 2)
+        runs = [rush(srv.base, buyers, kind, offer_id, 300) for kind, offer_id in offers]
+
+        for run in runs:
+            assert run["winners"] == 1, run
+            assert run["rejected"] == 299, run
+            assert run["errors"] == 0, run
+
+        con = sqlite3.connect(srv.db_path)
+        for kind, offer_id in offers:
+            for table in ("transactions", "threads"):
+                (n,) = con.execute(f"SELECT count(*) FROM {table} WHERE kind=? AND listing_id=?", (kind, offer_id)).fetchone()
+                assert n == 1, (table, kind, n)
+            (n,) = con.execute("SELECT count(*) FROM messages JOIN threads ON threads.id = messages.thread_id "
+                               "WHERE kind=? AND listing_id=?", (kind, offer_id)).fetchone()
+            assert n == 1
+        con.close()
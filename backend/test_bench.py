@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+from bench.server import BACKEND_DIR
+
+LIST_ROUTES = ("import app; print('\\n'.join(f'{m} {r.path}' for r in app.app.routes "
+               "for m in getattr(r, 'methods', ()) if m != 'HEAD'))")
+DOCS = ("/openapi.json", "/docs", "/docs/oauth2-redirect", "/redoc")
+
+def test_suite_drives_every_route(tmp_path):
+    out = tmp_path / "run.json"
+    env = {**os.environ, "BCRYPT_ROUNDS": "4", "HASH_WORKERS": "0"}
+    subprocess.run([sys.executable, "-m", "bench.suite", "--scale", "0.001", "--requests", "10", "--out", str(out)],
+                   cwd=BACKEND_DIR, env=env, check=True, capture_output=True)
+    result = json.loads(out.read_text())
+    routes = result["routes"]
+
+    listed = subprocess.run([sys.executable, "-c", LIST_ROUTES], cwd=BACKEND_DIR, env=env, check=True,
+                            capture_output=True, text=True).stdout.splitlines()
+    covered = {name.split("?")[0] for name in routes}
+    missing = [r for r in listed if r.split(" ", 1)[1] not in DOCS and r not in covered]
+    assert not missing, missing
+    for name, r in routes.items():
+        assert set(r["status"]) == {"200"}, (name, r["status"])
+        assert r["n"] >= 2 and r["p50_ms"] <= r["p99_ms"]
+    assert routes["GET /offers/meals"]["queries_mean"] >= 1
+    assert result["meta"]["rows"]["messages"] >= 1000
+
+def test_fast_list_responses_match_response_model(tmp_path):
+    # bench.serialize fails if the column + orjson bodies decode differently from the validated ones
+    out = tmp_path / "serialize.json"
+    subprocess.run([sys.executable, "-m", "bench.serialize", "--rows", "100", "--repeat", "2", "--out", str(out)],
+                   cwd=BACKEND_DIR, check=True, capture_output=True)
+    result = json.loads(out.read_text())
+    assert set(result) == {"GET /offers/meals", "GET /offers/items", "GET /admin/offers/meals"}
+    for route, r in result.items():
+        assert r["n"] == 100, route
+        assert {"orm", "rows"} <= set(r), route
@@ -0,0 +1,115 @@
+from datetime import date, datetime, timedelta, timezone
+import pytest
+from sqlalchemy import create_engine, func, select, update
+from sqlalchemy.orm import sessionmaker
+from bench.login_storm import signup_and_login
+from bench.server import UNLIMITED, Server, call
+from db import Base
+from models import (User, MealOffer, ItemOffer, OfferStatus, Transaction, Thread, Message,
+                    meal_offers_archive, threads_archive, messages_archive, transactions_archive)
+import expiry
+import search
+import summary
+
+NOW = datetime.now(timezone.utc)
+TODAY = NOW.date()
+
+def days_ago(n: float) -> datetime:
+    return NOW - timedelta(days=n)
+
+def sessions(db_path: str):
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(engine)
+    search.ensure_index(engine)
+    return sessionmaker(bind=engine, autoflush=False)
+
+@pytest.fixture
+def Session(tmp_path):
+    return sessions(str(tmp_path / "expiry.db"))
+
+def user(session, email: str, expires_on: date) -> User:
+    u = User(email=email, password_hash="x", university="Expiry U", total_meals=100, expires_on=expires_on)
+    session.add(u)
+    session.flush()
+    return u
+
+def meal(session, seller: User, created_at: datetime) -> MealOffer:
+    o = MealOffer(seller_id=seller.id, university=seller.university, meals=1, location="Hall", price=5, created_at=created_at)
+    session.add(o)
+    session.flush()
+    return o
+
+def test_offers_expire_when_the_plan_ends_or_the_ttl_passes(Session):
+    with Session() as s:
+        ended = user(s, "ended@x.edu", TODAY - timedelta(days=1))
+        current = user(s, "current@x.edu", TODAY + timedelta(days=30))
+        plan_over = meal(s, ended, days_ago(1)).id
+        too_old = meal(s, current, days_ago(expiry.MEAL_OFFER_TTL_DAYS + 1)).id
+        fresh = meal(s, current, days_ago(1)).id
+        item = ItemOffer(seller_id=current.id, university=current.university, name="Lamp", category="Home", price=10,
+                         created_at=days_ago(expiry.MEAL_OFFER_TTL_DAYS + 1))
+        s.add(item)
+        s.commit()
+        item_id = item.id
+        summary.rebuild(s)
+
+    with Session() as s:
+        assert expiry.expire_batch(s, MealOffer, NOW, TODAY) == 2
+    with Session() as s:
+        assert expiry.expire_batch(s, ItemOffer, NOW, TODAY) == 0
+    with Session() as s:
+        status = dict(s.execute(select(MealOffer.id, MealOffer.status)).all())
+        assert status == {plan_over: OfferStatus.expired, too_old: OfferStatus.expired, fresh: OfferStatus.active}
+        assert s.get(ItemOffer, item_id).status == OfferStatus.active
+        assert summary.check(s) == []
+
+def test_open_threads_keep_their_offers_out_of_the_archive(tmp_path):
+    db_path = str(tmp_path / "server.db")
+    env = {"BCRYPT_ROUNDS": "4", "HASH_WORKERS": "0", "EXPIRY_INTERVAL": "0", **UNLIMITED}
+    with Server(env=env, db_path=db_path) as srv:
+        seller = signup_and_login(srv.base, "seller@bench.edu")
+        buyer = signup_and_login(srv.base, "buyer@bench.edu")
+        status, offer, _ = call(srv.base, "POST", "/offers/meals", {"meals": 1, "location": "Hall", "price": 5, "meal_type": "lunch"}, token=seller)
+        assert status == 200
+        status, _, _ = call(srv.base, "POST", f"/offers/meals/{offer['id']}/accept", {"message": "mine"}, token=buyer)
+        assert status == 200
+        Session = sessions(db_path)
+        with Session() as s:
+            thread_id = s.execute(select(Thread.id).where(Thread.listing_id == offer["id"])).scalar_one()
+
+        def backdate():
+            with Session() as s:
+                s.execute(update(MealOffer).values(created_at=days_ago(expiry.ARCHIVE_AFTER_DAYS + 5)))
+                s.execute(update(Thread).values(created_at=days_ago(expiry.ARCHIVE_AFTER_DAYS + 5)))
+                s.execute(update(Message).values(created_at=days_ago(expiry.ARCHIVE_AFTER_DAYS + 5)))
+                s.commit()
+
+        # The thread is still open, so the accepted offer stays put
+        backdate()
+        with Session() as s:
+            assert expiry.archive_batch(s, MealOffer, NOW) == 0
+        # A quiet thread is closed, and a new message opens it again
+        with Session() as s:
+            assert expiry.close_batch(s, NOW) == 1
+        with Session() as s:
+            assert s.get(Thread, thread_id).open is False
+        status, _, _ = call(srv.base, "POST", f"/inbox/threads/{thread_id}/messages", {"body": "still there?"}, token=seller)
+        assert status == 200
+        with Session() as s:
+            assert s.get(Thread, thread_id).open is True
+            # The new message keeps it open through the next sweep
+            assert expiry.close_batch(s, NOW) == 0
+        with Session() as s:
+            assert expiry.archive_batch(s, MealOffer, NOW) == 0
+
+        # Once it goes quiet again the offer moves to the archive with its thread, messages and transaction
+        backdate()
+        with Session() as s:
+            assert expiry.close_batch(s, NOW) == 1
+        with Session() as s:
+            assert expiry.archive_batch(s, MealOffer, NOW) == 1
+        with Session() as s:
+            count = lambda t: s.execute(select(func.count()).select_from(t)).scalar_one()
+            assert [count(t) for t in (MealOffer, Thread, Message, Transaction)] == [0, 0, 0, 0]
+            assert [count(t) for t in (meal_offers_archive, threads_archive, messages_archive, transactions_archive)] == [1, 1, 2, 1]
+            assert summary.check(s) == []
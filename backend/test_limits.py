@@ -0,0 +1,102 @@
+import json
+import urllib.error
+import urllib.request
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+from bench.login_storm import signup_and_login
+from bench.server import UNLIMITED, Server
+import limits
+from limits import AdmissionMiddleware, RateLimited, TokenBucketLimiter
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+def test_token_bucket_allows_a_burst_then_refills():
+    clock = Clock()
+    bucket = TokenBucketLimiter("test_bucket", rate=2, burst=3, clock=clock)
+    assert set(limits.limiters) == {"user_writes", "ip_writes"}  # standalone, never reported in /metrics
+    assert [bucket.take("u1") for _ in range(3)] == [0, 0, 0]
+    assert bucket.take("u1") == 0.5
+    assert bucket.take("u2") == 0  # keys have their own buckets
+    clock.now += 0.5
+    assert bucket.take("u1") == 0
+    with pytest.raises(RateLimited) as e:
+        bucket.check("u1")
+    assert e.value.retry_after == 0.5
+    assert bucket.limited == 2
+    clock.now += 60
+    assert [bucket.take("u1") for _ in range(3)] == [0, 0, 0]  # refills only up to the burst
+    assert bucket.take("u1") > 0
+    bucket.refund("u1")
+    assert bucket.take("u1") == 0
+
+def test_zero_rate_turns_the_limit_off():
+    bucket = TokenBucketLimiter("test_off", rate=0, burst=1)
+    assert all(bucket.take("u") == 0 for _ in range(100))
+
+def test_client_ip_trusts_only_the_configured_proxy_hops(monkeypatch):
+    def request(forwarded=None):
+        headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+        return Request({"type": "http", "headers": headers, "client": ("10.0.0.1", 4000)})
+
+    assert limits.client_ip(request("6.6.6.6, 1.2.3.4")) == "10.0.0.1"
+    monkeypatch.setattr(limits, "TRUSTED_PROXY_HOPS", 1)
+    assert limits.client_ip(request("6.6.6.6, 1.2.3.4")) == "1.2.3.4"  # the left entry is the client's to forge
+    assert limits.client_ip(request()) == "10.0.0.1"
+    monkeypatch.setattr(limits, "TRUSTED_PROXY_HOPS", 2)
+    assert limits.client_ip(request("6.6.6.6, 1.2.3.4, 10.0.0.9")) == "1.2.3.4"
+
+def test_admission_sheds_when_the_pool_queue_is_deep(monkeypatch):
+    app = Starlette(routes=[Route("/x", lambda r: PlainTextResponse("ok"), methods=["GET", "POST"]),
+                            Route("/metrics", lambda r: PlainTextResponse("ok"))])
+    app.add_middleware(AdmissionMiddleware)
+    monkeypatch.setattr(limits, "ADMISSION_MAX_WAITING", 8)
+    monkeypatch.setattr(limits, "ADMISSION_MAX_WAITING_WRITES", 4)
+    monkeypatch.setattr(limits, "shed", {"read": 0, "write": 0})
+    client = TestClient(app)
+
+    monkeypatch.setattr(limits.pool_waits, "waiting", 5)
+    assert client.get("/x").status_code == 200
+    r = client.post("/x")
+    assert r.status_code == 503 and r.headers["Retry-After"] == str(limits.ADMISSION_RETRY_AFTER)
+
+    monkeypatch.setattr(limits.pool_waits, "waiting", 8)
+    assert client.get("/x").status_code == 503
+    assert client.get("/metrics").status_code == 200  # never shed
+    assert limits.shed == {"read": 1, "write": 1}
+
+def test_write_routes_answer_429_with_retry_after():
+    # One IP (this test) with room for two signups and three offers; two offers per user
+    env = {"BCRYPT_ROUNDS": "4", "HASH_WORKERS": "0", "EXPIRY_INTERVAL": "0", **UNLIMITED,
+           "WRITE_RATE_PER_USER": "0.01", "WRITE_BURST_PER_USER": "2",
+           "WRITE_RATE_PER_IP": "0.01", "WRITE_BURST_PER_IP": "5"}
+    with Server(env=env) as srv:
+        first = signup_and_login(srv.base, "first@bench.edu")
+        second = signup_and_login(srv.base, "second@bench.edu")
+
+        def post(token):
+            body = json.dumps({"meals": 1, "location": "Hall", "price": 5, "meal_type": "lunch"}).encode()
+            req = urllib.request.Request(srv.base + "/offers/meals", data=body, method="POST",
+                                         headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+            try:
+                with urllib.request.urlopen(req, timeout=30) as r:
+                    return r.status, r.headers
+            except urllib.error.HTTPError as e:
+                return e.code, e.headers
+
+        assert [post(first)[0] for _ in range(2)] == [200, 200]
+        status, headers = post(first)
+        assert status == 429
+        assert int(headers["Retry-After"]) >= 1
+        # Refused for the user's own limit, so these do not use up the shared IP bucket
+        assert [post(first)[0] for _ in range(5)] == [429] * 5
+        assert post(second)[0] == 200
+        assert post(second)[0] == 429  # now the IP bucket is empty
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import time
+import pytest
+from pubsub import InProcessBroker, UnixSocketBroker
+from ws import Hub
+
+MESSAGES = 500
+
+def _subscriber(directory, ready, results):
+    got = []
+    broker = UnixSocketBroker(directory)
+    broker.attach(lambda room, text: got.append((room, json.loads(text), time.time())))
+    broker.start()
+    ready.set()
+    deadline = time.time() + 10
+    while len(got) < MESSAGES and time.time() < deadline:
+        time.sleep(0.01)
+    results.put([(room, msg["seq"], at - msg["sent"]) for room, msg, at in got])
+    broker.close()
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        pass
+
+def test_in_process_hub_delivers_to_sockets_in_the_room():
+    async def scenario():
+        hub = Hub(broker=InProcessBroker())
+        a, b = FakeSocket(), FakeSocket()
+        conn_a = await hub.join("campus:A", a)
+        await hub.join("campus:B", b)
+        hub.publish("campus:A", {"seq": 1})
+        for _ in range(100):
+            if a.sent:
+                break
+            await asyncio.sleep(0.01)
+        hub.leave("campus:A", conn_a)
+        hub.publish("campus:A", {"seq": 2})
+        await asyncio.sleep(0.05)
+        return a.sent, b.sent, hub.room_sizes()
+    a_sent, b_sent, rooms = asyncio.run(scenario())
+    assert a_sent == ['{"seq": 1}']
+    assert b_sent == []
+    assert rooms == {"campus:B": 1}
+
+def test_unix_broker_order_and_latency_across_workers(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    directory = str(tmp_path)
+    results = ctx.Queue()
+    procs = []
+    for _ in range(3):
+        ready = ctx.Event()
+        p = ctx.Process(target=_subscriber, args=(directory, ready, results))
+        p.start()
+        assert ready.wait(10)
+        procs.append(p)
+
+    local = []
+    pub = UnixSocketBroker(directory, name="publisher")
+    pub.attach(lambda room, text: local.append(json.loads(text)["seq"]))
+    for seq in range(MESSAGES):
+        pub.publish("campus:A", json.dumps({"seq": seq, "sent": time.time()}))
+
+    assert pub.flush(15)
+    reports = [results.get(timeout=15) for _ in procs]
+    for p in procs:
+        p.join(5)
+    pub.close()
+
+    assert local == list(range(MESSAGES))
+    # Delivery is best effort, so a loaded machine may drop some; whatever arrives is in order
+    assert pub.sent + pub.dropped == MESSAGES * len(procs)
+    for report in reports:
+        seqs = [seq for _, seq, _ in report]
+        assert seqs and seqs == sorted(set(seqs))
+        assert {room for room, _, _ in report} == {"campus:A"}
+        # Generous, for loaded CI machines; a healthy host delivers in well under 10 ms
+        latencies = sorted(latency for _, _, latency in report)
+        assert latencies[int(0.99 * (len(latencies) - 1))] < 1.0
+        assert latencies[-1] < 5.0
+
+def test_unix_broker_forgets_dead_workers(tmp_path):
+    # A worker that died without cleaning up leaves its bound path with nobody listening
+    gone = str(tmp_path / "gone.sock")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(gone)
+    sock.close()
+    pub = UnixSocketBroker(str(tmp_path), name="publisher")
+    pub.publish("campus:A", "{}")
+    assert pub.flush()
+    assert not os.path.exists(gone)
+    pub.close()
+
+def test_unix_broker_refuses_a_shared_directory(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    with pytest.raises(PermissionError):
+        UnixSocketBroker(str(shared)).start()
+    private = tmp_path / "private"
+    broker = UnixSocketBroker(str(private))
+    broker.start()
+    assert private.stat().st_mode & 0o777 == 0o700
+    broker.close()
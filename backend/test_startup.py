@@ -0,0 +1,24 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from bench.server import BACKEND_DIR
+from bench.startup import BASELINE, measure, regressions
+
+# Imported on first use (see auth.py), so a cold start never pays for them
+DEFERRED = ["passlib", "jose", "PIL"]
+
+def test_heavy_modules_are_not_imported_at_startup(tmp_path):
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{tmp_path / 'startup.db'}", "STARTUP_MIGRATE": "0"}
+    snippet = f"import sys, app; print([m for m in {DEFERRED!r} if m in sys.modules])"
+    out = subprocess.run([sys.executable, "-c", snippet], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+    assert out.stdout.strip().splitlines()[-1] == "[]"
+
+# Wall-clock numbers depend on the machine, so the timing comparison only runs on request
+@pytest.mark.skipif(os.getenv("RUN_BENCH") != "1", reason="set RUN_BENCH=1 to compare against the startup baseline")
+def test_cold_start_has_not_regressed():
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    result = measure(runs=3)
+    assert not regressions(result, baseline), (result, baseline)
@@ -0,0 +1,104 @@
+import sys
+from datetime import date, datetime, timedelta
+from sqlalchemy import delete
+from db import dialect_insert
+from models import UsageAdjustment, UsageWeek, UsageTotal
+
+# Rollups of UsageAdjustment so /stats reads a couple of rows instead of a user's history.
+# `used` counts meals consumed (the negated sum of negative deltas); `net_delta` is the
+# plain sum of deltas, which the semester calculation adds to its pro-rata estimate.
+
+def week_start(d: date) -> date:
+    """Monday of the ISO week containing `d`."""
+    return d - timedelta(days=d.weekday())
+
+def _upsert(session, model, rows: list):
+    # One multi-row statement per table; rows must have distinct keys
+    stmt = dialect_insert(session.get_bind())(model).values(rows)
+    keys = [c.name for c in model.__table__.primary_key]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={
+            "used": model.used + stmt.excluded.used,
+            "net_delta": model.net_delta + stmt.excluded.net_delta,
+            "entries": model.entries + stmt.excluded.entries,
+        },
+    )
+    session.execute(stmt)
+
+def bump(session, user_id: int, at: datetime, deltas: list):
+    """Fold adjustments recorded at `at` into the rollups. Runs inside the caller's transaction."""
+    bump_many(session, user_id, [(at, d) for d in deltas])
+
+def bump_many(session, user_id: int, adjustments: list):
+    """Fold (at, delta) pairs into the rollups with one upsert per table, however many weeks they span."""
+    if not adjustments:
+        return
+    weeks = {}
+    for at, delta in adjustments:
+        ws = week_start(at.date())
+        u, n, c = weeks.get(ws, (0, 0, 0))
+        weeks[ws] = (u + (-delta if delta < 0 else 0), n + delta, c + 1)
+    _upsert(session, UsageWeek, [{"user_id": user_id, "week_start": ws, "used": u, "net_delta": n, "entries": c}
+                                 for ws, (u, n, c) in sorted(weeks.items())])
+    _upsert(session, UsageTotal, [{"user_id": user_id, "used": sum(u for u, _, _ in weeks.values()),
+                                   "net_delta": sum(n for _, n, _ in weeks.values()), "entries": len(adjustments)}])
+
+def _aggregate(session):
+    weeks, totals = {}, {}
+    rows = (session.query(UsageAdjustment.user_id, UsageAdjustment.at, UsageAdjustment.meals_used_delta)
+            .execution_options(yield_per=5000))
+    for uid, at, delta in rows:
+        used = -delta if delta < 0 else 0
+        for acc, key in ((weeks, (uid, week_start(at.date()))), (totals, uid)):
+            u, n, c = acc.get(key, (0, 0, 0))
+            acc[key] = (u + used, n + delta, c + 1)
+    return weeks, totals
+
+def rebuild(session) -> int:
+    """Recompute every rollup from the raw adjustments; returns the number of week rows written."""
+    weeks, totals = _aggregate(session)
+    session.execute(delete(UsageWeek))
+    session.execute(delete(UsageTotal))
+    session.add_all(UsageWeek(user_id=uid, week_start=ws, used=u, net_delta=n, entries=c)
+                    for (uid, ws), (u, n, c) in weeks.items())
+    session.add_all(UsageTotal(user_id=uid, used=u, net_delta=n, entries=c)
+                    for uid, (u, n, c) in totals.items())
+    session.commit()
+    return len(weeks)
+
+def ensure(session):
+    """Seed the rollups on first start against an existing database."""
+    if session.query(UsageTotal.user_id).first() is None and session.query(UsageAdjustment.id).first() is not None:
+        rebuild(session)
+
+def check(session) -> list:
+    """Compare rollups against the raw adjustments; returns a description of each mismatch."""
+    weeks, totals = _aggregate(session)
+    stored_weeks = {(r.user_id, r.week_start): (r.used, r.net_delta, r.entries) for r in session.query(UsageWeek)}
+    stored_totals = {r.user_id: (r.used, r.net_delta, r.entries) for r in session.query(UsageTotal)}
+    problems = []
+    for name, want, have in (("week", weeks, stored_weeks), ("total", totals, stored_totals)):
+        for key in sorted(set(want) | set(have), key=str):
+            if want.get(key, (0, 0, 0)) != have.get(key, (0, 0, 0)):
+                problems.append(f"{name} {key}: expected {want.get(key)}, rollup has {have.get(key)}")
+    return problems
+
+if __name__ == "__main__":
+    from db import SessionLocal, sync_schema
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd not in ("rebuild", "check"):
+        sys.exit("usage: python usage.py rebuild|check")
+    sync_schema()
+    s = SessionLocal()
+    try:
+        if cmd == "rebuild":
+            print(f"Rebuilt {rebuild(s)} weekly usage rollups")
+        else:
+            problems = check(s)
+            for p in problems:
+                print(p)
+            print("Usage rollups consistent" if not problems else f"{len(problems)} mismatched rollups")
+            sys.exit(1 if problems else 0)
+    finally:
+        s.close()
@@ -1,30 +1,125 @@
+import asyncio
+import json
+import os
+import threading
 from typing import Dict, Set
 from fastapi import WebSocket
+from pubsub import make_broker
+
+# Each socket gets a bounded outbound queue drained by its own task, so a broadcast only
+# enqueues and one slow client can never stall delivery to the rest of its room. A client
+# that falls WS_SEND_QUEUE messages behind, or whose send blocks for WS_SEND_TIMEOUT
+# seconds, is disconnected and is expected to reconnect and refetch.
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "64"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+def campus_room(university: str) -> str:
+    return f"campus:{university}"
+
+class Conn:
+    def __init__(self, ws: WebSocket, maxsize: int):
+        self.ws = ws
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.task: asyncio.Task | None = None
+        self.closed = False
+
+    def offer(self, hub: "Hub", room: str, text: str):
+        # Runs on the connection's own loop
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            asyncio.ensure_future(hub.drop(room, self))
+
+    async def drain(self, hub: "Hub", room: str):
+        try:
+            while True:
+                text = await self.queue.get()
+                await asyncio.wait_for(self.ws.send_text(text), WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await hub.drop(room, self, code=1011)
 
 class Hub:
-    def __init__(self):
-        self.rooms: Dict[str, Set[WebSocket]] = {}
+    def __init__(self, send_queue: int = WS_SEND_QUEUE, broker=None):
+        self.rooms: Dict[str, Set[Conn]] = {}
+        self.send_queue = send_queue
+        self.dropped = 0
+        # Publishers may run on worker threads, so room membership is guarded by a lock
+        self._lock = threading.Lock()
+        # Publishes go through the broker so that sockets held by other workers hear them too
+        self.broker = broker or make_broker()
+        self.broker.attach(self.deliver)
+        self.listeners: Dict[str, list] = {}
 
-    async def join(self, room: str, ws: WebSocket):
+    async def join(self, room: str, ws: WebSocket) -> Conn:
+        self.broker.start()
         await ws.accept()
-        self.rooms.setdefault(room, set()).add(ws)
+        conn = Conn(ws, self.send_queue)
+        conn.task = asyncio.create_task(conn.drain(self, room))
+        with self._lock:
+            self.rooms.setdefault(room, set()).add(conn)
+        return conn
 
-    def leave(self, room: str, ws: WebSocket):
-        if room in self.rooms and ws in self.rooms[room]:
-            self.rooms[room].remove(ws)
-            if not self.rooms[room]:
-                del self.rooms[room]
+    def leave(self, room: str, conn: Conn):
+        conn.closed = True
+        if conn.task and conn.task is not asyncio.current_task():
+            conn.task.cancel()
+        with self._lock:
+            if room in self.rooms and conn in self.rooms[room]:
+                self.rooms[room].remove(conn)
+                if not self.rooms[room]:
+                    del self.rooms[room]
 
-    async def broadcast(self, room: str, msg: dict):
-        if room not in self.rooms:
+    async def drop(self, room: str, conn: Conn, code: int = 1013):
+        """Disconnect a client that cannot keep up (1013: try again later)."""
+        if conn.closed:
             return
-        dead = []
-        for ws in list(self.rooms[room]):
-            try:
-                await ws.send_json(msg)
-            except Exception:
-                dead.append(ws)
-        for ws in dead:
-            self.leave(room, ws)
+        self.dropped += 1
+        self.leave(room, conn)
+        try:
+            await conn.ws.close(code=code)
+        except Exception:
+            pass
+
+    def publish(self, room: str, msg: dict):
+        """Send `msg` to `room` in every worker. Safe to call from sync endpoints' worker threads."""
+        self.broker.publish(room, json.dumps(msg))
+
+    def on(self, room: str, fn):
+        """Also call `fn(text)` in this process for every message published to `room`."""
+        self.listeners.setdefault(room, []).append(fn)
+        self.broker.start()
+
+    def deliver(self, room: str, text: str):
+        """Queue an already-encoded message for this worker's sockets in `room`."""
+        for fn in self.listeners.get(room, ()):
+            fn(text)
+        with self._lock:
+            conns = list(self.rooms.get(room, ()))
+        if not conns:
+            return
+        current = _running_loop()
+        for conn in conns:
+            if conn.loop is current:
+                conn.offer(self, room, text)
+            elif not conn.loop.is_closed():
+                conn.loop.call_soon_threadsafe(conn.offer, self, room, text)
+
+    async def broadcast(self, room: str, msg: dict):
+        self.publish(room, msg)
+
+    def room_sizes(self) -> Dict[str, int]:
+        with self._lock:
+            return {room: len(conns) for room, conns in self.rooms.items()}
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
 
 hub = Hub()
@@ -89,8 +89,8 @@ document.addEventListener('DOMContentLoaded', () => {
   const weeklyMeals = Number(currentUser.weeklyMeals || 0);
   const termDays = 112;
 
-  // Map of meal type to base price for the current university. Populated asynchronously via loadMealPrices().
-  const mealPriceMap = {};
+  // Average per-meal savings for the current university, computed by the backend. Populated asynchronously via loadSavings().
+  let avgSavings = 0;
 
   /**
    * Synchronize any locally stored meal or item offers to the backend.
@@ -173,39 +173,25 @@ document.addEventListener('DOMContentLoaded', () => {
     }
   }
 
-  async function loadMealPrices() {
+  async function loadSavings() {
     if (!currentUser.university) return;
     try {
-      // Use the API_BASE so this call goes to the backend service instead of the static server
-      const resp = await fetch(`${API_BASE}/mealprices?university=${encodeURIComponent(currentUser.university)}`);
+      // The backend prices every campus offer against its meal prices in one pass
+      const resp = await fetch(`${API_BASE}/offers/meals/savings?university=${encodeURIComponent(currentUser.university)}`, {
+        headers: { Authorization: token ? ('Bearer ' + token) : '' }
+      });
       if (resp.ok) {
-        const arr = await resp.json();
-        arr.forEach(mp => { mealPriceMap[mp.meal_type] = mp.price; });
-        // Once prices are loaded, recompute average recovered to update UI
+        const summary = await resp.json();
+        avgSavings = summary.avg_savings_per_meal || 0;
         computeAvgRecovered();
       }
     } catch (e) {
-      console.error('Failed loading meal prices', e);
+      console.error('Failed loading meal savings', e);
     }
   }
 
   function computeAvgRecovered() {
-    // Compute average savings per meal across all local meal offers using base price definitions
-    const uniKey = currentUser.university || 'GLOBAL';
-    const mKey = `mpa_meal_offers_${uniKey}`;
-    const list = JSON.parse(localStorage.getItem(mKey) || '[]');
-    let totalDiff = 0;
-    let totalMealsCount = 0;
-    list.forEach(o => {
-      const base = mealPriceMap[o.meal_type];
-      if (!base) return;
-      const diff = base - o.price;
-      if (diff > 0) {
-        totalDiff += diff * (o.meals || 1);
-        totalMealsCount += (o.meals || 1);
-      }
-    });
-    const avg = totalMealsCount > 0 ? (totalDiff / totalMealsCount) : 0;
+    const avg = avgSavings;
     const wasteSummaryEl = document.getElementById('wasteSummary');
     if (wasteSummaryEl) {
       // The wasteSummary text may already include the waste percentage. We'll append savings separated by " | ".
@@ -573,6 +559,35 @@ document.addEventListener('DOMContentLoaded', () => {
     });
   }
 
+  // Usage adjustments are queued in localStorage and sent as one batch, so entries recorded
+  // offline (or lost to the reload below) go up together later. Each carries a key, which makes
+  // resending a batch harmless.
+  const usageQueueKey = `mpa_usage_queue_${email}`;
+  function queueUsage(delta, note) {
+    const queue = readJSON(usageQueueKey, []);
+    const key = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    queue.push({ key, meals_used_delta: delta, note, at: new Date().toISOString() });
+    writeJSON(usageQueueKey, queue);
+  }
+  async function flushUsageQueue() {
+    const queue = readJSON(usageQueueKey, []).slice(0, 500);
+    if (!queue.length || !token) return;
+    try {
+      const resp = await fetch(`${API_BASE}/usage/adjust/batch`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', Authorization: 'Bearer ' + token },
+        body: JSON.stringify({ adjustments: queue })
+      });
+      if (!resp.ok) return;
+      const sent = new Set(queue.map(a => a.key));
+      writeJSON(usageQueueKey, readJSON(usageQueueKey, []).filter(a => !sent.has(a.key)));
+    } catch (err) {
+      // offline; retried on the next load or when the browser comes back online
+    }
+  }
+  flushUsageQueue();
+  window.addEventListener('online', flushUsageQueue);
+
   // Daily usage recording
   const dailyUsageForm = document.getElementById('dailyUsageForm');
   const dailyMealsInput = document.getElementById('dailyMealsUsed');
@@ -585,20 +600,9 @@ document.addEventListener('DOMContentLoaded', () => {
       const logs = readJSON(usageKey, []);
       logs.push({ ts: Date.now(), meals: n });
       writeJSON(usageKey, logs);
-      // Attempt to send to backend; ignore errors if not authenticated
-      (async () => {
-        try {
-          // Send the adjustment to the backend so it is persisted. Use the API base and
-          // include the bearer token if available. The local log is still kept for UI.
-          await fetch(`${API_BASE}/usage/adjust`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json', Authorization: token ? ('Bearer ' + token) : '' },
-            body: JSON.stringify({ meals_used_delta: -n, note: 'Recorded via dashboard' })
-          });
-        } catch (err) {
-          // silently ignore network or auth errors
-        }
-      })();
+      // Queue the adjustment for the backend; the local log is still kept for UI
+      queueUsage(-n, 'Recorded via dashboard');
+      flushUsageQueue();
       dailyMealsInput.value = '';
       // We no longer show the usage history within the KPI card, so skip rendering
       showToast('Meal usage recorded.');
@@ -739,6 +743,7 @@ document.addEventListener('DOMContentLoaded', () => {
       if (row.status === 'active') { badge.textContent = 'Active'; badge.style.background = '#1c2433'; }
       if (row.status === 'accepted') { badge.textContent = 'Taken'; badge.style.background = '#12331c'; }
       if (row.status === 'cancelled') { badge.textContent = 'Cancelled'; badge.style.background = '#331c1c'; }
+      if (row.status === 'expired') { badge.textContent = 'Expired'; badge.style.background = '#2a2a2a'; }
       left.textContent = row.label + ' ';
       left.appendChild(badge);
       const right = document.createElement('span');
@@ -834,6 +839,34 @@ document.addEventListener('DOMContentLoaded', () => {
     setThreads(threads);
   }
 
+  // Pull the other party's messages from the backend. After the first sync only messages newer
+  // than the stored cursor are fetched; our own are already stored locally by addMessage.
+  async function syncMessages(tid) {
+    const t = getThreads().find(x => x.id === tid);
+    if (!t || !t.remoteThreadId) return false;
+    try {
+      const qs = t.msgCursor ? `?after=${encodeURIComponent(t.msgCursor)}` : '';
+      const resp = await fetch(`${API_BASE}/inbox/threads/${t.remoteThreadId}/messages${qs}`, {
+        headers: { Authorization: token ? ('Bearer ' + token) : '' }
+      });
+      if (!resp.ok) return false;
+      const rows = await resp.json();
+      const threads = getThreads();
+      const cur = threads.find(x => x.id === tid);
+      if (!cur) return false;
+      const seen = new Set(cur.messages.map(m => m.remoteId).filter(Boolean));
+      const fresh = rows.filter(r => r.from_email !== email && !seen.has(r.id));
+      fresh.forEach(r => cur.messages.push({ from: r.from_email, body: r.body, ts: Date.parse(r.when), remoteId: r.id,
+        readBy: { seller: r.from_email === cur.seller, buyer: r.from_email === cur.buyer } }));
+      cur.msgCursor = resp.headers.get('X-Latest-Cursor') || cur.msgCursor;
+      setThreads(threads);
+      return fresh.length > 0;
+    } catch (err) {
+      console.warn('Failed to sync messages', err);
+      return false;
+    }
+  }
+
   function openAcceptDialog(kind, id) {
     const meals = readJSON(mealsKey, []);
     const items = readJSON(itemsKey, []);
@@ -1092,6 +1125,7 @@ document.addEventListener('DOMContentLoaded', () => {
       Array.from(threadsEl.children).forEach(n => n.classList.remove('active'));
       node.classList.add('active');
       renderMessages(tid);
+      syncMessages(tid).then(changed => { if (changed && activeId === tid) renderMessages(tid); });
     });
 
     formEl.addEventListener('submit', (e) => {
@@ -1279,7 +1313,7 @@ document.addEventListener('DOMContentLoaded', () => {
     renderMyListings(listMeals, listItems);
     ensureInboxBadge();
 
-    // After updating lists, recompute average recovered savings. This uses mealPriceMap loaded from backend.
+    // After updating lists, redraw average recovered savings. This uses avgSavings loaded from backend.
     computeAvgRecovered();
   }
 
@@ -1288,8 +1322,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
   refreshAllViews();
 
-  // Load meal price definitions for the current user's campus to compute savings. This will update the waste summary with average savings.
-  loadMealPrices();
+  // Load the current user's campus savings. This will update the waste summary with average savings.
+  loadSavings();
 });
 
 